@@ -0,0 +1,182 @@
+"""
+Benchmark do pipeline completo com provedores falsos (LLM e embeddings locais).
+
+Gera livros .docx sintéticos com um número crescente de seções e executa
+`main.run_pipeline` em um processo novo para cada tamanho, com o LLM falso
+determinístico (latência e tamanho das respostas configuráveis) e os embeddings
+por hash. Reporta o tempo total, as chamadas ao LLM, os tokens, o pico de memória
+e o tempo e as chamadas de cada etapa (conversão, mapa da estrutura, indexação,
+geração, montagem). Os caches persistentes ficam desligados, para medir o trabalho real.
+Com mais de um modo em --expansion, cada livro roda em cada modo e uma tabela compara
+as chamadas, os tokens e o tempo gastos só na expansão das seções.
+
+Uso:
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --sizes 10 100 --latency 0.5 --latency-std 0.2 --scheduler dag
+    python -m benchmarks.bench_pipeline --sizes 100 --expansion iterative single_shot
+"""
+import argparse
+import logging
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import docx
+
+SECTION_COUNTS = [10, 100, 1000]
+SECTIONS_PER_UNIT = 25
+PARAGRAPHS_PER_SECTION = 3
+# Limites de taxa do LLM falso quando --rpm/--tpm não são informados (na prática, sem limite)
+UNLIMITED = 1e12
+
+WORDS = (
+    "a célula é a unidade básica da vida e realiza processos como respiração divisão e síntese "
+    "de proteínas que dependem de energia de enzimas e de estruturas especializadas"
+).split()
+
+def make_synthetic_docx(total_sections: int, path: Path):
+    """Cria um .docx com unidades (Título 1) de SECTIONS_PER_UNIT seções (Título 2) com parágrafos."""
+    document = docx.Document()
+    for number in range(total_sections):
+        unit, section = divmod(number, SECTIONS_PER_UNIT)
+        if section == 0:
+            document.add_heading(f"Unidade {unit + 1}", level=1)
+        document.add_heading(f"{unit + 1}.{section + 1} Seção sintética {number + 1}", level=2)
+        for paragraph in range(PARAGRAPHS_PER_SECTION):
+            start = (number + paragraph) % len(WORDS)
+            words = (WORDS[start:] + WORDS[:start]) * 3
+            document.add_paragraph(" ".join(words).capitalize() + ".")
+    document.save(path)
+
+def peak_memory_mb() -> float:
+    """Pico de memória residente do processo (ru_maxrss é em KiB no Linux e em bytes no macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def configure(options: dict):
+    """Aponta o pipeline para os provedores falsos e desliga os caches e checkpoints persistentes."""
+    from config import settings
+
+    settings.LLM_PROVIDER = "fake"
+    settings.EMBEDDING_PROVIDER = "fake"
+    settings.FAKE_LLM_LATENCY_MEAN = options['latency']
+    settings.FAKE_LLM_LATENCY_STD = options['latency_std']
+    settings.FAKE_LLM_COMPLETION_TOKENS_MEAN = options['completion_tokens']
+    settings.FAKE_LLM_COMPLETION_TOKENS_STD = options['completion_tokens_std']
+    settings.LLM_DEFAULT_RATE_LIMITS = (options['rpm'] or UNLIMITED, options['tpm'] or UNLIMITED)
+    settings.LLM_EXECUTION_MODE = "interactive"
+    settings.BOOK_SCHEDULER = options['scheduler']
+    settings.SECTION_EXECUTION_MODE = options['section_mode']
+    settings.ENRICHMENT_MODE = options['enrichment']
+    settings.EXPANSION_MODE = options['expansion']
+    settings.USE_CONVERSION_CACHE = False
+    settings.USE_EMBEDDING_CACHE = False
+    settings.USE_RETRIEVAL_CACHE = False
+    settings.USE_LLM_RESPONSE_CACHE = False
+    settings.USE_CHECKPOINTS = False
+    settings.PERSIST_BOOK_INDEX = False
+
+def llm_counters() -> dict:
+    from src.utils import llm_handler
+
+    metrics = llm_handler.scheduler_metrics().values()
+    return {
+        'calls': sum(m['requests'] for m in metrics),
+        'tokens': sum(m['prompt_tokens'] + m['completion_tokens'] for m in metrics),
+    }
+
+def run_size(total_sections: int, options: dict) -> dict:
+    """Executa o pipeline num livro de `total_sections` seções (no processo atual)."""
+    logging.disable(logging.CRITICAL)
+    configure(options)
+    import main
+    from src.utils.stage_timer import set_stage_probe, stage_timings
+
+    set_stage_probe(llm_counters)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        input_path = tmp / "livro_sintetico.docx"
+        make_synthetic_docx(total_sections, input_path)
+        artifact_paths = {name: tmp / name for name in ('intermediate', 'output', 'vectorstore')}
+        for path in artifact_paths.values():
+            path.mkdir()
+
+        start = time.perf_counter()
+        output_path = main.run_pipeline(input_path, artifact_paths)
+        elapsed = time.perf_counter() - start
+        if output_path is None or not output_path.exists():
+            raise RuntimeError("O pipeline não gerou o documento final.")
+
+    # Com seções em paralelo (modo assíncrono), a sonda de uma expansão também conta as
+    # chamadas das expansões simultâneas; as do agendador, por tipo de tarefa, são exatas
+    stages, expansion = stage_timings(), main.expansion_telemetry()
+    if "expansão" in stages:
+        stages["expansão"].update({
+            'calls': expansion['calls'], 'tokens': expansion['prompt_tokens'] + expansion['completion_tokens'],
+        })
+    return {
+        'seconds': elapsed, 'peak_mb': peak_memory_mb(), **llm_counters(),
+        'stages': stages, 'expansion': expansion,
+    }
+
+def run_isolated(total_sections: int, options: dict) -> dict:
+    """Executa `run_size` num processo novo, para que o pico de memória seja só deste livro."""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_size, (total_sections, options))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline completo com provedores falsos.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=SECTION_COUNTS, help="Seções de cada livro sintético.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latência média de cada chamada ao LLM (s).")
+    parser.add_argument("--latency-std", type=float, default=0.0, help="Desvio padrão da latência (s).")
+    parser.add_argument("--completion-tokens", type=int, default=400, help="Tokens médios das respostas de texto.")
+    parser.add_argument("--completion-tokens-std", type=int, default=100, help="Desvio padrão dos tokens das respostas.")
+    parser.add_argument("--rpm", type=float, default=None, help="Requisições por minuto do LLM falso (padrão: sem limite).")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens por minuto do LLM falso (padrão: sem limite).")
+    parser.add_argument("--scheduler", choices=("loop", "dag"), default="loop", help="Agendamento do livro.")
+    parser.add_argument("--section-mode", choices=("sequential", "async"), default="sequential",
+                        help="Execução das seções de cada capítulo.")
+    parser.add_argument("--enrichment", choices=("separate", "fused"), default="separate",
+                        help="Enriquecimento dos capítulos.")
+    parser.add_argument("--expansion", nargs="+", choices=("iterative", "single_shot"), default=["iterative"],
+                        help="Modos de expansão das seções (vários: compara os modos).")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    options = {
+        'latency': args.latency, 'latency_std': args.latency_std,
+        'completion_tokens': args.completion_tokens, 'completion_tokens_std': args.completion_tokens_std,
+        'rpm': args.rpm, 'tpm': args.tpm, 'scheduler': args.scheduler, 'section_mode': args.section_mode,
+        'enrichment': args.enrichment,
+    }
+
+    print(f"{'seções':>8} {'expansão':>12} {'tempo (s)':>10} {'chamadas':>9} {'tokens':>10} {'pico (MiB)':>11}")
+    results = {}
+    for total_sections in args.sizes:
+        for mode in args.expansion:
+            results[total_sections, mode] = result = run_isolated(total_sections, {**options, 'expansion': mode})
+            print(f"{total_sections:>8} {mode:>12} {result['seconds']:>10.2f} {result['calls']:>9} "
+                  f"{result['tokens']:>10} {result['peak_mb']:>11.1f}")
+
+    # "expansão" é medida dentro de "geração"
+    for (total_sections, mode), result in results.items():
+        print(f"\nEtapas ({total_sections} seções, expansão {mode}):")
+        print(f"  {'etapa':<20} {'tempo (s)':>10} {'%':>6} {'chamadas':>9}")
+        for stage, timing in result['stages'].items():
+            share = 100 * timing['seconds'] / result['seconds'] if result['seconds'] else 0.0
+            print(f"  {stage:<20} {timing['seconds']:>10.2f} {share:>6.1f} {timing.get('calls', 0):>9.0f}")
+
+    if len(args.expansion) > 1:
+        print("\nExpansão das seções:")
+        print(f"  {'seções':>8} {'modo':>12} {'chamadas':>9} {'tokens prompt':>14} {'tokens saída':>13} {'tempo (s)':>10}")
+        for (total_sections, mode), result in results.items():
+            expansion = result['expansion']
+            print(f"  {total_sections:>8} {mode:>12} {expansion['calls']:>9} {expansion['prompt_tokens']:>14} "
+                  f"{expansion['completion_tokens']:>13} {expansion['seconds']:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark da montagem da árvore de seções (document_handler.build_section_tree).
+
+Gera livros sintéticos com um número crescente de títulos e mede o tempo de
+estruturação. Em um algoritmo linear, o tempo por título deve ficar estável
+à medida que o livro cresce.
+
+Uso:
+    python -m benchmarks.bench_section_tree
+"""
+import logging
+import time
+
+from src.preprocessing import document_handler
+
+HEADING_COUNTS = [2_500, 5_000, 10_000, 20_000]
+SECTIONS_PER_UNIT = 250
+REPEATS = 3
+
+def make_synthetic_book(total_headings: int) -> str:
+    """Cria um Markdown com `total_headings` títulos (# e ##) e um parágrafo por seção."""
+    lines = []
+    heading_count = 0
+    unit_number = 0
+    while heading_count < total_headings:
+        unit_number += 1
+        lines.append(f"# Unidade {unit_number}")
+        # Metade das unidades tem texto próprio, exercitando o agrupamento sob a unidade
+        if unit_number % 2 == 0:
+            lines.append(f"Introdução da unidade {unit_number}.")
+        heading_count += 1
+        for section_number in range(1, SECTIONS_PER_UNIT + 1):
+            if heading_count >= total_headings:
+                break
+            lines.append(f"## {unit_number}.{section_number} Seção sintética")
+            lines.append(f"Conteúdo da seção {unit_number}.{section_number}.")
+            lines.append("### Subseção")
+            lines.append("Detalhes da subseção.")
+            heading_count += 1
+    return "\n".join(lines)
+
+def time_build(content: str) -> float:
+    """Retorna o melhor tempo (em segundos) entre REPEATS execuções."""
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        document_handler.build_section_tree(content, "livro_sintetico.md")
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"{'títulos':>10} {'tempo (s)':>12} {'µs/título':>12}")
+    per_heading = []
+    for total_headings in HEADING_COUNTS:
+        elapsed = time_build(make_synthetic_book(total_headings))
+        per_heading.append(elapsed / total_headings)
+        print(f"{total_headings:>10} {elapsed:>12.4f} {per_heading[-1] * 1e6:>12.2f}")
+
+    growth = per_heading[-1] / per_heading[0]
+    print(f"\nVariação do custo por título ({HEADING_COUNTS[0]} → {HEADING_COUNTS[-1]}): {growth:.2f}x")
+    print("Escala linear." if growth < 2 else "ATENÇÃO: o custo por título cresceu com o tamanho do livro.")
+
+if __name__ == "__main__":
+    main()
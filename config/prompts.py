@@ -189,6 +189,26 @@ Incorpore os <paragrafos_de_expansao> a seguir no <texto_base_da_secao>. Encontr
 """
 
 
+SINGLE_SHOT_EXPANSION_PROMPT = """
+<prompt>
+<papel>Você é um autor especialista com a tarefa de aprofundar uma seção de livro didático.</papel>
+<contexto_geral>
+Os seguintes tópicos já foram abordados em detalhe no livro e NÃO devem ser explicados novamente:
+<topicos_ja_abordados>
+{mapa_de_conteudo_global}
+</topicos_ja_abordados>
+</contexto_geral>
+<regras>
+<regra prioridade="altissima">Reescreva a seção completa do <texto_base_da_secao>, expandida para cerca de <meta_de_palavras>{target_words}</meta_de_palavras> palavras (aproximadamente {words_to_add} palavras a mais que o texto atual).</regra>
+<regra>Escolha de 2 a 3 conceitos-chave presentes no texto e aprofunde-os com detalhes técnicos, exemplos práticos ou estudos de caso, inserindo o novo conteúdo nos locais mais lógicos e naturais.</regra>
+<regra>Preserve todo o conteúdo e toda a formatação original (tabelas, listas, etc.), ajustando as transições para que o texto final seja coeso e fluido.</regra>
+<regra>NÃO REPITA informações já descritas nos <topicos_ja_abordados>.</regra>
+<regra>Mantenha o mesmo tom acadêmico e impessoal do texto base e retorne apenas a seção em formato Markdown.</regra>
+</regras>
+<texto_base_da_secao>{base_text}</texto_base_da_secao>
+<secao_completa_e_expandida>
+"""
+
 
 UNIT_THEME_GENERATOR_PROMPT = """
 <prompt>
@@ -250,4 +270,31 @@ Se nenhum ponto do texto for adequado para uma curiosidade, retorne um JSON com
 <saida_json>
 """
 
+CHAPTER_ENRICHMENT_PROMPT = """
+<prompt>
+<instrucoes>
+<papel>Você é um editor de material didático, especialista em síntese de conteúdo acadêmico e em encontrar fatos interessantes.</papel>
+<tarefa>
+Analise o texto completo do capítulo fornecido em <contexto_do_capitulo> e produza, de uma só vez, três elementos:
+1. "curiosidade": o texto de UMA (1) única caixa "Você sabia?" que agregue valor pedagógico ao capítulo. O fato deve ser interessante, relevante e factualmente correto. Se nenhum ponto do texto for adequado, use null.
+2. "resumo": um resumo conciso e objetivo em texto corrido (um ou dois parágrafos) com as ideias, conceitos e conclusões mais importantes do capítulo. Ele será usado na seção final "Resumindo".
+3. "resumo_mapa": uma única frase concisa que capture o conceito principal do capítulo.
+Retorne apenas um objeto JSON válido com exatamente essas três chaves, sem nenhum texto adicional.
+</tarefa>
+</instrucoes>
+<exemplo_saida>
+{{
+  "curiosidade": "Você sabia que o concreto utilizado pelos romanos antigos, como no Panteão, fica mais forte com o tempo ao ser exposto à água?",
+  "resumo": "Neste capítulo, vimos...",
+  "resumo_mapa": "O capítulo apresenta..."
+}}
+</exemplo_saida>
+
+<contexto_do_capitulo>
+{context}
+</contexto_do_capitulo>
+
+<saida_json>
+"""
+
 TEXT_SUMMARIZER_PROMPT = "Resuma o texto a seguir em uma única frase concisa, capturando seu conceito principal. Texto: {text_to_summarize}"
\ No newline at end of file
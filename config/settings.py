@@ -18,20 +18,174 @@ MARKDOWN_FILENAME = "livro_em_markdown.md"
 STRUCTURE_MAP_FILENAME = "mapeamento_estrutura.json"
 OUTPUT_FILENAME = "livro_reestruturado.docx"
 
+# --- Conversão DOCX → Markdown ---
+# "auto": conversor nativo em Python, com o pandoc como alternativa para conteúdo não suportado
+# "native": sempre o conversor nativo | "pandoc": sempre o pandoc
+DOCX_CONVERTER = "auto"
+
+# --- Cache da conversão DOCX → Markdown ---
+USE_CONVERSION_CACHE = True
+CONVERSION_CACHE_DIR = INTERMEDIATE_DIR / "conversion_cache"
+
 # --- LLM and Embedding Models ---
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 LLM_MODEL = "gpt-4o"
 LLM_MODEL_STRUCTURE = "gpt-3.5-turbo" 
 EMBEDDING_MODEL = "text-embedding-3-small"
 
+# --- Provedores do LLM e dos embeddings ---
+# "openai": API da OpenAI
+# "fake": modelo e embeddings locais e determinísticos, para testes e benchmarks sem custo
+LLM_PROVIDER = "openai"
+EMBEDDING_PROVIDER = "openai"
+FAKE_LLM_LATENCY_MEAN = 0.0 # Segundos por chamada (distribuição normal, truncada em 0)
+FAKE_LLM_LATENCY_STD = 0.0
+FAKE_LLM_COMPLETION_TOKENS_MEAN = 400 # Tokens das respostas de texto livre
+FAKE_LLM_COMPLETION_TOKENS_STD = 100
+FAKE_LLM_SEED = 0
+FAKE_EMBEDDING_DIMENSIONS = 256
+
+# --- Cliente HTTP compartilhado (pool de conexões keep-alive) ---
+LLM_HTTP_MAX_CONNECTIONS = 20
+LLM_HTTP_MAX_KEEPALIVE = 10
+LLM_HTTP_KEEPALIVE_EXPIRY = 60 # Segundos que uma conexão ociosa é mantida
+LLM_HTTP_TIMEOUT = 120 # Segundos por requisição
+
+# --- Correspondência de títulos (mapa da estrutura → seções originais) ---
+# Similaridade mínima para aceitar um título aproximado quando não há correspondência exata
+TITLE_MATCH_MIN_SIMILARITY = 0.85
+
 # --- RAG Configuration ---
 CHUNK_SIZE_CHILD = 400
 CHUNK_SIZE_PARENT = 2000
+INDEXING_BATCH_DOCUMENTS = 500 # Documentos por inserção no índice (cada um gera vários chunks filhos)
+
+# --- Cache persistente de embeddings ---
+USE_EMBEDDING_CACHE = True
+EMBEDDING_CACHE_PATH = ARTIFACTS_DIR / "embedding_cache.sqlite"
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+
+# --- Requisições de embedding (lotes concorrentes e limites de taxa) ---
+EMBEDDING_BATCH_MAX_TOKENS = 8_000 # Tokens estimados por requisição
+EMBEDDING_BATCH_MAX_ITEMS = 512 # Chunks por requisição (a API aceita até 2048)
+EMBEDDING_MAX_CONCURRENCY = 4 # Requisições simultâneas
+EMBEDDING_REQUESTS_PER_MINUTE = 3_000 # RPM do nível da conta
+EMBEDDING_TOKENS_PER_MINUTE = 1_000_000 # TPM do nível da conta
+EMBEDDING_MAX_RETRIES = 5 # Novas tentativas após erros transitórios (429, timeouts, 5xx)
+
+# --- Backend do banco vetorial ---
+# "chroma": coleção persistida em disco (SQLite + HNSW)
+# "numpy": matriz em memória com busca exata, sem disco (ideal para livros e capítulos pequenos)
+VECTOR_BACKEND = "chroma"
+
+# --- Modo de recuperação ---
+# "vector": apenas similaridade de embeddings
+# "hybrid": BM25 sobre os chunks filhos fundido com a busca vetorial (melhor para termos técnicos)
+# "lexical": apenas BM25, sem embeddings nem chamadas de rede
+RETRIEVAL_MODE = "vector"
+BM25_K1 = 1.5
+BM25_B = 0.75
+HYBRID_RRF_K = 60 # Constante do Reciprocal Rank Fusion
+HYBRID_CANDIDATES_PER_RESULT = 4 # Candidatos buscados em cada ranking por resultado final
+
+# --- Cache de recuperações (consulta → IDs dos documentos pais) ---
+# Em índices persistidos, o cache é salvo em disco e vale entre execuções
+USE_RETRIEVAL_CACHE = True
+RETRIEVAL_CACHE_PATH = ARTIFACTS_DIR / "retrieval_cache.sqlite"
+RETRIEVAL_CACHE_MAX_ENTRIES = 100_000
+
+# --- Coleções do banco vetorial ---
+# Persiste o índice do livro (pais em SQLite + filhos no Chroma) para que uma nova
+# execução sobre o mesmo conteúdo o reutilize sem dividir nem gerar embeddings
+PERSIST_BOOK_INDEX = True
+# Cada execução indexa o livro em uma coleção própria, descartada ao final
+VECTORSTORE_RUN_PREFIX = "run"
+# Coleções de execuções interrompidas mais antigas que isso são removidas pela manutenção
+VECTORSTORE_ORPHAN_MAX_AGE_HOURS = 24
+# Índices persistidos sem uso há mais tempo que isso são removidos pela manutenção
+VECTORSTORE_PERSISTENT_MAX_AGE_DAYS = 30
 
 # --- LLM API Parameters for High Fidelity ---
 LLM_TEMPERATURE = 0.5
 LLM_TOP_P = 0.5
 
+# --- Cache persistente de respostas do LLM ---
+# Chave: modelo, temperatura, top_p e hash do prompt renderizado
+USE_LLM_RESPONSE_CACHE = True
+LLM_RESPONSE_CACHE_PATH = ARTIFACTS_DIR / "llm_response_cache.sqlite"
+LLM_RESPONSE_CACHE_TTL_DAYS = 30 # None: as respostas não expiram
+LLM_RESPONSE_CACHE_MAX_ENTRIES = 50_000
+# Tarefas (pelo início do nome) que sempre chamam a API, ex.: "Geração de Curiosidade"
+LLM_CACHE_DISABLED_TASKS = ()
+
+# --- Agendador de chamadas ao LLM (limites de taxa, prioridades e novas tentativas) ---
+# Limites (RPM, TPM) da conta por modelo; modelos não listados usam os padrões
+LLM_RATE_LIMITS = {
+    "gpt-4o": (500, 30_000),
+    "gpt-3.5-turbo": (500, 200_000),
+}
+LLM_DEFAULT_RATE_LIMITS = (500, 30_000)
+LLM_EXPECTED_COMPLETION_TOKENS = 800 # Reservados por chamada até a resposta informar o consumo real
+LLM_MAX_RETRIES = 6 # Novas tentativas após erros transitórios (429, timeouts, 5xx)
+LLM_RETRY_BASE_DELAY = 1.0 # Segundos
+LLM_RETRY_MAX_DELAY = 60.0 # Segundos
+# Prioridade na fila quando os limites se esgotam (menor = antes), pelo início do nome da tarefa:
+# tarefas curtas do caminho crítico passam à frente das longas gerações de seções
+LLM_TASK_PRIORITIES = {
+    "Mapeamento da Estrutura": 0,
+    "Sumarização para Mapa Global": 0,
+    "Enriquecimento do Capítulo": 0, # Inclui o resumo para o mapa global
+    "Geração de Resumo do Capítulo": 1,
+    "Geração de Tema da Unidade": 1,
+    "Geração de Curiosidade": 1,
+    "Análise de Tópicos para Expansão": 2,
+    "Integração de Conteúdo Expandido": 2,
+    "Expansão do Tópico": 3,
+    "Expansão Única da Seção": 3,
+    "Geração da Seção": 3,
+}
+LLM_DEFAULT_PRIORITY = 2
+
+# --- Modo de execução das chamadas independentes ---
+# "interactive": cada chamada é feita na hora
+# "batch_api": as chamadas independentes de uma etapa (mapa da estrutura; curiosidades,
+# resumos de capítulo e temas de unidade) viram um lote da Batch API da OpenAI:
+# metade do custo e fora dos limites interativos, com espera de até 24h
+LLM_EXECUTION_MODE = "interactive"
+BATCH_API_BASE_URL = None # None: API da OpenAI
+BATCH_API_COMPLETION_WINDOW = "24h"
+BATCH_API_POLL_INTERVAL = 60 # Segundos entre as consultas ao estado do lote
+BATCH_API_TIMEOUT_HOURS = 24 # Depois disso o lote é cancelado e as chamadas viram interativas
+BATCH_API_MAX_REQUESTS = 50_000 # Requisições por lote (limite da API)
+BATCH_API_COST_FACTOR = 0.5 # Preço da Batch API em relação ao interativo
+
+# --- Execução da geração das seções ---
+# "sequential": uma seção após a outra; "async": as seções de cada capítulo em paralelo
+SECTION_EXECUTION_MODE = "sequential"
+SECTION_MAX_CONCURRENCY = 4 # Seções geradas ao mesmo tempo no modo "async"
+EXPANSION_MAX_CONCURRENCY = 6 # Parágrafos de expansão gerados ao mesmo tempo em cada iteração
+
+# --- Enriquecimento dos capítulos ---
+# "separate": curiosidade, resumo "Resumindo" e resumo para o mapa global em três chamadas
+# "fused": os três numa única chamada com resposta JSON (o capítulo é enviado uma vez);
+# campos inválidos na resposta são gerados pelas chamadas separadas
+ENRICHMENT_MODE = "separate"
+
+# --- Agendamento do livro ---
+# "loop": unidades, capítulos e seções em laços aninhados
+# "dag": grafo de tarefas com as dependências reais, executado em paralelo
+BOOK_SCHEDULER = "loop"
+DAG_MAX_WORKERS = 8 # Tarefas executadas ao mesmo tempo no modo "dag"
+# Se True, as seções usam o mapa de conteúdo global com os capítulos concluídos até
+# o momento, sem esperar o capítulo anterior (mais paralelismo, mapa possivelmente parcial)
+DAG_RELAX_CONTENT_MAP = False
+
+# --- Checkpoints da geração ---
+# Diário (no diretório intermediário do livro) com cada seção, enriquecimento de
+# capítulo e tema de unidade concluídos; `--resume` continua a partir dele
+USE_CHECKPOINTS = True
+CHECKPOINT_FILENAME = "checkpoint_geracao.jsonl"
+
 # --- PARÂMETRO DE CONTROLE DE VOLUME ---
 WORDS_PER_PAGE = 300
 TARGET_PAGES_PER_UNIT = 30
@@ -40,6 +194,34 @@ TARGET_WORDS_PER_UNIT = WORDS_PER_PAGE * TARGET_PAGES_PER_UNIT
 # Freio de segurança para o loop de expansão
 MAX_EXPANSION_ITERATIONS = 4
 
+# --- Expansão das seções ---
+# "iterative": até MAX_EXPANSION_ITERATIONS rodadas de análise de tópicos, N parágrafos
+# e integração (2 + N chamadas por rodada, reenviando e reescrevendo a seção a cada uma)
+# "single_shot": uma única reescrita completa, dimensionada pelo déficit de palavras
+EXPANSION_MODE = "iterative"
+
+# --- Processamento em lote (vários livros) ---
+BOOKS_ARTIFACTS_DIR = ARTIFACTS_DIR / "books"
+BATCH_MAX_WORKERS = 4
+
+def get_artifact_paths(book_name: str = None) -> dict:
+    """
+    Retorna os diretórios de artefatos de um livro. Sem nome, usa os diretórios
+    padrão do modo de livro único; no modo em lote, cada livro tem seu próprio espaço.
+    """
+    if book_name is None:
+        return {'intermediate': INTERMEDIATE_DIR, 'output': OUTPUT_DIR, 'vectorstore': VECTORSTORE_DIR}
+
+    book_dir = BOOKS_ARTIFACTS_DIR / book_name
+    paths = {
+        'intermediate': book_dir / "intermediate",
+        'output': book_dir / "output",
+        'vectorstore': book_dir / "vectorstore",
+    }
+    for path in paths.values():
+        path.mkdir(parents=True, exist_ok=True)
+    return paths
+
 # --- Create directories if they don't exist ---
 INPUT_DIR.mkdir(parents=True, exist_ok=True)
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
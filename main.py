@@ -1,24 +1,26 @@
+import argparse
+import asyncio
+import json
+import threading
 import re 
-import unidecode
+from pathlib import Path
 from config import settings
 
+from src.utils import llm_handler
+from src.utils.llm_scheduler import log_scheduler_metrics
 from src.utils.logger import logger 
-from src.preprocessing import document_handler
+from src.utils.stage_timer import stage_timings, timed_stage
+from src.preprocessing import conversion_cache, document_handler
+from src.preprocessing.title_index import TitleIndex
 from src.rag_system import retriever_builder
 from src.transformation import content_generator, structure_mapper, summary_generator
 from src.assembly import document_assembler
+from src.orchestration import batch_runner
+from src.orchestration.checkpoint import CheckpointJournal, book_fingerprint
+from src.orchestration.task_graph import TaskGraph
 import pypandoc
 from langchain_community.callbacks import get_openai_callback
 
-def normalize_title(title: str) -> str:
-    """Função para limpar e normalizar títulos para garantir a correspondência."""
-
-    cleaned_title = re.sub(r'^(?:#|##)\s*', '', title).strip()
-    ascii_title = unidecode.unidecode(cleaned_title)
-    normalized_title = re.sub(r'[^a-zA-Z0-9\s\.-]', '', ascii_title)
-
-    return normalized_title.lower().strip()
-
 def create_full_book_summary_str(structure_map: dict) -> str:
     """Cria uma string formatada com o sumário do livro inteiro."""
     summary_lines = []
@@ -31,139 +33,594 @@ def create_full_book_summary_str(structure_map: dict) -> str:
                 summary_lines.append(f"    - {clean_section}")
     return "\n".join(summary_lines)
 
-def run_pipeline():
+def assign_structure_metadata(documents: list, structure_map: dict, title_index: TitleIndex):
     """
-    Executa o pipeline completo de reestruturação do livro didático.
+    Anota cada documento com a unidade e o capítulo a que pertence no novo mapa
+    da estrutura. Os chunks indexados herdam esses metadados, que delimitam as
+    visões por capítulo e por unidade do índice do livro.
     """
-    logger.info("--- INICIANDO PIPELINE DE REESTRUTURAÇÃO DE LIVRO ---")
+    for doc in documents:
+        doc.metadata['unit'] = doc.metadata['title'].split('\n')[0].strip().replace('# ', '')
 
-    # FASE 1: DESCONSTRUÇÃO E PREPARAÇÃO
-    input_docx_path = settings.INPUT_DIR / settings.INPUT_FILENAME
-    intermediate_md_path = settings.INTERMEDIATE_DIR / settings.MARKDOWN_FILENAME
-    document_handler.convert_docx_to_markdown(input_docx_path, intermediate_md_path, settings.INTERMEDIATE_DIR)
-    
-    with open(intermediate_md_path, 'r', encoding='utf-8') as f:
-        original_md_content = f.read()
-    corrected_md_content = document_handler.preprocess_markdown_headings(original_md_content)
-    all_documents = document_handler.load_and_split_by_structure(corrected_md_content, intermediate_md_path.name)
-    
-    if not all_documents:
-        logger.critical("Pipeline interrompido: nenhum documento foi extraído do arquivo de entrada.")
-        return
+    for unit_title, unit_data in structure_map.items():
+        for chapter_title, sections in unit_data.items():
+            for doc in map(title_index.lookup, sections):
+                if doc is None:
+                    continue
+                if doc.metadata.get('chapter') not in (None, chapter_title):
+                    logger.warning(f"Seção '{doc.metadata['title']}' mapeada em mais de um capítulo; usando '{chapter_title}'.")
+                doc.metadata['unit'] = unit_title
+                doc.metadata['chapter'] = chapter_title
 
-    # FASE 2: MAPEAMENTO DA ESTRUTURA
-    structure_map_path = settings.INTERMEDIATE_DIR / settings.STRUCTURE_MAP_FILENAME
-    structure_map = structure_mapper.generate_structure_map(corrected_md_content, structure_map_path)
-    full_book_summary = create_full_book_summary_str(structure_map)
+def _section_source(section_title: str, title_index: TitleIndex):
+    """Retorna (título limpo, texto fonte) da seção, ou None se ela não existir no original."""
+    clean_section_title = re.sub(r'^(?:#|##)\s*', '', section_title).strip()
+    original_doc = title_index.lookup(section_title)
+    if original_doc is None:
+        logger.warning(f"    Seção '{clean_section_title}' não encontrada no conteúdo fonte. Pulando.")
+        return None
+
+    text_for_generation = original_doc.page_content
+    if text_for_generation == "TÍTULO ESTRUTURAL":
+        text_for_generation = clean_section_title
+    return clean_section_title, text_for_generation
+
+def process_section(section_title: str, chapter_title: str, chapter_retriever, title_index: TitleIndex,
+                    full_book_summary: str, target_words_per_section: float, mapa_de_conteudo_global: dict):
+    """Gera o rascunho de uma seção e a expande até a meta de palavras. Retorna (título, texto) ou None."""
+    source = _section_source(section_title, title_index)
+    if source is None:
+        return None
+    clean_section_title, text_for_generation = source
+
+    # 1. GERA O RASCUNHO INICIAL DA SEÇÃO
+    logger.info(f"    - Gerando rascunho para a seção: {clean_section_title}")
+    generated_section_text = content_generator.generate_section(
+        sumario_completo=full_book_summary, capitulo_atual=chapter_title, subtitulo_atual=clean_section_title,
+        texto_original_da_secao=text_for_generation, retriever_do_capitulo=chapter_retriever
+    )
+
+    # 2. EXPANDE A SEÇÃO ATÉ A META DE PALAVRAS
+    with timed_stage("expansão"):
+        generated_section_text = expand_section_text(
+            clean_section_title, generated_section_text, target_words_per_section, mapa_de_conteudo_global
+        )
+    return clean_section_title, generated_section_text
+
+def expand_section_text(clean_section_title: str, generated_section_text: str, target_words_per_section: float,
+                        mapa_de_conteudo_global: dict) -> str:
+    """
+    Expande o rascunho até a meta de palavras. No modo "iterative", repete análise de
+    tópicos, parágrafos e integração; no modo "single_shot", faz uma única reescrita
+    dimensionada pelo déficit de palavras.
+    """
+    word_count = len(generated_section_text.split())
+    if settings.EXPANSION_MODE == "single_shot":
+        if word_count < target_words_per_section:
+            logger.info(f"      - Expansão única da seção '{clean_section_title}' "
+                        f"({word_count} → ~{int(target_words_per_section)} palavras).")
+            generated_section_text = content_generator.expand_section(
+                generated_section_text, target_words_per_section, mapa_de_conteudo_global
+            )
+        return generated_section_text
+
+    for i in range(settings.MAX_EXPANSION_ITERATIONS):
+        if word_count >= target_words_per_section:
+            break
+
+        logger.info(f"      - Expansão da seção '{clean_section_title}' [{i+1}/{settings.MAX_EXPANSION_ITERATIONS}].")
+
+        topics_to_expand = content_generator.identify_expansion_topics(generated_section_text)
+        if not topics_to_expand:
+            break
+
+        new_paragraphs = content_generator.generate_expansion_paragraphs(topics_to_expand, generated_section_text, mapa_de_conteudo_global)
+        # Tópicos cuja geração falhou voltam vazios e ficam de fora da integração
+        new_paragraphs = {topic: paragraph for topic, paragraph in new_paragraphs.items() if paragraph.strip()}
+        if not new_paragraphs:
+            break
+
+        generated_section_text = content_generator.integrate_expansions(generated_section_text, new_paragraphs)
+        word_count = len(generated_section_text.split())
+
+    return generated_section_text
+
+async def aprocess_section(section_title: str, chapter_title: str, chapter_retriever, title_index: TitleIndex,
+                           full_book_summary: str, target_words_per_section: float, mapa_de_conteudo_global: dict):
+    """Versão assíncrona de `process_section`, com as mesmas etapas e a mesma ordem de chamadas."""
+    source = _section_source(section_title, title_index)
+    if source is None:
+        return None
+    clean_section_title, text_for_generation = source
+
+    logger.info(f"    - Gerando rascunho para a seção: {clean_section_title}")
+    generated_section_text = await content_generator.agenerate_section(
+        sumario_completo=full_book_summary, capitulo_atual=chapter_title, subtitulo_atual=clean_section_title,
+        texto_original_da_secao=text_for_generation, retriever_do_capitulo=chapter_retriever
+    )
+
+    with timed_stage("expansão"):
+        generated_section_text = await aexpand_section_text(
+            clean_section_title, generated_section_text, target_words_per_section, mapa_de_conteudo_global
+        )
+    return clean_section_title, generated_section_text
+
+async def aexpand_section_text(clean_section_title: str, generated_section_text: str, target_words_per_section: float,
+                               mapa_de_conteudo_global: dict) -> str:
+    """Versão assíncrona de `expand_section_text`."""
+    word_count = len(generated_section_text.split())
+    if settings.EXPANSION_MODE == "single_shot":
+        if word_count < target_words_per_section:
+            logger.info(f"      - Expansão única da seção '{clean_section_title}' "
+                        f"({word_count} → ~{int(target_words_per_section)} palavras).")
+            generated_section_text = await content_generator.aexpand_section(
+                generated_section_text, target_words_per_section, mapa_de_conteudo_global
+            )
+        return generated_section_text
+
+    for i in range(settings.MAX_EXPANSION_ITERATIONS):
+        if word_count >= target_words_per_section:
+            break
+
+        logger.info(f"      - Expansão da seção '{clean_section_title}' [{i+1}/{settings.MAX_EXPANSION_ITERATIONS}].")
+
+        topics_to_expand = await content_generator.aidentify_expansion_topics(generated_section_text)
+        if not topics_to_expand:
+            break
+
+        new_paragraphs = await content_generator.agenerate_expansion_paragraphs(topics_to_expand, generated_section_text, mapa_de_conteudo_global)
+        # Tópicos cuja geração falhou voltam vazios e ficam de fora da integração
+        new_paragraphs = {topic: paragraph for topic, paragraph in new_paragraphs.items() if paragraph.strip()}
+        if not new_paragraphs:
+            break
+
+        generated_section_text = await content_generator.aintegrate_expansions(generated_section_text, new_paragraphs)
+        word_count = len(generated_section_text.split())
+
+    return generated_section_text
+
+async def _agenerate_sections(sections: list, task_names: list, journal: CheckpointJournal, *args) -> list:
+    """
+    Processa as seções em paralelo (até SECTION_MAX_CONCURRENCY) e devolve os resultados na ordem do mapa.
+    Se uma seção falha, as demais são canceladas e aguardadas antes de propagar o erro.
+    """
+    semaphore = asyncio.Semaphore(settings.SECTION_MAX_CONCURRENCY)
+
+    async def bounded(section_title, task_name):
+        async with semaphore:
+            return await journal.astep(task_name, aprocess_section, section_title, *args)
+
+    tasks = [asyncio.ensure_future(bounded(section_title, task_name)) for section_title, task_name in zip(sections, task_names)]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def generate_chapter_sections(sections: list, chapter_title: str, chapter_retriever, title_index: TitleIndex,
+                              full_book_summary: str, target_words_per_section: float,
+                              mapa_de_conteudo_global: dict, event_loop=None,
+                              journal: CheckpointJournal = None, chapter_key: str = None) -> dict:
+    """
+    Gera as seções de um capítulo, em sequência ou, com um laço de eventos
+    (`SECTION_EXECUTION_MODE = "async"`), concorrentemente. A ordem das seções
+    no resultado é sempre a do mapa da estrutura. Com um diário de checkpoints,
+    cada seção concluída é registrada e as já registradas não são geradas de novo.
+    """
+    journal = journal or CheckpointJournal(None, "")
+    chapter_key = chapter_key or chapter_title
+    task_names = [f"seção:{chapter_key}:{i}" for i in range(len(sections))]
+    args = (chapter_title, chapter_retriever, title_index, full_book_summary, target_words_per_section, mapa_de_conteudo_global)
+    if event_loop is not None:
+        results = event_loop.run_until_complete(_agenerate_sections(sections, task_names, journal, *args))
+    else:
+        results = [journal.step(task_name, process_section, section_title, *args)
+                   for section_title, task_name in zip(sections, task_names)]
+    return {title: text for title, text in filter(None, results)}
+
+def generate_book_content(structure_map: dict, title_index: TitleIndex, book_index, full_book_summary: str,
+                          journal: CheckpointJournal = None) -> dict:
+    """
+    Gera e expande o conteúdo de todas as unidades e capítulos do mapa da estrutura.
+    Retorna o `processed_content` usado na montagem do documento final.
+    Seções, enriquecimentos de capítulo e temas de unidade passam pelo diário de
+    checkpoints: ao retomar, `processed_content` e o mapa de conteúdo global são
+    reconstruídos a partir dele e a geração continua da primeira tarefa pendente.
+    """
+    journal = journal or CheckpointJournal(None, "")
+    if settings.BOOK_SCHEDULER == "dag":
+        return generate_book_content_dag(structure_map, title_index, book_index, full_book_summary, journal)
+
+    # No modo "batch_api", curiosidades, resumos e temas saem do laço e vão num único lote ao final
+    defer_enrichment = settings.LLM_EXECUTION_MODE == "batch_api"
 
-    original_sections_map = {
-        normalize_title(doc.metadata['title'].split('\n')[-1]): doc for doc in all_documents
-    }
-    
-    # FASE 3: GERAÇÃO E EXPANSÃO DE CONTEÚDO
-    logger.info("--- INICIANDO FASE DE GERAÇÃO E EXPANSÃO DE CONTEÚDO ---")
-    
     processed_content = {}
     mapa_de_conteudo_global = {}
+    # No modo assíncrono, um único laço de eventos serve o livro inteiro (e o pool de conexões)
+    event_loop = asyncio.new_event_loop() if settings.SECTION_EXECUTION_MODE == "async" else None
+    try:
+        for unit_title, unit_data in structure_map.items():
+            logger.info(f"Processando Unidade: {unit_title}")
+            processed_content[unit_title] = {'chapters': {}}
+            full_unit_text_for_theme = ""
 
-    for unit_title, unit_data in structure_map.items():
-        logger.info(f"Processando Unidade: {unit_title}")
-        processed_content[unit_title] = {'chapters': {}}
+            for chapter_title, sections in unit_data.items():
+                logger.info(f"  - Preparando Capítulo: {chapter_title}")
+                key = f"{unit_title}/{chapter_title}"
+
+                chapter_docs = [doc for doc in map(title_index.lookup, sections) if doc is not None]
+                if not chapter_docs:
+                    logger.warning(f"    Nenhum conteúdo fonte encontrado para o capítulo {chapter_title}. Pulando.")
+                    continue
+
+                chapter_retriever = retriever_builder.build_retriever(book_index, unit=unit_title, chapter=chapter_title)
+
+                target_words_per_section = (settings.TARGET_WORDS_PER_UNIT / len(unit_data)) / len(sections) if len(sections) > 0 else 250
+                final_chapter_sections = generate_chapter_sections(
+                    sections, chapter_title, chapter_retriever, title_index, full_book_summary,
+                    target_words_per_section, mapa_de_conteudo_global, event_loop, journal, key,
+                )
+
+                # 3. MONTA O TEXTO COMPLETO DO CAPÍTULO A PARTIR DAS SEÇÕES JÁ FINALIZADAS
+                full_chapter_text = "\n\n".join(f"### {title}\n{text}" for title, text in final_chapter_sections.items())
+
+                processed_content[unit_title]['chapters'][chapter_title] = {'content': full_chapter_text}
+
+                # --- Enriquecimento Final do Capítulo ---
+                if settings.ENRICHMENT_MODE == "fused":
+                    enrichment = journal.step(
+                        f"enriquecimento:{key}", summary_generator.generate_chapter_enrichment, full_chapter_text, chapter_retriever
+                    )
+                    apply_chapter_enrichment(processed_content[unit_title]['chapters'][chapter_title], enrichment)
+                    resumo_capitulo = enrichment["resumo_mapa"]
+                else:
+                    if not defer_enrichment:
+                        curiosity = journal.step(f"curiosidade:{key}", content_generator.generate_curiosities, full_chapter_text)
+                        if curiosity and curiosity.get("curiosidade"):
+                            processed_content[unit_title]['chapters'][chapter_title]['curiosity'] = curiosity["curiosidade"]
+
+                        summary = journal.step(f"resumo:{key}", summary_generator.generate_chapter_summary, full_chapter_text, chapter_retriever)
+                        processed_content[unit_title]['chapters'][chapter_title]['summary'] = summary
+
+                    resumo_capitulo = journal.step(f"mapa:{key}", summary_generator.summarize_text, full_chapter_text)
+                mapa_de_conteudo_global[chapter_title] = resumo_capitulo
+                full_unit_text_for_theme += full_chapter_text + "\n\n"
+
+            if full_unit_text_for_theme.strip() and not defer_enrichment:
+                unit_retriever = retriever_builder.build_retriever(book_index, unit=unit_title)
+                processed_content[unit_title]['theme'] = journal.step(
+                    f"tema:{unit_title}", summary_generator.generate_unit_theme, unit_title, full_unit_text_for_theme, unit_retriever
+                )
+    finally:
+        if event_loop is not None:
+            event_loop.run_until_complete(llm_handler.aclose_async_http_client())
+            event_loop.close()
+
+    if defer_enrichment:
+        enrich_book_with_batch_api(processed_content, journal)
+    return processed_content
+
+def apply_chapter_enrichment(chapter_data: dict, enrichment: dict):
+    """Copia a curiosidade (se houver) e o resumo da chamada combinada para o capítulo."""
+    if enrichment.get("curiosidade"):
+        chapter_data['curiosity'] = enrichment["curiosidade"]
+    chapter_data['summary'] = enrichment["resumo"]
+
+def enrich_book_with_batch_api(processed_content: dict, journal: CheckpointJournal):
+    """
+    Gera curiosidades, resumos de capítulo e temas de unidade num único lote da
+    Batch API, a partir dos textos já em `processed_content`. Nenhuma outra tarefa
+    depende deles, então podem esperar o lote; as tarefas já registradas no diário
+    de checkpoints não são reenviadas. Capítulos já enriquecidos pela chamada
+    combinada (`ENRICHMENT_MODE = "fused"`) só entram no texto do tema.
+    """
+    tasks = []
+    for unit_title, unit_content in processed_content.items():
         full_unit_text_for_theme = ""
+        for chapter_title, chapter_data in unit_content['chapters'].items():
+            key = f"{unit_title}/{chapter_title}"
+            if 'summary' not in chapter_data:
+                tasks.append((f"curiosidade:{key}", content_generator.curiosity_request(chapter_data['content']), content_generator.parse_curiosity))
+                tasks.append((f"resumo:{key}", summary_generator.chapter_summary_request(chapter_data['content']), None))
+            full_unit_text_for_theme += chapter_data['content'] + "\n\n"
+        if full_unit_text_for_theme.strip():
+            tasks.append((f"tema:{unit_title}", summary_generator.unit_theme_request(unit_title, full_unit_text_for_theme), None))
+
+    # Os argumentos de texto de cada tarefa são os parâmetros do prompt, como em `journal.step`
+    pending = [task for task in tasks if not journal.completed(task[0], *task[1][1].values())]
+    logger.info(f"Enriquecimento em lote: {len(pending)} de {len(tasks)} tarefas enviadas à Batch API.")
+    responses = llm_handler.batch_api_invoke_llm_with_tracking([request for _, request, _ in pending])
+    # Resultados vazios são usados nesta execução, mas não ficam no diário (a retomada os refaz)
+    results = dict(journal.results)
+    for (task_name, request, parse), response in zip(pending, responses):
+        results[task_name] = parse(response) if parse else response
+        journal.record(task_name, results[task_name], *request[1].values())
+
+    for unit_title, unit_content in processed_content.items():
+        for chapter_title, chapter_data in unit_content['chapters'].items():
+            key = f"{unit_title}/{chapter_title}"
+            if 'summary' in chapter_data:
+                continue
+            curiosity = results[f"curiosidade:{key}"]
+            if curiosity and curiosity.get("curiosidade"):
+                chapter_data['curiosity'] = curiosity["curiosidade"]
+            chapter_data['summary'] = results[f"resumo:{key}"]
+        if f"tema:{unit_title}" in results:
+            unit_content['theme'] = results[f"tema:{unit_title}"]
+
+# Prioridades do grafo (menor = antes): o resumo para o mapa global libera o
+# capítulo seguinte, então fica no caminho crítico; tema, curiosidade e resumo
+# final não têm dependentes e ficam por último.
+PRIORITY_CONTENT_MAP = 0
+PRIORITY_SECTION = 1
+PRIORITY_CHAPTER_ENRICHMENT = 2
+PRIORITY_UNIT_THEME = 3
+
+def generate_book_content_dag(structure_map: dict, title_index: TitleIndex, book_index, full_book_summary: str,
+                              journal: CheckpointJournal = None) -> dict:
+    """
+    Gera o conteúdo do livro como um grafo de tarefas com as dependências reais:
+    cada seção depende apenas do mapa de conteúdo global; o texto do capítulo, das
+    suas seções; curiosidade, resumo e entrada no mapa global (uma só tarefa com
+    `ENRICHMENT_MODE = "fused"`), do texto do capítulo; e o tema da unidade, dos
+    capítulos da unidade. As tarefas prontas rodam em paralelo (até
+    `settings.DAG_MAX_WORKERS`).
+
+    Por padrão, as seções de um capítulo esperam a entrada do capítulo anterior no
+    mapa global, reproduzindo o laço sequencial. Com `settings.DAG_RELAX_CONTENT_MAP`,
+    elas usam os capítulos concluídos até o momento em que começam.
+    As tarefas já registradas no diário de checkpoints devolvem o resultado salvo.
+    """
+    journal = journal or CheckpointJournal(None, "")
+    defer_enrichment = settings.LLM_EXECUTION_MODE == "batch_api"
+    processed_content = {}
+    mapa_de_conteudo_global = {}
+    mapa_lock = threading.Lock()
+    graph = TaskGraph()
+    previous_map_task = None
+
+    def section_task(task_name, section_title, chapter_title, chapter_retriever, target_words_per_section):
+        def run(*_):
+            with mapa_lock:
+                mapa_snapshot = dict(mapa_de_conteudo_global)
+            return journal.step(task_name, process_section, section_title, chapter_title, chapter_retriever, title_index,
+                                full_book_summary, target_words_per_section, mapa_snapshot)
+        return run
+
+    def chapter_text_task(chapter_data):
+        def run(*section_results):
+            final_chapter_sections = {title: text for title, text in filter(None, section_results)}
+            chapter_data['content'] = "\n\n".join(f"### {title}\n{text}" for title, text in final_chapter_sections.items())
+            return chapter_data['content']
+        return run
+
+    def curiosity_task(task_name, chapter_data):
+        def run(full_chapter_text):
+            curiosity = journal.step(task_name, content_generator.generate_curiosities, full_chapter_text)
+            if curiosity and curiosity.get("curiosidade"):
+                chapter_data['curiosity'] = curiosity["curiosidade"]
+        return run
+
+    def summary_task(task_name, chapter_data, chapter_retriever):
+        def run(full_chapter_text):
+            chapter_data['summary'] = journal.step(task_name, summary_generator.generate_chapter_summary, full_chapter_text, chapter_retriever)
+        return run
+
+    def content_map_task(task_name, chapter_title):
+        def run(full_chapter_text, *_):
+            resumo_capitulo = journal.step(task_name, summary_generator.summarize_text, full_chapter_text)
+            with mapa_lock:
+                mapa_de_conteudo_global[chapter_title] = resumo_capitulo
+        return run
+
+    def enrichment_task(task_name, chapter_title, chapter_data, chapter_retriever):
+        def run(full_chapter_text, *_):
+            enrichment = journal.step(task_name, summary_generator.generate_chapter_enrichment, full_chapter_text, chapter_retriever)
+            apply_chapter_enrichment(chapter_data, enrichment)
+            with mapa_lock:
+                mapa_de_conteudo_global[chapter_title] = enrichment["resumo_mapa"]
+        return run
+
+    def unit_theme_task(task_name, unit_title, unit_content):
+        def run(*chapter_texts):
+            full_unit_text_for_theme = "".join(text + "\n\n" for text in chapter_texts)
+            if full_unit_text_for_theme.strip():
+                unit_retriever = retriever_builder.build_retriever(book_index, unit=unit_title)
+                unit_content['theme'] = journal.step(
+                    task_name, summary_generator.generate_unit_theme, unit_title, full_unit_text_for_theme, unit_retriever
+                )
+        return run
+
+    for unit_title, unit_data in structure_map.items():
+        # As entradas são criadas na ordem do mapa para que a montagem independa da ordem de conclusão
+        unit_content = processed_content[unit_title] = {'chapters': {}}
+        chapter_text_tasks = []
 
         for chapter_title, sections in unit_data.items():
-            logger.info(f"  - Preparando Capítulo: {chapter_title}")
-            
-            chapter_docs = [original_sections_map[normalize_title(s)] for s in sections if normalize_title(s) in original_sections_map]
+            chapter_docs = [doc for doc in map(title_index.lookup, sections) if doc is not None]
             if not chapter_docs:
                 logger.warning(f"    Nenhum conteúdo fonte encontrado para o capítulo {chapter_title}. Pulando.")
                 continue
-            
-            chapter_retriever = retriever_builder.build_retriever(chapter_docs)
-            
-            final_chapter_sections = {}
-            
-            # LÓGICA DE GERAÇÃO E EXPANSÃO (SEÇÃO POR SEÇÃO)
-            for section_title in sections:
-                clean_section_title = re.sub(r'^(?:#|##)\s*', '', section_title).strip()
-                lookup_key = normalize_title(section_title)
-                
-                if lookup_key not in original_sections_map:
-                    continue
 
-                original_doc = original_sections_map[lookup_key]
-                text_for_generation = original_doc.page_content
-                if text_for_generation == "TÍTULO ESTRUTURAL":
-                    text_for_generation = clean_section_title
+            key = f"{unit_title}/{chapter_title}"
+            chapter_data = unit_content['chapters'][chapter_title] = {}
+            chapter_retriever = retriever_builder.build_retriever(book_index, unit=unit_title, chapter=chapter_title)
+            target_words_per_section = (settings.TARGET_WORDS_PER_UNIT / len(unit_data)) / len(sections) if len(sections) > 0 else 250
 
-                # 1. GERA O RASCUNHO INICIAL DA SEÇÃO
-                logger.info(f"    - Gerando rascunho para a seção: {clean_section_title}")
-                generated_section_text = content_generator.generate_section(
-                    sumario_completo=full_book_summary, capitulo_atual=chapter_title, subtitulo_atual=clean_section_title,
-                    texto_original_da_secao=text_for_generation, retriever_do_capitulo=chapter_retriever
+            # No modo estrito, a cadeia de entradas do mapa global segue a ordem do livro
+            map_gate = [previous_map_task] if previous_map_task and not settings.DAG_RELAX_CONTENT_MAP else []
+            section_tasks = []
+            for i, section_title in enumerate(sections):
+                name = f"seção:{key}:{i}"
+                section_tasks.append(graph.add(
+                    name, section_task(name, section_title, chapter_title, chapter_retriever, target_words_per_section),
+                    map_gate, PRIORITY_SECTION,
+                ))
+            text_task = graph.add(f"capítulo:{key}", chapter_text_task(chapter_data), section_tasks, PRIORITY_CONTENT_MAP)
+            if settings.ENRICHMENT_MODE == "fused":
+                # A chamada combinada traz a entrada do mapa global, então fica no caminho crítico
+                previous_map_task = graph.add(
+                    f"enriquecimento:{key}", enrichment_task(f"enriquecimento:{key}", chapter_title, chapter_data, chapter_retriever),
+                    [text_task] + map_gate, PRIORITY_CONTENT_MAP,
                 )
+            else:
+                if not defer_enrichment:
+                    graph.add(f"curiosidade:{key}", curiosity_task(f"curiosidade:{key}", chapter_data), [text_task], PRIORITY_CHAPTER_ENRICHMENT)
+                    graph.add(f"resumo:{key}", summary_task(f"resumo:{key}", chapter_data, chapter_retriever), [text_task], PRIORITY_CHAPTER_ENRICHMENT)
+                previous_map_task = graph.add(f"mapa:{key}", content_map_task(f"mapa:{key}", chapter_title), [text_task] + map_gate, PRIORITY_CONTENT_MAP)
+            chapter_text_tasks.append(text_task)
 
-                # 2. INICIA O LOOP DE EXPANSÃO PARA A SEÇÃO ATUAL
-                word_count = len(generated_section_text.split())
-                target_words_per_section = (settings.TARGET_WORDS_PER_UNIT / len(unit_data)) / len(sections) if len(sections) > 0 else 250
+        if chapter_text_tasks and not defer_enrichment:
+            graph.add(f"tema:{unit_title}", unit_theme_task(f"tema:{unit_title}", unit_title, unit_content), chapter_text_tasks, PRIORITY_UNIT_THEME)
 
-                for i in range(settings.MAX_EXPANSION_ITERATIONS):
-                    if word_count >= target_words_per_section:
-                        break
-                    
-                    logger.info(f"      - Expansão da seção '{clean_section_title}' [{i+1}/{settings.MAX_EXPANSION_ITERATIONS}].")
-                    
-                    topics_to_expand = content_generator.identify_expansion_topics(generated_section_text)
-                    if not topics_to_expand:
-                        break
-
-                    new_paragraphs = {}
-                    for topic in topics_to_expand:
-                        new_paragraphs[topic] = content_generator.generate_expansion_paragraph(topic, generated_section_text, mapa_de_conteudo_global)
-                    
-                    generated_section_text = content_generator.integrate_expansions(generated_section_text, new_paragraphs)
-                    word_count = len(generated_section_text.split())
-
-                final_chapter_sections[clean_section_title] = generated_section_text
-
-            # 3. MONTA O TEXTO COMPLETO DO CAPÍTULO A PARTIR DAS SEÇÕES JÁ FINALIZADAS
-            full_chapter_text = "\n\n".join(f"### {title}\n{text}" for title, text in final_chapter_sections.items())
-
-            processed_content[unit_title]['chapters'][chapter_title] = {'content': full_chapter_text}
-            
-            # --- Enriquecimento Final do Capítulo ---
-            curiosity = content_generator.generate_curiosities(full_chapter_text)
-            if curiosity and curiosity.get("curiosidade"):
-                processed_content[unit_title]['chapters'][chapter_title]['curiosity'] = curiosity["curiosidade"]
+    logger.info(f"Executando {len(graph.tasks)} tarefas com até {settings.DAG_MAX_WORKERS} em paralelo...")
+    try:
+        graph.run(settings.DAG_MAX_WORKERS)
+    finally:
+        # Os modelos recebem o cliente assíncrono no modo "async" mesmo que o grafo os chame de forma síncrona
+        if settings.SECTION_EXECUTION_MODE == "async":
+            asyncio.run(llm_handler.aclose_async_http_client())
+    if defer_enrichment:
+        enrich_book_with_batch_api(processed_content, journal)
+    return processed_content
 
-            summary = summary_generator.generate_chapter_summary(full_chapter_text, chapter_retriever)
-            processed_content[unit_title]['chapters'][chapter_title]['summary'] = summary
-            
-            resumo_capitulo = summary_generator.summarize_text(full_chapter_text)
-            mapa_de_conteudo_global[chapter_title] = resumo_capitulo
-            full_unit_text_for_theme += full_chapter_text + "\n\n"
+def run_pipeline(input_docx_path: Path = None, artifact_paths: dict = None, resume: bool = False):
+    """
+    Executa o pipeline completo de reestruturação do livro didático.
+    Sem argumentos, processa `settings.INPUT_FILENAME` nos diretórios padrão.
+    Com `resume`, reaproveita o mapa da estrutura e o diário de checkpoints da
+    execução anterior e continua a geração de onde ela parou.
+    Retorna o caminho do documento final, ou None se o pipeline for interrompido.
+    """
+    logger.info("--- INICIANDO PIPELINE DE REESTRUTURAÇÃO DE LIVRO ---")
 
-        if full_unit_text_for_theme.strip():
-            global_retriever = retriever_builder.build_retriever(all_documents)
-            processed_content[unit_title]['theme'] = summary_generator.generate_unit_theme(unit_title, full_unit_text_for_theme, global_retriever)
+    input_docx_path = input_docx_path or settings.INPUT_DIR / settings.INPUT_FILENAME
+    artifact_paths = artifact_paths or settings.get_artifact_paths()
+    intermediate_dir = artifact_paths['intermediate']
+
+    # FASE 1: DESCONSTRUÇÃO E PREPARAÇÃO
+    intermediate_md_path = intermediate_dir / settings.MARKDOWN_FILENAME
+    with timed_stage("conversão"):
+        if settings.USE_CONVERSION_CACHE:
+            corrected_md_content, section_tree = conversion_cache.convert_with_cache(
+                input_docx_path, intermediate_md_path, settings.CONVERSION_CACHE_DIR
+            )
+        else:
+            original_md_content = document_handler.convert_docx_to_markdown(input_docx_path, intermediate_md_path)
+            corrected_md_content = document_handler.preprocess_markdown_headings(original_md_content)
+            section_tree = document_handler.build_section_tree(corrected_md_content, intermediate_md_path.name)
+    all_documents = section_tree['documents']
+
+    if not all_documents:
+        logger.critical("Pipeline interrompido: nenhum documento foi extraído do arquivo de entrada.")
+        return None
+
+    # FASE 2: MAPEAMENTO DA ESTRUTURA
+    structure_map_path = intermediate_dir / settings.STRUCTURE_MAP_FILENAME
+    with timed_stage("mapa da estrutura"):
+        if resume and structure_map_path.exists():
+            # O diário só vale para a mesma estrutura: não a geramos de novo ao retomar
+            logger.info(f"Retomando com o mapa da estrutura salvo em '{structure_map_path}'.")
+            structure_map = json.loads(structure_map_path.read_text(encoding='utf-8'))
+        else:
+            structure_map = structure_mapper.generate_structure_map(corrected_md_content, structure_map_path)
+        full_book_summary = create_full_book_summary_str(structure_map)
+
+        title_index = TitleIndex.from_section_tree(section_tree)
+        assign_structure_metadata(all_documents, structure_map, title_index)
+
+    # O livro é indexado uma única vez; capítulos e unidades usam visões filtradas
+    with timed_stage("indexação"):
+        book_index = retriever_builder.build_book_index(all_documents, artifact_paths['vectorstore'])
+
+    # FASE 3: GERAÇÃO E EXPANSÃO DE CONTEÚDO
+    logger.info("--- INICIANDO FASE DE GERAÇÃO E EXPANSÃO DE CONTEÚDO ---")
+    journal = CheckpointJournal(
+        intermediate_dir / settings.CHECKPOINT_FILENAME if settings.USE_CHECKPOINTS else None,
+        book_fingerprint(structure_map, full_book_summary), resume=resume,
+    )
+    try:
+        with timed_stage("geração"):
+            processed_content = generate_book_content(structure_map, title_index, book_index, full_book_summary, journal)
+    finally:
+        # A coleção da execução é efêmera; descartá-la evita que o banco vetorial cresça a cada execução
+        retriever_builder.drop_book_index(book_index, artifact_paths['vectorstore'])
 
     # FASE 5: MONTAGEM
-    output_path = settings.OUTPUT_DIR / settings.OUTPUT_FILENAME
-    document_assembler.create_final_document(processed_content, output_path)
-    
+    output_path = artifact_paths['output'] / settings.OUTPUT_FILENAME
+    with timed_stage("montagem"):
+        document_assembler.create_final_document(processed_content, output_path, intermediate_dir)
+
     logger.info("--- PIPELINE CONCLUÍDO COM SUCESSO ---")
+    return output_path
+
+# Tipos de tarefa (ver `task_category`) das chamadas de expansão, nos dois modos
+EXPANSION_TASKS = (
+    "Análise de Tópicos para Expansão", "Expansão do Tópico", "Integração de Conteúdo Expandido", "Expansão Única da Seção",
+)
+
+def expansion_telemetry() -> dict:
+    """
+    Custo da expansão das seções no processo: chamadas, tokens e tempo somado das
+    expansões (com seções em paralelo, a soma passa do tempo de relógio), para
+    comparar os modos "iterative" e "single_shot".
+    """
+    tasks = llm_handler.scheduler_task_metrics()
+    metrics = [tasks[task] for task in EXPANSION_TASKS if task in tasks]
+    return {
+        'mode': settings.EXPANSION_MODE,
+        'calls': sum(m['requests'] for m in metrics),
+        'prompt_tokens': sum(m['prompt_tokens'] for m in metrics),
+        'completion_tokens': sum(m['completion_tokens'] for m in metrics),
+        'seconds': stage_timings().get("expansão", {}).get('seconds', 0.0),
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reestruturação de livros didáticos.")
+    parser.add_argument(
+        "--batch", nargs="+", metavar="CAMINHO",
+        help="Processa em lote os arquivos .docx informados (arquivos ou diretórios)."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=settings.BATCH_MAX_WORKERS,
+        help="Número de livros processados em paralelo no modo em lote."
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Retoma a execução interrompida a partir do diário de checkpoints."
+    )
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    if not settings.OPENAI_API_KEY or "SUA_CHAVE_API_AQUI" in settings.OPENAI_API_KEY:
+    args = parse_args()
+    if settings.LLM_PROVIDER == "openai" and (not settings.OPENAI_API_KEY or "SUA_CHAVE_API_AQUI" in settings.OPENAI_API_KEY):
         logger.error("A chave da API da OpenAI não foi configurada. Verifique seu arquivo .env")
+    elif args.batch:
+        batch_runner.run_batch(args.batch, max_workers=args.workers, resume=args.resume)
     else:
         with get_openai_callback() as cb:
-            run_pipeline()
-            
+            run_pipeline(resume=args.resume)
+
             print("\n" + "="*50)
             logger.info("--- CUSTO TOTAL DO PIPELINE ---")
             logger.info(f"Total de Tokens: {cb.total_tokens}")
             logger.info(f"  - Tokens de Prompt: {cb.prompt_tokens}")
             logger.info(f"  - Tokens de Conclusão: {cb.completion_tokens}")
             logger.info(f"Custo Total (USD): ${cb.total_cost:.4f}")
+            cache_stats = llm_handler.response_cache_stats()
+            logger.info(f"Cache de respostas: {cache_stats['hits']} acertos, {cache_stats['misses']} falhas")
+            logger.info(f"  - Tokens economizados: {cache_stats['tokens_saved']} "
+                        f"(prompt: {cache_stats['prompt_tokens_saved']}, conclusão: {cache_stats['completion_tokens_saved']})")
+            batch_stats = llm_handler.batch_api_stats()
+            if batch_stats['requests']:
+                logger.info(f"Batch API: {batch_stats['requests']} requisições, "
+                            f"{batch_stats['prompt_tokens'] + batch_stats['completion_tokens']} tokens, "
+                            f"custo estimado ${batch_stats['cost']:.4f} (fora do total acima)")
+            log_scheduler_metrics(llm_handler.scheduler_metrics())
+            expansion = expansion_telemetry()
+            logger.info(f"Expansão ({expansion['mode']}): {expansion['calls']} chamadas, "
+                        f"{expansion['prompt_tokens']} tokens de prompt, {expansion['completion_tokens']} de conclusão, "
+                        f"{expansion['seconds']:.1f}s")
             print("="*50 + "\n")
\ No newline at end of file
@@ -5,7 +5,7 @@ from src.utils.logger import logger
 from config import settings 
 import re
 
-def create_final_document(processed_content: dict, output_path: Path):
+def create_final_document(processed_content: dict, output_path: Path, intermediate_dir: Path = None):
     """
     Monta uma string Markdown completa do livro e a converte para .docx usando pandoc e um reference.docx.
     """
@@ -37,7 +37,7 @@ def create_final_document(processed_content: dict, output_path: Path):
 
     final_markdown_string = "\n".join(final_markdown_lines)
     
-    final_md_path = settings.INTERMEDIATE_DIR / "final_book.md"
+    final_md_path = (intermediate_dir or settings.INTERMEDIATE_DIR) / "final_book.md"
     with open(final_md_path, 'w', encoding='utf-8') as f:
         f.write(final_markdown_string)
     
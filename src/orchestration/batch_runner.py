@@ -0,0 +1,169 @@
+import hashlib
+import multiprocessing
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from langchain_community.callbacks import get_openai_callback
+from config import settings
+from src.utils.logger import logger
+
+def collect_input_files(inputs: Iterable) -> List[Path]:
+    """
+    Expande a lista de entradas (arquivos .docx ou diretórios) em uma lista
+    ordenada e sem repetições de arquivos .docx.
+    """
+    files = []
+    for entry in inputs:
+        path = Path(entry)
+        if path.is_dir():
+            # Ignora os arquivos temporários de lock do Word (~$livro.docx)
+            files.extend(p for p in sorted(path.glob("*.docx")) if not p.name.startswith("~$"))
+        elif path.suffix.lower() == ".docx" and path.exists():
+            files.append(path)
+        else:
+            logger.warning(f"Entrada ignorada (não é um .docx ou diretório existente): '{entry}'")
+
+    unique_files = list(dict.fromkeys(p.resolve() for p in files))
+    return unique_files
+
+def assign_book_names(files: List[Path]) -> Dict[Path, str]:
+    """
+    Gera um nome de espaço de artefatos por livro a partir do nome do arquivo.
+    Arquivos homônimos em diretórios diferentes recebem um sufixo com o hash do caminho.
+    """
+    base_names = {path: re.sub(r'[^\w.-]+', '_', path.stem).strip('_') or "livro" for path in files}
+    name_counts = {}
+    for name in base_names.values():
+        name_counts[name] = name_counts.get(name, 0) + 1
+
+    book_names = {}
+    for path, name in base_names.items():
+        if name_counts[name] > 1:
+            name = f"{name}_{hashlib.sha1(str(path).encode('utf-8')).hexdigest()[:8]}"
+        book_names[path] = name
+    return book_names
+
+def _new_report(input_path: Path, book_name: str) -> dict:
+    """Relatório de um livro antes da execução (status 'erro' até o pipeline terminar)."""
+    return {
+        'book': book_name, 'input': str(input_path), 'output': None, 'status': 'erro', 'error': None,
+        'total_tokens': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'total_cost': 0.0, 'elapsed': 0.0,
+        'batch_api_requests': 0, 'batch_api_tokens': 0, 'batch_api_cost': 0.0,
+        'cache_hits': 0, 'cache_misses': 0, 'tokens_saved': 0, 'llm_metrics': {},
+    }
+
+def _run_book(input_path: Path, book_name: str, resume: bool = False, rate_limit_share: float = 1.0) -> dict:
+    """
+    Executa o pipeline para um livro em um processo de trabalho e devolve seu relatório.
+    Os processos dividem a conta da OpenAI, então cada um usa `rate_limit_share` dos limites de taxa.
+    """
+    # Importação tardia: o processo de trabalho carrega o pipeline apenas quando necessário
+    from main import run_pipeline
+    from src.utils.llm_handler import batch_api_stats, reset_scheduler, response_cache_stats, scheduler_metrics
+
+    report = _new_report(input_path, book_name)
+    # Um processo de trabalho pode executar vários livros: conta só a diferença deste
+    cache_before = response_cache_stats()
+    batch_before = batch_api_stats()
+    # Um agendador novo por livro: as métricas de vazão do relatório são só deste livro
+    reset_scheduler(rate_limit_share)
+    start = time.perf_counter()
+    try:
+        with get_openai_callback() as cb:
+            output_path = run_pipeline(input_path, settings.get_artifact_paths(book_name), resume=resume)
+        report.update({
+            'output': str(output_path) if output_path else None,
+            'status': 'concluído' if output_path else 'interrompido',
+            'total_tokens': cb.total_tokens,
+            'prompt_tokens': cb.prompt_tokens,
+            'completion_tokens': cb.completion_tokens,
+            'total_cost': cb.total_cost,
+        })
+        # As chamadas da Batch API não passam pelo callback: ficam em campos próprios, com o desconto
+        batch_after = batch_api_stats()
+        report.update({
+            'batch_api_requests': batch_after['requests'] - batch_before['requests'],
+            'batch_api_tokens': sum(batch_after[field] - batch_before[field] for field in ('prompt_tokens', 'completion_tokens')),
+            'batch_api_cost': batch_after['cost'] - batch_before['cost'],
+        })
+    except Exception as e:
+        report['error'] = f"{e}\n{traceback.format_exc()}"
+    cache_after = response_cache_stats()
+    report.update({
+        'cache_hits': cache_after['hits'] - cache_before['hits'],
+        'cache_misses': cache_after['misses'] - cache_before['misses'],
+        'tokens_saved': cache_after['tokens_saved'] - cache_before['tokens_saved'],
+        'llm_metrics': scheduler_metrics(),
+    })
+    report['elapsed'] = time.perf_counter() - start
+    return report
+
+def log_batch_report(reports: List[dict]):
+    """Registra o relatório consolidado de progresso e custo do lote."""
+    print("\n" + "="*50)
+    logger.info("--- RELATÓRIO DO PROCESSAMENTO EM LOTE ---")
+    for report in reports:
+        logger.info(
+            f"[{report['status']}] {report['book']}: {report['total_tokens']} tokens, "
+            f"${report['total_cost']:.4f}, {report['elapsed']:.1f}s, "
+            f"cache: {report['cache_hits']} acertos ({report['tokens_saved']} tokens economizados)"
+        )
+    logger.info(f"Livros concluídos: {sum(r['status'] == 'concluído' for r in reports)}/{len(reports)}")
+    logger.info(f"Total de Tokens: {sum(r['total_tokens'] for r in reports)}")
+    logger.info(f"  - Tokens de Prompt: {sum(r['prompt_tokens'] for r in reports)}")
+    logger.info(f"  - Tokens de Conclusão: {sum(r['completion_tokens'] for r in reports)}")
+    logger.info(f"Custo Total (USD): ${sum(r['total_cost'] for r in reports):.4f}")
+    if any(r['batch_api_requests'] for r in reports):
+        logger.info(f"Batch API: {sum(r['batch_api_requests'] for r in reports)} requisições, "
+                    f"{sum(r['batch_api_tokens'] for r in reports)} tokens, "
+                    f"custo estimado ${sum(r['batch_api_cost'] for r in reports):.4f} (fora do total acima)")
+    logger.info(f"Cache de respostas: {sum(r['cache_hits'] for r in reports)} acertos, {sum(r['cache_misses'] for r in reports)} falhas")
+    logger.info(f"  - Tokens economizados: {sum(r['tokens_saved'] for r in reports)}")
+    models = sorted({model for r in reports for model in r['llm_metrics']})
+    for model in models:
+        metrics = [r['llm_metrics'][model] for r in reports if model in r['llm_metrics']]
+        logger.info(
+            f"Modelo {model}: {sum(m['requests'] for m in metrics)} chamadas, "
+            f"{sum(m['retries'] for m in metrics)} novas tentativas, {sum(m['failures'] for m in metrics)} falhas"
+        )
+    print("="*50 + "\n")
+
+def run_batch(inputs: Iterable, max_workers: int = None, resume: bool = False) -> List[dict]:
+    """
+    Reestrutura vários livros em paralelo, um processo por livro, cada um com
+    seu próprio espaço de artefatos. Retorna os relatórios na ordem de entrada.
+    Com `resume`, cada livro continua do seu próprio diário de checkpoints.
+    """
+    files = collect_input_files(inputs)
+    if not files:
+        logger.error("Nenhum arquivo .docx encontrado para o processamento em lote.")
+        return []
+
+    max_workers = max(1, min(max_workers or settings.BATCH_MAX_WORKERS, len(files)))
+    book_names = assign_book_names(files)
+    logger.info(f"--- INICIANDO LOTE: {len(files)} livros, {max_workers} processos ---")
+
+    reports = {}
+    # 'spawn' evita herdar, via fork, clientes HTTP e threads do processo principal
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(_run_book, path, book_names[path], resume, 1.0 / max_workers): path for path in files}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                # O processo de trabalho morreu (ex.: falta de memória); os demais livros seguem
+                report = _new_report(path, book_names[path])
+                report.update({'status': 'falhou', 'error': f"{type(e).__name__}: {e}"})
+            reports[path] = report
+            logger.info(f"[{completed}/{len(files)}] Livro '{report['book']}': {report['status']} ({report['elapsed']:.1f}s)")
+            if report['error']:
+                logger.error(f"  - Falha no livro '{report['book']}': {report['error']}")
+
+    ordered_reports = [reports[path] for path in files]
+    log_batch_report(ordered_reports)
+    return ordered_reports
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from src.utils.logger import logger
+
+def book_fingerprint(structure_map: dict, full_book_summary: str) -> str:
+    """Identifica o livro e a estrutura a que um diário de checkpoints se refere."""
+    payload = json.dumps(structure_map, ensure_ascii=False, sort_keys=True) + "\0" + full_book_summary
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def inputs_digest(args: tuple) -> str:
+    """Resumo dos argumentos de texto de uma tarefa (os demais, como retrievers, são ignorados)."""
+    texts = [arg for arg in args if isinstance(arg, str)]
+    return hashlib.sha256(json.dumps(texts, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+def is_complete(result: Any) -> bool:
+    """
+    Se o resultado de uma tarefa merece ser registrado. Resultados vazios vêm de
+    chamadas que falharam (texto vazio, seção sem texto, JSON com algum campo
+    vazio, como o resumo do enriquecimento combinado) e não são registrados, para
+    que a retomada tente de novo.
+    """
+    if isinstance(result, (tuple, list, dict)):
+        items = result.values() if isinstance(result, dict) else result
+        return bool(result) and all(is_complete(item) for item in items)
+    if isinstance(result, str):
+        return bool(result.strip())
+    return result is not None
+
+class CheckpointJournal:
+    """
+    Diário incremental (JSON Lines) das tarefas concluídas na geração de um livro.
+    Cada linha guarda o nome da tarefa e seu resultado, gravada e sincronizada no
+    disco assim que a tarefa termina. Ao retomar, as tarefas registradas devolvem o
+    resultado salvo sem chamar o LLM, desde que seus argumentos de texto sejam os
+    mesmos (ex.: um capítulo cuja seção foi refeita tem resumo refeito também).
+    Resultados vazios (ver `is_complete`) não são registrados. Sem `path`, o diário
+    fica só em memória.
+    """
+
+    def __init__(self, path: Optional[Path], fingerprint: str, resume: bool = False):
+        self.path = Path(path) if path is not None else None
+        self.fingerprint = fingerprint
+        self._inputs: Dict[str, str] = {}
+        self.results: Dict[str, Any] = self._load() if resume else {}
+        self.resumed = len(self.results)
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self._rewrite()
+
+    def _load(self) -> Dict[str, Any]:
+        if self.path is None or not self.path.exists():
+            logger.info("Nenhum checkpoint encontrado; a geração começa do início.")
+            return {}
+        records = []
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Última linha truncada por uma interrupção durante a gravação
+                    break
+        if not records or records[0].get('fingerprint') != self.fingerprint:
+            logger.warning(f"O checkpoint '{self.path}' é de outro livro ou estrutura; a geração começa do início.")
+            return {}
+        results = {record['task']: record['result'] for record in records[1:]}
+        self._inputs = {record['task']: record.get('inputs') for record in records[1:]}
+        logger.info(f"Retomando a partir do checkpoint: {len(results)} tarefas já concluídas.")
+        return results
+
+    def _rewrite(self):
+        """Regrava o diário só com o cabeçalho e os registros válidos, descartando linhas truncadas."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'fingerprint': self.fingerprint}) + "\n")
+            for task_name, result in self.results.items():
+                f.write(json.dumps(self._entry(task_name, result), ensure_ascii=False) + "\n")
+        os.replace(temp_path, self.path)
+
+    def _entry(self, task_name: str, result: Any) -> dict:
+        return {'task': task_name, 'inputs': self._inputs.get(task_name), 'result': result}
+
+    def completed(self, task_name: str, *args) -> bool:
+        """Se a tarefa está registrada com os mesmos argumentos de texto."""
+        return task_name in self.results and self._inputs.get(task_name) == inputs_digest(args)
+
+    def record(self, task_name: str, result: Any, *args):
+        """
+        Registra o resultado da tarefa com o resumo dos seus argumentos (`args`),
+        exceto se estiver vazio: a tarefa fica pendente e a retomada a refaz.
+        """
+        if not is_complete(result):
+            logger.warning(f"A tarefa '{task_name}' não produziu resultado e não foi registrada no checkpoint.")
+            return
+        with self._lock:
+            self.results[task_name] = result
+            self._inputs[task_name] = inputs_digest(args)
+            if self.path is None:
+                return
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(self._entry(task_name, result), ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def step(self, task_name: str, func: Callable[..., Any], *args) -> Any:
+        """Executa a tarefa e registra o resultado, ou devolve o resultado já registrado."""
+        if self.completed(task_name, *args):
+            return self.results[task_name]
+        result = func(*args)
+        self.record(task_name, result, *args)
+        return result
+
+    async def astep(self, task_name: str, func: Callable[..., Any], *args) -> Any:
+        """Versão de `step` para corrotinas."""
+        if self.completed(task_name, *args):
+            return self.results[task_name]
+        result = await func(*args)
+        self.record(task_name, result, *args)
+        return result
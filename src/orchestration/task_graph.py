@@ -0,0 +1,100 @@
+import contextvars
+import heapq
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+from src.utils.logger import logger
+
+@dataclass
+class Task:
+    name: str
+    func: Callable[..., Any]
+    dependencies: Tuple[str, ...]
+    priority: int
+    order: int
+
+class TaskGraph:
+    """
+    Grafo de tarefas com dependências explícitas. `run` executa em paralelo
+    (até `max_workers` threads) toda tarefa cujas dependências já terminaram,
+    escolhendo entre as prontas pela menor prioridade e, no empate, pela ordem
+    de inserção. Cada tarefa recebe como argumentos os resultados das suas
+    dependências, na ordem em que foram declaradas.
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, Task] = {}
+
+    def add(self, name: str, func: Callable[..., Any], dependencies=(), priority: int = 0) -> str:
+        if name in self.tasks:
+            raise ValueError(f"Tarefa duplicada no grafo: '{name}'.")
+        self.tasks[name] = Task(name, func, tuple(dependencies), priority, len(self.tasks))
+        return name
+
+    def _dependents(self) -> Dict[str, List[str]]:
+        dependents = {name: [] for name in self.tasks}
+        for task in self.tasks.values():
+            for dependency in task.dependencies:
+                if dependency not in self.tasks:
+                    raise ValueError(f"A tarefa '{task.name}' depende de '{dependency}', que não existe.")
+                dependents[dependency].append(task.name)
+        return dependents
+
+    def _check_acyclic(self, dependents: Dict[str, List[str]]):
+        pending = {name: len(task.dependencies) for name, task in self.tasks.items()}
+        queue = [name for name, count in pending.items() if count == 0]
+        visited = 0
+        while queue:
+            name = queue.pop()
+            visited += 1
+            for dependent in dependents[name]:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    queue.append(dependent)
+        if visited != len(self.tasks):
+            cyclic = sorted(name for name, count in pending.items() if count > 0)
+            raise ValueError(f"O grafo de tarefas tem ciclos envolvendo: {cyclic}")
+
+    def run(self, max_workers: int) -> Dict[str, Any]:
+        """
+        Executa o grafo e devolve o resultado de cada tarefa. Se uma tarefa falhar,
+        nenhuma nova é iniciada, as que estão em andamento terminam e o erro é propagado.
+        """
+        dependents = self._dependents()
+        self._check_acyclic(dependents)
+
+        pending = {name: len(task.dependencies) for name, task in self.tasks.items()}
+        ready = [(task.priority, task.order, name) for name, task in self.tasks.items() if not task.dependencies]
+        heapq.heapify(ready)
+        results: Dict[str, Any] = {}
+        running = {}
+        error = None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while running or (ready and error is None):
+                while ready and error is None and len(running) < max_workers:
+                    _, _, name = heapq.heappop(ready)
+                    task = self.tasks[name]
+                    args = [results[dependency] for dependency in task.dependencies]
+                    # Copia o contexto para que callbacks como o get_openai_callback vejam as chamadas
+                    context = contextvars.copy_context()
+                    running[executor.submit(context.run, task.func, *args)] = name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        logger.error(f"  - Tarefa '{name}' falhou: {e}")
+                        error = error or e
+                        continue
+                    for dependent in dependents[name]:
+                        pending[dependent] -= 1
+                        if pending[dependent] == 0:
+                            heapq.heappush(ready, (self.tasks[dependent].priority, self.tasks[dependent].order, dependent))
+
+        if error is not None:
+            raise error
+        return results
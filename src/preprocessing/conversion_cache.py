@@ -0,0 +1,175 @@
+import hashlib
+import json
+import re
+import types
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import pypandoc
+from langchain_core.documents import Document
+
+from config import settings
+from src.preprocessing import document_handler
+from src.utils.logger import logger
+
+CACHE_FORMAT_VERSION = 2
+ORIGINAL_MARKDOWN_FILENAME = "livro_original.md"
+CORRECTED_MARKDOWN_FILENAME = "livro_corrigido.md"
+SECTIONS_FILENAME = "secoes.json"
+
+def _file_sha256(path: Path) -> str:
+    """Calcula o hash SHA-256 do arquivo lendo-o em blocos."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _stable_repr(value) -> str:
+    """
+    Representação de um valor que não muda entre processos: primitivos, coleções
+    deles (conjuntos ordenados), expressões regulares, funções e código. Outros
+    objetos teriam um repr com endereço de memória (ex.: "<Obj at 0x...>"), que
+    mudaria a chave a cada execução, e são recusados com ValueError.
+    """
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return repr(value)
+    if isinstance(value, (tuple, list)):
+        return f"{type(value).__name__}({', '.join(map(_stable_repr, value))})"
+    if isinstance(value, (set, frozenset)):
+        # A ordem de um conjunto (ex.: `x in {"a", "b"}`) muda entre processos
+        return f"set({', '.join(sorted(map(_stable_repr, value)))})"
+    if isinstance(value, dict):
+        return f"dict({', '.join(sorted(f'{_stable_repr(k)}: {_stable_repr(v)}' for k, v in value.items()))})"
+    if isinstance(value, re.Pattern):
+        return f"re({value.pattern!r}, {value.flags})"
+    if isinstance(value, types.CodeType):
+        return _code_fingerprint(value)
+    if callable(value):
+        return _describe_rule(value)
+    raise ValueError(f"O valor {type(value).__qualname__} não tem representação estável para a chave do cache.")
+
+def _code_fingerprint(code: types.CodeType) -> str:
+    """Hash do bytecode, das constantes e dos nomes usados por uma função (inclusive funções internas)."""
+    payload = repr((code.co_code, _stable_repr(code.co_consts), code.co_names))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def _describe_rule(rule) -> str:
+    """
+    Descrição estável de uma regra de limpeza: nome qualificado, argumentos fixos e,
+    para funções, o hash do seu código e os valores capturados, para que duas
+    lambdas (todas "<lambda>") ou uma regra editada não compartilhem a mesma
+    entrada do cache. Levanta ValueError se a regra usa valores sem
+    representação estável (ver `_stable_repr`).
+    """
+    if isinstance(rule, partial):
+        return f"{_describe_rule(rule.func)}{_stable_repr(rule.args)}{_stable_repr(rule.keywords)}"
+    if not hasattr(rule, '__qualname__'):
+        # Objeto chamável: a classe e o seu estado
+        cls = type(rule)
+        return f"{cls.__module__}.{cls.__qualname__}{_stable_repr(getattr(rule, '__dict__', {}))}"
+    name = f"{getattr(rule, '__module__', '')}.{rule.__qualname__}"
+    code = getattr(rule, '__code__', None)
+    if code is None:
+        return name
+    closure = tuple(cell.cell_contents for cell in rule.__closure__ or ())
+    return f"{name}#{_code_fingerprint(code)}{_stable_repr(rule.__defaults__)}{_stable_repr(closure)}"
+
+def _pandoc_version() -> str:
+    try:
+        return pypandoc.get_pandoc_version()
+    except OSError:
+        return "indisponivel"
+
+def compute_cache_key(input_path: Path, rules: Sequence[document_handler.CleaningRule], converter: str = None) -> str:
+    """
+    Chave do cache: hash do arquivo de entrada, das regras de limpeza, do
+    conversor escolhido e da versão do pandoc (quando ele pode ser usado).
+    """
+    converter = converter or settings.DOCX_CONVERTER
+    parts = [
+        f"formato={CACHE_FORMAT_VERSION}",
+        f"arquivo={_file_sha256(input_path)}",
+        f"conversor={converter}",
+        f"pandoc={_pandoc_version() if converter != 'native' else '-'}",
+        *(f"regra={_describe_rule(rule)}" for rule in rules),
+    ]
+    return hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()
+
+def load_cached_conversion(cache_dir: Path, key: str) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+    """Carrega o Markdown original, o corrigido e a árvore de seções do cache, se existirem."""
+    entry_dir = cache_dir / key
+    sections_path = entry_dir / SECTIONS_FILENAME
+    original_path = entry_dir / ORIGINAL_MARKDOWN_FILENAME
+    markdown_path = entry_dir / CORRECTED_MARKDOWN_FILENAME
+    # O arquivo de seções é gravado por último, então sua presença indica uma entrada completa
+    if not sections_path.exists() or not markdown_path.exists() or not original_path.exists():
+        return None
+
+    try:
+        with open(sections_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        original_md_content = original_path.read_text(encoding='utf-8')
+        corrected_md_content = markdown_path.read_text(encoding='utf-8')
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Entrada de cache corrompida em '{entry_dir}', ignorando. Erro: {e}")
+        return None
+
+    data['documents'] = [
+        Document(page_content=doc['page_content'], metadata=doc['metadata'])
+        for doc in data['documents']
+    ]
+    return original_md_content, corrected_md_content, data
+
+def save_cached_conversion(cache_dir: Path, key: str, original_md_content: str, corrected_md_content: str,
+                           section_tree: Dict[str, Any]):
+    """Salva o Markdown original, o corrigido e a árvore de seções serializada no cache."""
+    entry_dir = cache_dir / key
+    entry_dir.mkdir(parents=True, exist_ok=True)
+
+    (entry_dir / ORIGINAL_MARKDOWN_FILENAME).write_text(original_md_content, encoding='utf-8')
+    (entry_dir / CORRECTED_MARKDOWN_FILENAME).write_text(corrected_md_content, encoding='utf-8')
+
+    serialized_tree = dict(section_tree)
+    serialized_tree['documents'] = [
+        {'page_content': doc.page_content, 'metadata': doc.metadata}
+        for doc in section_tree['documents']
+    ]
+    with open(entry_dir / SECTIONS_FILENAME, 'w', encoding='utf-8') as f:
+        json.dump(serialized_tree, f, ensure_ascii=False)
+
+def convert_with_cache(
+    input_path: Path,
+    intermediate_md_path: Path,
+    cache_dir: Path,
+    rules: Sequence[document_handler.CleaningRule] = document_handler.DEFAULT_CLEANING_RULES,
+    converter: str = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Executa a etapa DOCX → Markdown → seções, reutilizando o resultado salvo
+    quando o arquivo de entrada, as regras, o conversor e o pandoc não mudaram.
+    No acerto, o Markdown original também é regravado em `intermediate_md_path`,
+    como na conversão. Retorna o Markdown corrigido e a árvore de seções.
+    """
+    try:
+        key = compute_cache_key(input_path, rules, converter)
+    except ValueError as e:
+        logger.warning(f"Conversão de '{input_path.name}' sem cache: {e}")
+        key = None
+    cached = load_cached_conversion(cache_dir, key) if key else None
+    if cached is not None:
+        logger.info(f"Conversão de '{input_path.name}' encontrada no cache ({key[:12]}). Pulando a conversão.")
+        original_md_content, corrected_md_content, section_tree = cached
+        intermediate_md_path.write_text(original_md_content, encoding='utf-8')
+        return corrected_md_content, section_tree
+
+    original_md_content = document_handler.convert_docx_to_markdown(input_path, intermediate_md_path, rules, converter)
+    corrected_md_content = document_handler.preprocess_markdown_headings(original_md_content)
+    section_tree = document_handler.build_section_tree(corrected_md_content, intermediate_md_path.name)
+    if key is None:
+        return corrected_md_content, section_tree
+
+    save_cached_conversion(cache_dir, key, original_md_content, corrected_md_content, section_tree)
+    logger.info(f"Conversão de '{input_path.name}' salva no cache ({key[:12]}).")
+    return corrected_md_content, section_tree
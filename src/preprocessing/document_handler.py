@@ -1,91 +1,137 @@
+import io
 import pypandoc 
 import re 
+from functools import partial
 from pathlib import Path 
-from typing import List 
+from typing import Any, Callable, Dict, List, Optional, Sequence
 from langchain_core.documents import Document 
+from config import settings
+from src.preprocessing import native_converter
 from src.utils.logger import logger 
 
 import docx 
 from docx.document import Document as DocumentClass 
-from docx.oxml.table import CT_Tbl 
 from docx.oxml.text.paragraph import CT_P
 
-def remove_section_from_docx(doc: DocumentClass, section_title: str):
+# --- Regras de limpeza do DOCX ---
+# Cada regra recebe o texto de um parágrafo do corpo e devolve uma ação
+# (REMOVE ou TRUNCATE) ou None para manter o parágrafo.
+REMOVE = "remove"      # remove apenas o parágrafo
+TRUNCATE = "truncate"  # remove o parágrafo e todo o conteúdo a partir dele
+
+CleaningRule = Callable[[str], Optional[str]]
+
+URL_PATTERN = re.compile(r'https?://\S+')
+
+def truncate_at_section(text: str, section_title: str) -> Optional[str]:
+    """Regra: encontra um título de seção e remove todo o conteúdo a partir dele."""
+    if section_title.lower() in text.lower():
+        return TRUNCATE
+    return None
+
+def drop_image_sources(text: str) -> Optional[str]:
+    """Regra: remove parágrafos que contêm URLs de imagens e a linha de fonte correspondente."""
+    if URL_PATTERN.search(text) or text.strip().lower().startswith('fonte:'):
+        return REMOVE
+    return None
+
+DEFAULT_CLEANING_RULES: List[CleaningRule] = [
+    partial(truncate_at_section, section_title="Exercícios resolvidos"),
+    drop_image_sources,
+]
+
+def clean_docx_body(doc: DocumentClass, rules: Sequence[CleaningRule] = DEFAULT_CLEANING_RULES) -> int:
     """
-    Encontra um título de seção e remove todo o conteúdo a partir dele.
+    Aplica todas as regras de limpeza em uma única passada pelo XML do corpo
+    do documento. Retorna o número de elementos removidos.
     """
-    logger.info(f"Procurando e removendo a seção: '{section_title}'")
+    logger.info("Limpando o corpo do documento (seções descartadas, URLs de imagens e fontes)...")
+    body = doc.element.body
     elements_to_remove = []
-    found_section = False 
+    truncated = False
 
     # Itera sobre todos os elementos do corpo do documento (parágrafos e tabelas)
-    for element in doc.element.body:
-        if found_section:
+    for element in body:
+        if truncated:
             elements_to_remove.append(element)
-        elif isinstance(element, CT_P):
-            p = docx.text.paragraph.Paragraph(element, doc)
-            if section_title.lower() in p.text.lower():
-                found_section = True 
-                elements_to_remove.append(element)
-        
-    if found_section:
-        for element in elements_to_remove:
-            doc.element.body.remove(element)
-        logger.info(f"Seção '{section_title}' removida com sucesso.")
-    else:
-        logger.warning(f"A seção '{section_title}' não foi encontrada no documento.")    
-
-def remove_image_urls_from_docx(doc: DocumentClass):
-    """
-    Remove parágrafos que contêm URLs de imagens e a linha de fonte correspondente.
-    """
-    logger.info("Removendo URLs de imagens e fontes do documento...")
-    paragraphs_to_remove = []
-
-    for p in doc.paragraphs:
-        if re.search(r'https?://\S+', p.text):
-            paragraphs_to_remove.append(p)
-        elif p.text.strip().lower().startswith('fonte:'):
-            paragraphs_to_remove.append(p)
-
-    for p in paragraphs_to_remove:
-        parent_element = p._p.getparent()
-        if parent_element is not None:
-            parent_element.remove(p._p)
-            
-    logger.info(f"{len(paragraphs_to_remove)} parágrafos contendo URLs/fontes foram removidos.")
-
-def convert_docx_to_markdown(input_path: Path, output_path: Path, intermediate_dir: Path):
-    """Converte um arquivo .docx para Markdown usando pandoc."""
-    logger.info(f"Convertendo '{input_path.name}' para Markdown...")
+            continue
+        if not isinstance(element, CT_P):
+            continue
 
-    # 1. Carregar o documento 
-    doc = docx.Document(input_path)
+        text = element.text
+        for rule in rules:
+            action = rule(text)
+            if action == TRUNCATE:
+                truncated = True
+                elements_to_remove.append(element)
+                break
+            if action == REMOVE:
+                elements_to_remove.append(element)
+                break
 
-    # 2. Aplicar as limpezas 
-    remove_section_from_docx(doc, "Exercícios resolvidos")
-    remove_image_urls_from_docx(doc)
+    for element in elements_to_remove:
+        body.remove(element)
 
-    # 3. Salva um arquivo .docx limpo temporariamente 
-    cleaned_docx_path = intermediate_dir / "cleaned_document.docx"
-    doc.save(cleaned_docx_path)
-    logger.info(f"Documento limpo salvo temporariamente em '{cleaned_docx_path}'")
+    logger.info(f"{len(elements_to_remove)} elementos removidos do documento.")
+    return len(elements_to_remove)
 
-    # 4. Converter o documento limpo para Markdown
-    logger.info(f"Convertendo documento limpo para Markdown...")
+def convert_docx_with_pandoc(doc: DocumentClass) -> str:
+    """Converte o documento para Markdown com o pandoc, enviando-o pela entrada padrão."""
+    cleaned_docx = io.BytesIO()
+    doc.save(cleaned_docx)
 
     try:
-        pypandoc.convert_file(
-            source_file=str(cleaned_docx_path),
+        return pypandoc.convert_text(
+            source=cleaned_docx.getvalue(),
             to='markdown',
-            outputfile=str(output_path),
+            format='docx',
             extra_args=['--wrap=none'] # evita quebra de linhas indesejadas 
         )
-        logger.info(f"Arquivo Markdown salvo em '{output_path}'")
     except Exception as e:
         logger.error(f"Falha ao converter DOCX para Markdown. Certifique-se que o Pandoc está instalado. Erro: {e}")
         raise
 
+def convert_docx_to_markdown(
+    input_path: Path,
+    output_path: Path,
+    rules: Sequence[CleaningRule] = DEFAULT_CLEANING_RULES,
+    converter: str = None,
+) -> str:
+    """
+    Limpa um arquivo .docx em memória e o converte para Markdown.
+
+    O conversor é escolhido por `converter` (padrão: `settings.DOCX_CONVERTER`):
+    'native' usa o conversor em Python puro, 'pandoc' envia o documento limpo ao
+    pandoc pela entrada padrão e 'auto' usa o nativo, recorrendo ao pandoc quando
+    o documento tem conteúdo que o nativo não representa.
+    Retorna o Markdown gerado, que também é salvo em `output_path`.
+    """
+    converter = converter or settings.DOCX_CONVERTER
+    logger.info(f"Convertendo '{input_path.name}' para Markdown (conversor: {converter})...")
+
+    # 1. Carregar o documento 
+    doc = docx.Document(input_path)
+
+    # 2. Aplicar as limpezas 
+    clean_docx_body(doc, rules)
+
+    # 3. Converter o documento limpo para Markdown
+    if converter == 'auto':
+        unsupported = native_converter.find_unsupported_content(doc)
+        if unsupported:
+            logger.info(f"Conteúdo não suportado pelo conversor nativo ({', '.join(unsupported)}). Usando o pandoc.")
+        converter = 'pandoc' if unsupported else 'native'
+
+    if converter == 'native':
+        markdown_content = native_converter.docx_to_markdown(doc)
+    else:
+        markdown_content = convert_docx_with_pandoc(doc)
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(markdown_content)
+    logger.info(f"Arquivo Markdown salvo em '{output_path}'")
+    return markdown_content
+
 def preprocess_markdown_headings(content: str) -> str:
     """
     Corrige o Markdown para usar # e ## ao invés de ** para títulos.
@@ -111,23 +157,30 @@ def preprocess_markdown_headings(content: str) -> str:
     
     return "\n".join(processed_lines)
 
-def load_and_split_by_structure(content: str, source_name: str) -> List[Document]:
+def build_section_tree(content: str, source_name: str) -> Dict[str, Any]:
     """
-    Divide o conteúdo de uma string Markdown em Documentos, agrupando o conteúdo
-    de subtítulos sob seus títulos pais.
+    Monta, em uma única passada pelo Markdown, a árvore unidade → seção → subseção
+    e os Documentos agrupados (o conteúdo dos subtítulos fica sob o título pai).
+
+    Retorna um dicionário com:
+      - 'source': nome da fonte;
+      - 'documents': lista final de Documentos agrupados;
+      - 'units': {título da unidade: nó}, onde cada nó de unidade tem 'title',
+        'document' (índice em 'documents' ou None) e 'sections'
+        ({título '## ...': {'title', 'document', 'subsections'}}).
     """
     logger.info(f"Estruturando o conteúdo do Markdown de forma hierárquica: '{source_name}'")
-    
+
     # Adiciona uma linha de título final para garantir que a última seção seja capturada
     content += "\n# FIM DO DOCUMENTO"
-    lines = content.split('\n')
-    
+
     documents = []
+    subsections_by_title = {}
     current_section_content = []
     current_section_title = ""
     current_unit_title = ""
 
-    for line in lines:
+    for line in content.split('\n'):
         stripped_line = line.strip()
         is_unit_title = stripped_line.startswith('# ')
         is_section_title = stripped_line.startswith('## ')
@@ -141,7 +194,7 @@ def load_and_split_by_structure(content: str, source_name: str) -> List[Document
                         page_content=page_content,
                         metadata={'source': source_name, 'title': current_section_title}
                     ))
-            
+
             # Reseta para a nova seção
             current_section_content = []
             if is_unit_title:
@@ -153,44 +206,74 @@ def load_and_split_by_structure(content: str, source_name: str) -> List[Document
         else:
             # É uma linha de conteúdo, adiciona ao bloco atual
             current_section_content.append(line)
-    
-    # Agora, vamos agrupar o conteúdo.
-    # Cria um dicionário de seções, ex: {'# U1\n## S1': 'conteúdo', '# U1\n## S1.1': 'conteúdo'}
-    section_dict = {doc.metadata['title']: doc.page_content for doc in documents}
+            if stripped_line.startswith('###'):
+                subsections_by_title.setdefault(current_section_title, []).append(stripped_line)
+
+    # Indexa as seções de cada unidade. Um título repetido mantém a posição da
+    # primeira ocorrência e o conteúdo da última.
+    section_texts_by_unit = {}
+    units_with_own_text = set()
+    for doc in documents:
+        unit_title, _, section_title = doc.metadata['title'].partition('\n')
+        unit_sections = section_texts_by_unit.setdefault(unit_title, {})
+        if section_title:
+            unit_sections[section_title] = doc.page_content
+        else:
+            units_with_own_text.add(unit_title)
+
+    units = {
+        unit_title: {'title': unit_title, 'document': None, 'sections': {}}
+        for unit_title in section_texts_by_unit
+    }
     final_documents = []
 
-    # Itera pelos documentos originais para agrupar o conteúdo
+    # Agrupa o conteúdo: uma unidade com texto próprio absorve todas as suas seções;
+    # caso contrário, cada seção vira um documento independente.
     for doc in documents:
-        title = doc.metadata['title']
-        content = doc.page_content
-        
-        # Encontra todos os subtítulos diretos desta seção
-        subtitles = [
-            other_title for other_title in section_dict 
-            if other_title.startswith(title + "\n") and title != other_title
-        ]
-        
-        # Se esta seção tem subtítulos, seu conteúdo final é a junção do seu texto
-        # E do texto completo de todos os seus subtítulos.
-        if subtitles:
-            full_content_list = [content]
-            for subtitle in subtitles:
-                full_content_list.append(subtitle.split('\n')[-1]) # Adiciona o próprio subtítulo
-                full_content_list.append(section_dict[subtitle]) # Adiciona o conteúdo do subtítulo
-            
-            final_content = "\n\n".join(full_content_list)
-            
-            # Atualiza o conteúdo ou cria um novo documento
-            existing_doc = next((d for d in final_documents if d.metadata['title'] == title), None)
-            if existing_doc:
-                existing_doc.page_content = final_content
+        unit_title, _, section_title = doc.metadata['title'].partition('\n')
+        unit_node = units[unit_title]
+        unit_sections = section_texts_by_unit[unit_title]
+
+        if not section_title:
+            if unit_sections:
+                full_content_list = [doc.page_content]
+                for subtitle, subtitle_content in unit_sections.items():
+                    full_content_list.append(subtitle) # Adiciona o próprio subtítulo
+                    full_content_list.append(subtitle_content) # Adiciona o conteúdo do subtítulo
+                final_content = "\n\n".join(full_content_list)
+
+                if unit_node['document'] is not None:
+                    final_documents[unit_node['document']].page_content = final_content
+                else:
+                    unit_node['document'] = len(final_documents)
+                    final_documents.append(Document(page_content=final_content, metadata=doc.metadata))
             else:
-                final_documents.append(Document(page_content=final_content, metadata=doc.metadata))
-        else:
-            # Se não tem subtítulos, apenas adiciona se já não foi incluído
-            is_subtopic_of_another = any(title.startswith(d.metadata['title'] + "\n") for d in documents if d.metadata['title'] != title)
-            if not is_subtopic_of_another:
+                unit_node['document'] = len(final_documents)
                 final_documents.append(doc)
+        elif unit_title not in units_with_own_text:
+            unit_node['sections'][section_title] = {
+                'title': section_title,
+                'document': len(final_documents),
+                'subsections': subsections_by_title.get(doc.metadata['title'], []),
+            }
+            final_documents.append(doc)
+
+    # As seções absorvidas pela unidade apontam para o documento da própria unidade
+    for unit_title in units_with_own_text:
+        unit_node = units[unit_title]
+        for section_title in section_texts_by_unit[unit_title]:
+            unit_node['sections'][section_title] = {
+                'title': section_title,
+                'document': unit_node['document'],
+                'subsections': subsections_by_title.get(f"{unit_title}\n{section_title}", []),
+            }
 
     logger.info(f"Documento agrupado em {len(final_documents)} seções lógicas principais.")
-    return final_documents
\ No newline at end of file
+    return {'source': source_name, 'documents': final_documents, 'units': units}
+
+def load_and_split_by_structure(content: str, source_name: str) -> List[Document]:
+    """
+    Divide o conteúdo de uma string Markdown em Documentos, agrupando o conteúdo
+    de subtítulos sob seus títulos pais.
+    """
+    return build_section_tree(content, source_name)['documents']
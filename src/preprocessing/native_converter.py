@@ -0,0 +1,230 @@
+import re
+from typing import List, Optional, Tuple
+
+from docx.document import Document as DocumentClass
+from docx.oxml.table import CT_Tbl
+from docx.oxml.text.paragraph import CT_P
+from docx.text.run import Run
+
+# Conversor DOCX → Markdown em Python puro, usado no lugar do pandoc quando o
+# documento só tem o que o pipeline precisa: títulos, parágrafos (com negrito e
+# itálico), listas e tabelas simples. A saída segue as convenções do Markdown do
+# pandoc que `preprocess_markdown_headings` espera (ex.: títulos em negrito como
+# "**UNIDADE 1**"). Conteúdo que o conversor não representa é detectado por
+# `find_unsupported_content` para que o pandoc seja usado como alternativa.
+
+HEADING_STYLE_PATTERN = re.compile(r'^(?:heading|t[íi]tulo)\s*(\d)$', re.IGNORECASE)
+# O pandoc envia esses estilos para os metadados; sem --standalone, eles não aparecem no corpo
+METADATA_STYLES = {"title", "subtitle", "título", "subtítulo"}
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+INLINE_ESCAPE_PATTERN = re.compile(r'([\\*\[\]<>$^~`|])')
+UNDERSCORE_PATTERN = re.compile(r'(?<![0-9A-Za-zÀ-ÿ])_|_(?![0-9A-Za-zÀ-ÿ])')
+DASHES_PATTERN = re.compile(r'-(?=-)')
+BLOCK_START_PATTERN = re.compile(r'^(#|@|[-+]\s|\d+[.)](?:\s|$))')
+
+# Elementos que o conversor nativo não sabe representar: (descrição, XPath)
+UNSUPPORTED_CONTENT = [
+    ("equações", './/m:oMath | .//m:oMathPara'),
+    ("notas de rodapé", './/w:footnoteReference | .//w:endnoteReference'),
+    ("caixas de texto", './/w:txbxContent'),
+    ("tabelas aninhadas", './/w:tbl//w:tbl'),
+    ("células mescladas", './/w:tbl//w:gridSpan | .//w:tbl//w:vMerge'),
+    ("controles de conteúdo", './w:sdt'),
+    ("revisões controladas", './/w:del | .//w:moveFrom'),
+    ("figuras", './/w:drawing | .//w:pict'),
+]
+
+def find_unsupported_content(doc: DocumentClass) -> List[str]:
+    """Retorna a lista de tipos de conteúdo do documento que exigem o pandoc."""
+    body = doc.element.body
+    return [description for description, xpath in UNSUPPORTED_CONTENT if body.xpath(xpath)]
+
+def _escape_inline(text: str) -> str:
+    text = INLINE_ESCAPE_PATTERN.sub(r'\\\1', text)
+    text = UNDERSCORE_PATTERN.sub(r'\\_', text)
+    # "--" e "---" seriam convertidos em travessões pelo leitor de Markdown
+    return DASHES_PATTERN.sub(r'\\-', text)
+
+def _escape_block_start(text: str) -> str:
+    """Evita que o início do parágrafo seja lido como título, lista ou citação."""
+    match = BLOCK_START_PATTERN.match(text)
+    if not match:
+        return text
+    marker = match.group(1)
+    if marker[0].isdigit():
+        digits = marker.rstrip(' ')[:-1]
+        return f"{digits}\\{text[len(digits):]}"
+    return f"\\{text}"
+
+def _style_bold(run: Run) -> bool:
+    style = run.style
+    return bool(style is not None and style.font.bold)
+
+def _style_italic(run: Run) -> bool:
+    style = run.style
+    return bool(style is not None and style.font.italic)
+
+def _paragraph_runs(p_element: CT_P, parent) -> List[Run]:
+    """Runs do parágrafo, incluindo os que estão dentro de hyperlinks e inserções."""
+    return [Run(r, parent) for r in p_element.xpath('./w:r | ./w:hyperlink/w:r | ./w:ins/w:r | ./w:smartTag/w:r')]
+
+def _render_inline(p_element: CT_P, parent) -> str:
+    """Converte os runs de um parágrafo em texto Markdown com negrito e itálico."""
+    segments: List[Tuple[str, bool, bool]] = []
+    for run in _paragraph_runs(p_element, parent):
+        text = run.text
+        if not text:
+            continue
+        bold = run.bold if run.bold is not None else _style_bold(run)
+        italic = run.italic if run.italic is not None else _style_italic(run)
+        if segments and segments[-1][1:] == (bold, italic):
+            segments[-1] = (segments[-1][0] + text, bold, italic)
+        else:
+            segments.append((text, bold, italic))
+
+    # Agrupa os trechos em negrito e, dentro deles, os trechos em itálico,
+    # como o pandoc faz (ex.: "**A*B***C")
+    pieces = []
+    index = 0
+    while index < len(segments):
+        bold = segments[index][1]
+        group_end = index
+        while group_end < len(segments) and segments[group_end][1] == bold:
+            group_end += 1
+        inner = "".join(
+            _wrap(text, "*" if italic else "") for text, _, italic in _merge_flags(segments[index:group_end])
+        )
+        pieces.append(_wrap(inner, "**", escape=False) if bold else inner)
+        index = group_end
+
+    lines = [WHITESPACE_PATTERN.sub(' ', line).strip() for line in "".join(pieces).split('\n')]
+    return "\\\n".join(line for line in lines if line)
+
+def _merge_flags(segments: List[Tuple[str, bool, bool]]) -> List[Tuple[str, bool, bool]]:
+    merged = []
+    for text, bold, italic in segments:
+        if merged and merged[-1][2] == italic:
+            merged[-1] = (merged[-1][0] + text, bold, italic)
+        else:
+            merged.append((text, bold, italic))
+    return merged
+
+def _wrap(text: str, marker: str, escape: bool = True) -> str:
+    """Envolve o texto no marcador, mantendo os espaços das bordas do lado de fora."""
+    core = text.strip()
+    if escape:
+        core = _escape_inline(core)
+    if not core:
+        return " " if text else ""
+    leading = " " if text[:1].isspace() else ""
+    trailing = " " if text[-1:].isspace() else ""
+    return f"{leading}{marker}{core}{marker}{trailing}" if marker else f"{leading}{core}{trailing}"
+
+def _heading_level(style_name: str) -> Optional[int]:
+    match = HEADING_STYLE_PATTERN.match(style_name.strip())
+    return int(match.group(1)) if match else None
+
+def _list_info(doc: DocumentClass, paragraph_style, p_element: CT_P) -> Optional[Tuple[int, bool]]:
+    """Retorna (nível, numerada) se o parágrafo for um item de lista, ou None."""
+    num_pr = p_element.pPr.numPr if p_element.pPr is not None else None
+    level = None
+    style = paragraph_style
+    while num_pr is None and style is not None:
+        style_ppr = style.element.pPr
+        if style_ppr is not None and style_ppr.numPr is not None:
+            num_pr = style_ppr.numPr
+        else:
+            style = style.base_style
+    if num_pr is None or num_pr.numId is None or num_pr.numId.val == 0:
+        return None
+
+    num_id = num_pr.numId.val
+    if num_pr.ilvl is not None:
+        level = num_pr.ilvl.val
+
+    try:
+        numbering = doc.part.numbering_part.element
+    except (KeyError, NotImplementedError):
+        return (level or 0, False)
+
+    abstract_ids = numbering.xpath(f'./w:num[@w:numId="{num_id}"]/w:abstractNumId/@w:val')
+    if not abstract_ids:
+        return (level or 0, False)
+    abstract_num = f'./w:abstractNum[@w:abstractNumId="{abstract_ids[0]}"]'
+
+    if level is None and paragraph_style is not None:
+        # Listas definidas pelo estilo (ex.: "List Number 2") indicam o nível pelo pStyle
+        style_levels = numbering.xpath(f'{abstract_num}/w:lvl[w:pStyle/@w:val="{paragraph_style.style_id}"]/@w:ilvl')
+        level = int(style_levels[0]) if style_levels else 0
+    level = level or 0
+    formats = numbering.xpath(f'{abstract_num}/w:lvl[@w:ilvl="{level}"]/w:numFmt/@w:val')
+    ordered = bool(formats) and formats[0] not in ("bullet", "none")
+    return (level, ordered)
+
+def _render_table(tbl_element: CT_Tbl, parent) -> str:
+    rows = []
+    for tr in tbl_element.xpath('./w:tr'):
+        cells = []
+        for tc in tr.xpath('./w:tc'):
+            text = " ".join(filter(None, (_render_inline(p, parent) for p in tc.xpath('./w:p'))))
+            cells.append(text.replace('\\\n', ' '))
+        rows.append(cells)
+    if not rows:
+        return ""
+
+    column_count = max(len(row) for row in rows)
+    rows = [row + [""] * (column_count - len(row)) for row in rows]
+    lines = ["| " + " | ".join(rows[0]) + " |", "|" + "|".join(["---"] * column_count) + "|"]
+    lines.extend("| " + " | ".join(row) + " |" for row in rows[1:])
+    return "\n".join(lines)
+
+def docx_to_markdown(doc: DocumentClass) -> str:
+    """
+    Converte um documento python-docx já carregado em Markdown, sem o pandoc.
+    """
+    blocks = []
+    list_counters = {}
+
+    for element in doc.element.body:
+        if isinstance(element, CT_Tbl):
+            list_counters.clear()
+            table = _render_table(element, doc)
+            if table:
+                blocks.append(table)
+            continue
+        if not isinstance(element, CT_P):
+            continue
+
+        style = doc.styles.get_by_id(element.style, 1) if element.style else doc.styles.default(1)
+        style_name = style.name if style is not None else ""
+        if style_name.lower() in METADATA_STYLES:
+            continue
+
+        text = _render_inline(element, doc)
+        if not text:
+            continue
+
+        level = _heading_level(style_name)
+        if level is not None:
+            list_counters.clear()
+            blocks.append(f"{'#' * level} {text}")
+            continue
+
+        list_info = _list_info(doc, style, element)
+        if list_info is not None:
+            list_level, ordered = list_info
+            for deeper in [lvl for lvl in list_counters if lvl > list_level]:
+                del list_counters[deeper]
+            indent = "    " * list_level
+            if ordered:
+                list_counters[list_level] = list_counters.get(list_level, 0) + 1
+                blocks.append(f"{indent}{list_counters[list_level]}.  {text}")
+            else:
+                blocks.append(f"{indent}- {text}")
+            continue
+
+        list_counters.clear()
+        blocks.append(_escape_block_start(text))
+
+    return "\n\n".join(blocks) + "\n" if blocks else ""
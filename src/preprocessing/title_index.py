@@ -0,0 +1,125 @@
+import heapq
+import re
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional
+
+import unidecode
+from langchain_core.documents import Document
+
+from config import settings
+from src.utils.logger import logger
+
+HEADING_MARKER_PATTERN = re.compile(r'^(?:#|##)\s*')
+NON_TITLE_CHARS_PATTERN = re.compile(r'[^a-zA-Z0-9\s\.-]')
+NUMBER_PATTERN = re.compile(r'\d+')
+
+NGRAM_SIZE = 3
+FUZZY_CANDIDATES = 5
+# Candidatos com menos n-gramas em comum com a consulta são descartados antes da ordenação
+MIN_SHARED_NGRAMS = 2
+
+def normalize_title(title: str) -> str:
+    """Função para limpar e normalizar títulos para garantir a correspondência."""
+    cleaned_title = HEADING_MARKER_PATTERN.sub('', title).strip()
+    ascii_title = unidecode.unidecode(cleaned_title)
+    normalized_title = NON_TITLE_CHARS_PATTERN.sub('', ascii_title)
+
+    return normalized_title.lower().strip()
+
+def _ngrams(text: str) -> set:
+    padded = f" {text} "
+    return {padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+class TitleIndex:
+    """
+    Índice de títulos de seção construído uma única vez a partir da árvore de seções.
+
+    A busca exata usa o título normalizado (O(1)). Quando não há correspondência
+    exata, títulos próximos são encontrados por n-gramas de caracteres e
+    confirmados pela similaridade de edição, para não perder seções cujo título
+    foi levemente alterado pela LLM no mapa da estrutura. `section_titles` associa
+    títulos que não são de nenhum documento (seções absorvidas pelo documento da
+    unidade) ao documento que os contém.
+    """
+
+    def __init__(self, documents: List[Document], min_similarity: float = None,
+                 section_titles: Optional[Dict[str, Document]] = None):
+        self.min_similarity = settings.TITLE_MATCH_MIN_SIMILARITY if min_similarity is None else min_similarity
+        self._documents: Dict[str, Document] = {
+            normalize_title(doc.metadata['title'].split('\n')[-1]): doc for doc in documents
+        }
+        # O título do próprio documento tem precedência sobre o de uma seção absorvida
+        for title, document in (section_titles or {}).items():
+            self._documents.setdefault(normalize_title(title), document)
+        self._keys = list(self._documents)
+        self._ngram_postings: Dict[str, List[int]] = {}
+        # Número de n-gramas de cada título, usado no coeficiente de Dice da busca aproximada
+        self._gram_counts: List[int] = []
+        for key_id, key in enumerate(self._keys):
+            grams = _ngrams(key)
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                self._ngram_postings.setdefault(gram, []).append(key_id)
+        # Memoriza as consultas já resolvidas (inclusive as sem correspondência)
+        self._lookups: Dict[str, Optional[Document]] = {}
+
+    @classmethod
+    def from_section_tree(cls, section_tree: dict, min_similarity: float = None) -> "TitleIndex":
+        documents = section_tree['documents']
+        section_titles = {
+            section_title: documents[section['document']]
+            for unit in section_tree['units'].values()
+            for section_title, section in unit['sections'].items()
+            if section['document'] is not None
+        }
+        return cls(documents, min_similarity, section_titles)
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def lookup(self, title: str) -> Optional[Document]:
+        """Retorna o documento da seção com o título informado, ou None se não houver correspondência."""
+        if title in self._lookups:
+            return self._lookups[title]
+
+        key = normalize_title(title)
+        document = self._documents.get(key)
+        if document is None and key:
+            document = self._fuzzy_lookup(title, key)
+
+        self._lookups[title] = document
+        return document
+
+    def _fuzzy_lookup(self, title: str, key: str) -> Optional[Document]:
+        query_grams = _ngrams(key)
+        shared_counts = Counter()
+        for gram in query_grams:
+            shared_counts.update(self._ngram_postings.get(gram, ()))
+        shared = [(key_id, count) for key_id, count in shared_counts.items() if count >= MIN_SHARED_NGRAMS]
+        if not shared:
+            return None
+
+        # Pré-seleciona pelo coeficiente de Dice dos n-gramas e confirma pela distância de edição
+        query_count = len(query_grams)
+        candidates = heapq.nlargest(
+            FUZZY_CANDIDATES, shared,
+            key=lambda item: 2 * item[1] / (query_count + self._gram_counts[item[0]]),
+        )
+
+        query_numbers = NUMBER_PATTERN.findall(key)
+        best_key, best_ratio = None, 0.0
+        for key_id, _ in candidates:
+            candidate_key = self._keys[key_id]
+            # Numerações diferentes (ex.: "1.2" vs "1.3") indicam seções distintas
+            if NUMBER_PATTERN.findall(candidate_key) != query_numbers:
+                continue
+            ratio = SequenceMatcher(None, key, candidate_key).ratio()
+            if ratio > best_ratio:
+                best_key, best_ratio = candidate_key, ratio
+
+        if best_key is None or best_ratio < self.min_similarity:
+            return None
+
+        logger.warning(f"Título '{title}' associado por similaridade ({best_ratio:.2f}) à seção '{best_key}'.")
+        return self._documents[best_key]
@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from src.utils.logger import logger
+from src.utils.rate_limiting import RateLimiter, call_with_retries, estimate_tokens
+
+def split_into_batches(texts: List[str], max_tokens: int, max_items: int) -> List[List[int]]:
+    """
+    Agrupa os índices dos textos, na ordem, em lotes de até `max_tokens` tokens
+    estimados e `max_items` textos. Um texto maior que o limite forma um lote sozinho.
+    """
+    batches = []
+    current, current_tokens = [], 0
+    for index, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+class ConcurrentEmbeddings(Embeddings):
+    """
+    Envolve uma função de embedding dividindo os textos em lotes dimensionados
+    por tokens e enviando-os em paralelo, respeitando os limites de RPM/TPM
+    e repetindo com backoff os lotes que falharem por erros transitórios.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        max_batch_tokens: int,
+        max_batch_items: int,
+        max_concurrency: int,
+        rate_limiter: RateLimiter,
+        max_retries: int,
+    ):
+        self.underlying = underlying
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        def request():
+            self.rate_limiter.acquire(sum(estimate_tokens(text) for text in texts))
+            return self.underlying.embed_documents(texts)
+        return call_with_retries(request, f"Embedding de {len(texts)} chunks", self.max_retries)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = split_into_batches(texts, self.max_batch_tokens, self.max_batch_items)
+        logger.info(f"Gerando embeddings de {len(texts)} chunks em {len(batches)} lotes ({self.max_concurrency} em paralelo)...")
+
+        batch_texts = [[texts[i] for i in batch] for batch in batches]
+        if len(batches) == 1 or self.max_concurrency <= 1:
+            results = [self._embed_batch(batch) for batch in batch_texts]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = list(executor.map(self._embed_batch, batch_texts))
+
+        vectors: List[List[float]] = [None] * len(texts)
+        for batch, batch_vectors in zip(batches, results):
+            for index, vector in zip(batch, batch_vectors):
+                vectors[index] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        def request():
+            self.rate_limiter.acquire(estimate_tokens(text))
+            return self.underlying.embed_query(text)
+        return call_with_retries(request, "Embedding da consulta", self.max_retries)
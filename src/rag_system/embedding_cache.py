@@ -0,0 +1,118 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from src.utils.logger import logger
+
+# Limite de variáveis por consulta do SQLite (SQLITE_MAX_VARIABLE_NUMBER em versões antigas)
+SQLITE_BATCH_SIZE = 500
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envolve uma função de embedding com um cache persistente em SQLite, com
+    chave (modelo, hash do texto). Os textos já conhecidos são buscados em lote
+    e apenas os ausentes são enviados ao modelo. Quando o cache passa de
+    `max_entries`, os vetores usados há mais tempo são descartados.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, cache_path: Path, max_entries: int):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache_path = Path(cache_path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # Vários processos (modo em lote) podem compartilhar o mesmo arquivo
+            self._connection = sqlite3.connect(str(self.cache_path), timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        return self._connection
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def _fetch(self, keys: List[str]) -> Dict[str, List[float]]:
+        connection = self._connect()
+        found = {}
+        for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+            batch = keys[start:start + SQLITE_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+            for key, blob in rows:
+                vector = array('f')
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+        if found:
+            now = time.time()
+            connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            connection.commit()
+        return found
+
+    def _store(self, vectors: Dict[str, List[float]]):
+        connection = self._connect()
+        now = time.time()
+        connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, array('f', vector).tobytes(), now) for key, vector in vectors.items()],
+        )
+        excess = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            logger.info(f"Cache de embeddings: {excess} vetores antigos descartados.")
+        connection.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            cached = self._fetch(list(dict.fromkeys(keys)))
+
+        # Textos repetidos na mesma chamada são enviados ao modelo apenas uma vez
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            new_vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), new_vectors))
+            with self._lock:
+                self._store(computed)
+            cached.update(computed)
+
+        logger.info(f"Cache de embeddings: {len(texts) - len(missing)} reutilizados, {len(missing)} calculados.")
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        with self._lock:
+            cached = self._fetch([key])
+        if key in cached:
+            self.hits += 1
+            return cached[key]
+
+        self.misses += 1
+        vector = self.underlying.embed_query(text)
+        with self._lock:
+            self._store({key: vector})
+        return vector
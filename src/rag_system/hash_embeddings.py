@@ -0,0 +1,36 @@
+import hashlib
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.rag_system.lexical_index import tokenize
+
+class HashEmbeddings(Embeddings):
+    """
+    Embeddings locais e determinísticos: cada token é projetado, por hash, em uma
+    das `dimensions` coordenadas (com sinal também dado pelo hash) e o vetor é
+    normalizado. Textos com palavras em comum ficam próximos, o que basta para
+    exercitar a recuperação em testes e benchmarks sem chamadas de rede.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in tokenize(text):
+            digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], 'big') % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            # Texto sem tokens indexáveis: vetor fixo, para manter a busca bem definida
+            vector[0], norm = 1.0, 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
@@ -0,0 +1,203 @@
+import re
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from unidecode import unidecode
+
+from src.rag_system.numpy_vectorstore import filter_conditions
+
+TOKEN_PATTERN = re.compile(r'\w+')
+MIN_TOKEN_LENGTH = 3
+
+def tokenize(text: str) -> List[str]:
+    """Termos em minúsculas e sem acentos; termos muito curtos (artigos, preposições) são ignorados."""
+    return [token for token in TOKEN_PATTERN.findall(unidecode(text).lower()) if len(token) >= MIN_TOKEN_LENGTH]
+
+class BM25Index:
+    """
+    Índice invertido em memória com pontuação BM25. Os postings são acumulados
+    em listas durante a indexação e convertidos em arrays NumPy na primeira busca.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        self._postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._lengths: List[int] = []
+        self._frozen: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None
+        self._length_norm: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, texts: List[str], metadatas: List[dict], ids: List[str]):
+        for text, metadata, doc_id in zip(texts, metadatas, ids):
+            row = len(self.ids)
+            self.ids.append(doc_id)
+            self.texts.append(text)
+            self.metadatas.append(dict(metadata))
+            tokens = tokenize(text)
+            self._lengths.append(len(tokens))
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                rows, frequencies = self._postings.setdefault(token, ([], []))
+                rows.append(row)
+                frequencies.append(count)
+        self._frozen = None
+
+    def delete(self, ids: Optional[List[str]] = None):
+        """
+        Remove as linhas dos IDs (todas, sem IDs) e renumera as restantes nos postings.
+        O comprimento médio é recalculado na próxima busca.
+        """
+        removed = set(ids) if ids is not None else set(self.ids)
+        keep = [row for row, doc_id in enumerate(self.ids) if doc_id not in removed]
+        if len(keep) == len(self.ids):
+            return
+        new_row = {row: new for new, row in enumerate(keep)}
+        self.ids = [self.ids[row] for row in keep]
+        self.texts = [self.texts[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self._lengths = [self._lengths[row] for row in keep]
+        postings = {}
+        for token, (rows, frequencies) in self._postings.items():
+            kept = [(new_row[row], frequency) for row, frequency in zip(rows, frequencies) if row in new_row]
+            if kept:
+                postings[token] = ([row for row, _ in kept], [frequency for _, frequency in kept])
+        self._postings = postings
+        self._frozen = None
+
+    def _freeze(self):
+        if self._frozen is not None:
+            return
+        self._frozen = {
+            token: (np.asarray(rows, dtype=np.int64), np.asarray(frequencies, dtype=np.float32))
+            for token, (rows, frequencies) in self._postings.items()
+        }
+        lengths = np.asarray(self._lengths, dtype=np.float32)
+        average = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+        self._length_norm = self.k1 * (1 - self.b + self.b * lengths / average)
+
+    def search(self, query: str, k: int, filter: Optional[dict] = None) -> List[Tuple[int, float]]:
+        """Retorna até k pares (linha, pontuação) com pontuação positiva, do maior para o menor."""
+        if not self.ids:
+            return []
+        self._freeze()
+        total = len(self.ids)
+        scores = np.zeros(total, dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self._frozen.get(token)
+            if posting is None:
+                continue
+            rows, frequencies = posting
+            idf = np.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + self._length_norm[rows])
+
+        pairs = filter_conditions(filter)
+        if pairs:
+            for row in np.flatnonzero(scores):
+                if not all(self.metadatas[row].get(key) == value for key, value in pairs):
+                    scores[row] = 0
+
+        candidates = np.flatnonzero(scores > 0)
+        if candidates.size == 0:
+            return []
+        k = min(k, candidates.size)
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.texts[row], metadata=dict(self.metadatas[row]), id=self.ids[row])
+
+class HybridVectorStore(VectorStore):
+    """
+    Combina um banco vetorial com um índice BM25 sobre os mesmos chunks filhos,
+    fundindo os rankings por Reciprocal Rank Fusion. Sem banco vetorial
+    (`vector_store=None`), a busca é apenas lexical e não faz chamadas de rede.
+
+    Fica atrás do ParentDocumentRetriever como qualquer banco vetorial, então
+    os filtros das visões por unidade/capítulo continuam funcionando.
+    """
+
+    def __init__(
+        self,
+        vector_store: Optional[VectorStore],
+        k1: float = 1.5,
+        b: float = 0.75,
+        rrf_k: int = 60,
+        candidates_per_result: int = 4,
+    ):
+        self.vector_store = vector_store
+        self.lexical_index = BM25Index(k1=k1, b=b)
+        self.rrf_k = rrf_k
+        self.candidates_per_result = candidates_per_result
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.vector_store.embeddings if self.vector_store is not None else None
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        if self.vector_store is not None:
+            self.vector_store.add_texts(texts, metadatas=metadatas, ids=ids, **kwargs)
+        self.lexical_index.add(texts, metadatas, ids)
+        return ids
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        if self.vector_store is None:
+            return [self.lexical_index.document(row) for row, _ in self.lexical_index.search(query, k, filter)]
+
+        candidates = k * self.candidates_per_result
+        search_kwargs = {'filter': filter} if filter else {}
+        rankings = [
+            self.vector_store.similarity_search(query, k=candidates, **search_kwargs),
+            [self.lexical_index.document(row) for row, _ in self.lexical_index.search(query, candidates, filter)],
+        ]
+
+        fused: Dict[str, float] = {}
+        documents: Dict[str, Document] = {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking):
+                key = doc.id or doc.page_content
+                fused[key] = fused.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+                documents.setdefault(key, doc)
+        best = sorted(fused, key=fused.get, reverse=True)[:k]
+        return [documents[key] for key in best]
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if self.vector_store is not None:
+            self.vector_store.delete(ids, **kwargs)
+        self.lexical_index.delete(ids)
+        return True
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> "HybridVectorStore":
+        # Construído a partir de textos, o índice é apenas lexical; `embedding` é ignorado
+        store = cls(vector_store=None, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
@@ -0,0 +1,167 @@
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+def filter_conditions(filter: Optional[dict]) -> List[Tuple[str, Any]]:
+    """Pares (chave, valor) de um filtro de igualdade simples ou de um '$and' de igualdades."""
+    if not filter:
+        return []
+    conditions = filter['$and'] if '$and' in filter else [filter]
+    return sorted((key, value) for condition in conditions for key, value in condition.items())
+
+class NumpyVectorStore(VectorStore):
+    """
+    Banco vetorial em memória para corpora pequenos (um livro ou capítulo):
+    os embeddings normalizados ficam em uma matriz NumPy contígua e a busca
+    exata dos k mais próximos é um único produto matriz-vetor, sem disco nem índice HNSW.
+
+    Os filtros aceitam igualdade de metadados ({'unit': ...}) e '$and' de igualdades,
+    o mesmo subconjunto usado por `build_retriever` com o Chroma.
+    """
+
+    def __init__(self, embedding: Embeddings):
+        self._embedding = embedding
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._size = 0
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[dict] = []
+        self._mask_cache: Dict[str, np.ndarray] = {}
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, extra: int, dimension: int):
+        """Garante espaço para `extra` linhas, dobrando a capacidade da matriz quando necessário."""
+        capacity = self._matrix.shape[0]
+        if self._size + extra <= capacity and self._matrix.shape[1] == dimension:
+            return
+        new_capacity = max(self._size + extra, 2 * capacity, 16)
+        matrix = np.empty((new_capacity, dimension), dtype=np.float32)
+        if self._size:
+            matrix[:self._size] = self._matrix[:self._size]
+        self._matrix = matrix
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+
+        vectors = np.asarray(self._embedding.embed_documents(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+
+        self._reserve(len(texts), vectors.shape[1])
+        self._matrix[self._size:self._size + len(texts)] = vectors
+        self._size += len(texts)
+        self._ids.extend(ids)
+        self._texts.extend(texts)
+        self._metadatas.extend(dict(m) for m in metadatas)
+        self._mask_cache.clear()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            keep = []
+        else:
+            removed = set(ids)
+            keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in removed]
+        self._matrix = np.ascontiguousarray(self._matrix[keep]) if keep else np.empty((0, 0), dtype=np.float32)
+        self._size = len(keep)
+        self._ids = [self._ids[i] for i in keep]
+        self._texts = [self._texts[i] for i in keep]
+        self._metadatas = [self._metadatas[i] for i in keep]
+        self._mask_cache.clear()
+        return True
+
+    def _filter_mask(self, filter: Optional[dict]) -> Optional[np.ndarray]:
+        """Máscara booleana das linhas que satisfazem o filtro (memorizada até o próximo add/delete)."""
+        if not filter:
+            return None
+        pairs = filter_conditions(filter)
+        cache_key = repr(pairs)
+        mask = self._mask_cache.get(cache_key)
+        if mask is None:
+            mask = np.fromiter(
+                (all(metadata.get(key) == value for key, value in pairs) for metadata in self._metadatas),
+                dtype=bool, count=self._size,
+            )
+            self._mask_cache[cache_key] = mask
+        return mask
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        if self._size == 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        scores = self._matrix[:self._size] @ query
+
+        mask = self._filter_mask(filter)
+        if mask is not None:
+            candidates = np.flatnonzero(mask)
+            scores = scores[candidates]
+        else:
+            candidates = None
+        if scores.size == 0:
+            return []
+
+        k = min(k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        rows = candidates[top] if candidates is not None else top
+        return [
+            (Document(page_content=self._texts[row], metadata=dict(self._metadatas[row]), id=self._ids[row]), float(score))
+            for row, score in zip(rows, scores[top])
+        ]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        # Similaridade de cosseno em [-1, 1] → relevância em [0, 1]
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(embedding)
+        store.add_texts(texts, metadatas, ids)
+        return store
@@ -0,0 +1,100 @@
+import json
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.stores import BaseStore
+
+PARENT_DOCSTORE_SUFFIX = ".parents.sqlite"
+
+def parent_docstore_path(persist_directory: Path, collection_name: str) -> Path:
+    """Arquivo do armazenamento de pais que acompanha uma coleção do banco vetorial."""
+    return Path(persist_directory) / f"{collection_name}{PARENT_DOCSTORE_SUFFIX}"
+
+class SQLiteDocStore(BaseStore[str, Document]):
+    """
+    Armazenamento dos documentos pais do ParentDocumentRetriever em SQLite,
+    persistido ao lado da coleção de chunks filhos. Uma marca de conclusão
+    indica que a indexação terminou e o par (pais, filhos) pode ser reutilizado.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS parents (id TEXT PRIMARY KEY, document TEXT NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        return self._connection
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[Document]]:
+        with self._lock:
+            connection = self._connect()
+            placeholders = ",".join("?" * len(keys))
+            rows = dict(connection.execute(f"SELECT id, document FROM parents WHERE id IN ({placeholders})", list(keys))) if keys else {}
+        documents = []
+        for key in keys:
+            data = json.loads(rows[key]) if key in rows else None
+            documents.append(Document(page_content=data['page_content'], metadata=data['metadata']) if data else None)
+        return documents
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, Document]]) -> None:
+        rows = [
+            (key, json.dumps({'page_content': doc.page_content, 'metadata': doc.metadata}, ensure_ascii=False))
+            for key, doc in key_value_pairs
+        ]
+        with self._lock:
+            connection = self._connect()
+            connection.executemany("INSERT OR REPLACE INTO parents (id, document) VALUES (?, ?)", rows)
+            connection.commit()
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        with self._lock:
+            connection = self._connect()
+            connection.executemany("DELETE FROM parents WHERE id = ?", [(key,) for key in keys])
+            connection.commit()
+
+    def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
+        with self._lock:
+            keys = [row[0] for row in self._connect().execute("SELECT id FROM parents ORDER BY id")]
+        return iter([key for key in keys if prefix is None or key.startswith(prefix)])
+
+    def is_complete(self) -> bool:
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM meta WHERE key = 'complete'").fetchone()
+        return bool(row and row[0] == "1")
+
+    def mark_complete(self):
+        """Marca a indexação como concluída com um identificador novo para esta construção."""
+        with self._lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('complete', '1')")
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('build_id', ?)", (uuid.uuid4().hex,))
+            connection.commit()
+
+    def build_id(self) -> str:
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM meta WHERE key = 'build_id'").fetchone()
+        return row[0] if row else ""
+
+    def clear(self):
+        """Descarta pais e a marca de conclusão (indexação interrompida que será refeita)."""
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM parents")
+            connection.execute("DELETE FROM meta")
+            connection.commit()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, List, Optional
+
+from langchain.retrievers import ParentDocumentRetriever
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.runnables.config import run_in_executor
+
+class RetrievalCache:
+    """
+    Memoização das buscas do retriever: (versão do índice, escopo, hash da consulta)
+    → IDs dos documentos pais retornados. Com `path=None`, o cache vive só em memória
+    (índices efêmeros, cujos IDs não sobrevivem à execução); com um arquivo, é
+    compartilhado entre execuções e limitado a `max_entries` pelos usos mais recentes.
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_entries: int = 100_000):
+        self.path = Path(path) if path is not None else None
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            if self.path is None:
+                self._connection = sqlite3.connect(":memory:", check_same_thread=False)
+            else:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._connection = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS retrievals ("
+                " key TEXT PRIMARY KEY, parent_ids TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_retrievals_last_used ON retrievals (last_used)")
+        return self._connection
+
+    @staticmethod
+    def make_key(index_version: str, scope: dict, query: str) -> str:
+        # Só o hash da consulta entra na chave: o texto da seção inteira nunca é armazenado nem comparado
+        query_hash = hashlib.sha256(query.encode('utf-8')).hexdigest()
+        scope_json = json.dumps(scope, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(f"{index_version}\0{scope_json}\0{query_hash}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT parent_ids FROM retrievals WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE retrievals SET last_used = ? WHERE key = ?", (time.time(), key))
+                connection.commit()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, parent_ids: List[str]):
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO retrievals (key, parent_ids, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(parent_ids), time.time()),
+            )
+            excess = connection.execute("SELECT COUNT(*) FROM retrievals").fetchone()[0] - self.max_entries
+            if excess > 0:
+                connection.execute(
+                    "DELETE FROM retrievals WHERE key IN (SELECT key FROM retrievals ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+            connection.commit()
+
+class MemoizedParentDocumentRetriever(ParentDocumentRetriever):
+    """
+    ParentDocumentRetriever que consulta o `retrieval_cache` antes de buscar:
+    num acerto, os pais são lidos direto do armazenamento pelos IDs memorizados,
+    sem o embedding da consulta nem a busca no banco vetorial.
+    """
+
+    retrieval_cache: Optional[Any] = None
+    index_version: str = ""
+
+    def _search_parent_ids(self, query: str) -> List[str]:
+        """Mesma busca do MultiVectorRetriever, devolvendo os IDs dos pais na ordem."""
+        if self.search_type == "mmr":
+            sub_docs = self.vectorstore.max_marginal_relevance_search(query, **self.search_kwargs)
+        elif self.search_type == "similarity_score_threshold":
+            sub_docs = [doc for doc, _ in self.vectorstore.similarity_search_with_relevance_scores(query, **self.search_kwargs)]
+        else:
+            sub_docs = self.vectorstore.similarity_search(query, **self.search_kwargs)
+        return list(dict.fromkeys(d.metadata[self.id_key] for d in sub_docs if self.id_key in d.metadata))
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self.retrieval_cache is None:
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+
+        key = RetrievalCache.make_key(self.index_version, {'type': self.search_type, **self.search_kwargs}, query)
+        parent_ids = self.retrieval_cache.get(key)
+        if parent_ids is not None:
+            docs = self.docstore.mget(parent_ids)
+            # Pais ausentes indicam um índice reconstruído: a entrada é refeita abaixo
+            if all(doc is not None for doc in docs):
+                self.retrieval_cache.hits += 1
+                return docs
+
+        self.retrieval_cache.misses += 1
+        parent_ids = self._search_parent_ids(query)
+        self.retrieval_cache.put(key, parent_ids)
+        return [doc for doc in self.docstore.mget(parent_ids) if doc is not None]
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self.retrieval_cache is None:
+            return await super()._aget_relevant_documents(query, run_manager=run_manager)
+        return await run_in_executor(None, self._get_relevant_documents, query, run_manager=run_manager.get_sync())
@@ -1,17 +1,145 @@
-from typing import List 
+import hashlib
+import json
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional
 from langchain_core.documents import Document 
+from langchain_core.vectorstores import VectorStore
 from langchain.retrievers import ParentDocumentRetriever
 from langchain.storage import InMemoryStore
 from langchain_chroma import Chroma 
 from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from config import settings
+from src.rag_system import vectorstore_maintenance
+from src.rag_system.concurrent_embeddings import ConcurrentEmbeddings
+from src.rag_system.embedding_cache import CachedEmbeddings
+from src.rag_system.hash_embeddings import HashEmbeddings
+from src.rag_system.lexical_index import HybridVectorStore
+from src.rag_system.numpy_vectorstore import NumpyVectorStore
+from src.rag_system.parent_docstore import SQLiteDocStore, parent_docstore_path
+from src.rag_system.retrieval_cache import MemoizedParentDocumentRetriever, RetrievalCache
+from src.utils.llm_handler import get_http_client
 from src.utils.logger import logger
+from src.utils.rate_limiting import RateLimiter
 
-def build_retriever(documents: List[Document]):
+def get_embedding_function():
     """
-    Constrói e retorna um ParentDocumentRetriever configurado.
+    Retorna a função de embedding: requisições em lotes concorrentes sob os
+    limites de RPM/TPM e, quando habilitado, o cache persistente na frente delas.
+    Com `settings.EMBEDDING_PROVIDER == "fake"`, usa os embeddings locais por hash.
     """
+    if settings.EMBEDDING_PROVIDER == "fake":
+        return HashEmbeddings(settings.FAKE_EMBEDDING_DIMENSIONS)
+    embeddings = ConcurrentEmbeddings(
+        # As novas tentativas ficam a cargo do ConcurrentEmbeddings, que respeita os limites de taxa
+        OpenAIEmbeddings(model=settings.EMBEDDING_MODEL, http_client=get_http_client(), max_retries=0),
+        max_batch_tokens=settings.EMBEDDING_BATCH_MAX_TOKENS,
+        max_batch_items=settings.EMBEDDING_BATCH_MAX_ITEMS,
+        max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+        rate_limiter=RateLimiter(settings.EMBEDDING_REQUESTS_PER_MINUTE, settings.EMBEDDING_TOKENS_PER_MINUTE),
+        max_retries=settings.EMBEDDING_MAX_RETRIES,
+    )
+    if not settings.USE_EMBEDDING_CACHE:
+        return embeddings
+    return CachedEmbeddings(
+        embeddings, settings.EMBEDDING_MODEL, settings.EMBEDDING_CACHE_PATH, settings.EMBEDDING_CACHE_MAX_ENTRIES
+    )
+
+def new_collection_name(scope: str) -> str:
+    """
+    Gera um nome de coleção exclusivo para uma execução e um escopo, no formato
+    '<prefixo>_<data>_<id>_<escopo>', aceito pelo Chroma ([a-zA-Z0-9._-]).
+    """
+    run_id = f"{time.strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    safe_scope = re.sub(r'[^a-zA-Z0-9._-]+', '-', scope).strip('-._')[:20] or "livro"
+    return f"{settings.VECTORSTORE_RUN_PREFIX}_{run_id}_{safe_scope}"
+
+def create_vectorstore(collection_name: str, persist_directory: Path, ephemeral: bool = True) -> VectorStore:
+    """
+    Cria o banco dos chunks filhos conforme `settings.RETRIEVAL_MODE` e,
+    quando há busca vetorial, `settings.VECTOR_BACKEND`.
+    """
+    if settings.RETRIEVAL_MODE not in ("vector", "hybrid", "lexical"):
+        raise ValueError(f"Modo de recuperação desconhecido: '{settings.RETRIEVAL_MODE}'.")
+    if settings.RETRIEVAL_MODE == "lexical":
+        return _hybrid_store(None)
+    vectorstore = _create_vector_backend(collection_name, persist_directory, ephemeral)
+    return _hybrid_store(vectorstore) if settings.RETRIEVAL_MODE == "hybrid" else vectorstore
+
+def _hybrid_store(vectorstore) -> HybridVectorStore:
+    return HybridVectorStore(
+        vectorstore,
+        k1=settings.BM25_K1,
+        b=settings.BM25_B,
+        rrf_k=settings.HYBRID_RRF_K,
+        candidates_per_result=settings.HYBRID_CANDIDATES_PER_RESULT,
+    )
+
+def _create_vector_backend(collection_name: str, persist_directory: Path, ephemeral: bool) -> VectorStore:
+    if settings.VECTOR_BACKEND == "numpy":
+        return NumpyVectorStore(embedding=get_embedding_function())
+    if settings.VECTOR_BACKEND != "chroma":
+        raise ValueError(f"Backend de banco vetorial desconhecido: '{settings.VECTOR_BACKEND}'.")
+    return Chroma(
+        collection_name=collection_name,
+        embedding_function=get_embedding_function(),
+        persist_directory=str(persist_directory),
+        collection_metadata={'created_at': time.time(), 'ephemeral': ephemeral},
+    )
+
+def index_fingerprint(documents: List[Document]) -> str:
+    """
+    Impressão digital do conteúdo indexado: documentos, metadados, tamanhos
+    dos chunks e modelo de embedding. Define o nome da coleção persistente.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{settings.EMBEDDING_MODEL}\0{settings.CHUNK_SIZE_PARENT}\0{settings.CHUNK_SIZE_CHILD}\0".encode('utf-8'))
+    for doc in documents:
+        digest.update(doc.page_content.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(json.dumps(doc.metadata, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _uses_persistent_index() -> bool:
+    """O índice só pode ser persistido quando os filhos ficam em uma coleção do Chroma."""
+    return settings.PERSIST_BOOK_INDEX and settings.VECTOR_BACKEND == "chroma" and settings.RETRIEVAL_MODE != "lexical"
+
+def _chroma_store(vectorstore: VectorStore) -> Optional[Chroma]:
+    if isinstance(vectorstore, HybridVectorStore):
+        vectorstore = vectorstore.vector_store
+    return vectorstore if isinstance(vectorstore, Chroma) else None
+
+def _reload_lexical_index(vectorstore: VectorStore):
+    """No modo híbrido, reconstrói o BM25 a partir dos filhos persistidos (sem novos embeddings)."""
+    if not isinstance(vectorstore, HybridVectorStore):
+        return
+    children = vectorstore.vector_store.get(include=['documents', 'metadatas'])
+    vectorstore.lexical_index.add(children['documents'], children['metadatas'], children['ids'])
+
+def build_book_index(documents: List[Document], persist_directory: Path = None, collection_name: str = None) -> ParentDocumentRetriever:
+    """
+    Indexa o livro inteiro uma única vez e retorna o ParentDocumentRetriever completo.
+    Os chunks filhos herdam os metadados dos documentos pais ('unit', 'chapter'),
+    permitindo que `build_retriever` entregue visões filtradas sem reindexar.
+
+    Com `settings.PERSIST_BOOK_INDEX`, os pais ficam em um SQLite ao lado de uma
+    coleção nomeada pela impressão digital do conteúdo: uma nova execução sobre o
+    mesmo livro (ex.: após uma queda) reaproveita o índice sem dividir nem gerar
+    embeddings de novo; um índice novo substitui os de conteúdos anteriores no
+    mesmo diretório, que é exclusivo do livro. Caso contrário, cada execução usa sua própria coleção
+    (efêmera), descartada com `drop_book_index` ao final.
+    """
+    persist_directory = persist_directory or settings.VECTORSTORE_DIR
+    persistent = _uses_persistent_index()
+    if collection_name is None:
+        collection_name = (
+            f"{settings.VECTORSTORE_RUN_PREFIX}_idx_{index_fingerprint(documents)[:24]}"
+            if persistent else new_collection_name("livro")
+        )
     logger.info("Construindo o sistema RAG com ParentDocumentRetriever...")
     
     # Divisor para os documentos pais 
@@ -21,24 +149,93 @@ def build_retriever(documents: List[Document]):
     child_splitter = RecursiveCharacterTextSplitter(chunk_size=settings.CHUNK_SIZE_CHILD)
 
     # Banco de dados vetorial para os chunks filhos 
-    vectorstore = Chroma(
-        collection_name="split_parents",
-        embedding_function=OpenAIEmbeddings(model=settings.EMBEDDING_MODEL),
-        persist_directory=str(settings.VECTORSTORE_DIR)
-    )
+    vectorstore = create_vectorstore(collection_name, persist_directory, ephemeral=not persistent)
 
     # Armazenamento para os documentos pais 
-    store = InMemoryStore()
+    store = SQLiteDocStore(parent_docstore_path(persist_directory, collection_name)) if persistent else InMemoryStore()
 
-    retriever = ParentDocumentRetriever(
+    retriever = MemoizedParentDocumentRetriever(
         vectorstore=vectorstore,
         docstore=store,
         child_splitter=child_splitter,
         parent_splitter=parent_splitter,
     )
 
+    if persistent:
+        chroma = _chroma_store(vectorstore)
+        if store.is_complete() and (chroma._collection.count() > 0 or not documents):
+            _reload_lexical_index(vectorstore)
+            chroma._collection.modify(metadata={**(chroma._collection.metadata or {}), 'last_used': time.time()})
+            logger.info(f"Reutilizando o índice persistido '{collection_name}' ({chroma._collection.count()} chunks).")
+            _attach_retrieval_cache(retriever, collection_name, persistent)
+            return retriever
+        # Indexação anterior interrompida: recomeça do zero para não misturar filhos órfãos
+        store.clear()
+        chroma.reset_collection()
+
     logger.info("Adicionando documentos ao retriever...")
-    retriever.add_documents(documents, ids=None)
+    # Em lotes: o Chroma recusa inserções acima do seu tamanho máximo de lote
+    batch_size = settings.INDEXING_BATCH_DOCUMENTS
+    for start in range(0, len(documents), batch_size):
+        retriever.add_documents(documents[start:start + batch_size], ids=None)
+    if persistent:
+        store.mark_complete()
+        # O índice de um conteúdo anterior do mesmo livro não seria mais reutilizado
+        superseded = vectorstore_maintenance.remove_superseded_indexes(persist_directory, collection_name)
+        if superseded:
+            logger.info(f"Índices persistidos substituídos e removidos: {', '.join(superseded)}.")
+    _attach_retrieval_cache(retriever, collection_name, persistent)
 
     logger.info("Retriever construído e pronto para uso.")
-    return retriever 
\ No newline at end of file
+    return retriever
+
+def _attach_retrieval_cache(retriever: MemoizedParentDocumentRetriever, collection_name: str, persistent: bool):
+    """
+    Liga o cache de recuperações ao índice. A versão do índice combina a coleção,
+    a construção dos pais (IDs gerados nela) e os parâmetros que alteram o ranking.
+    """
+    if not settings.USE_RETRIEVAL_CACHE:
+        return
+    build_id = retriever.docstore.build_id() if persistent else ""
+    retriever.index_version = ":".join(str(part) for part in (
+        collection_name, build_id, settings.RETRIEVAL_MODE, settings.BM25_K1, settings.BM25_B,
+        settings.HYBRID_RRF_K, settings.HYBRID_CANDIDATES_PER_RESULT,
+    ))
+    # IDs de pais de índices efêmeros só valem nesta execução: o cache fica em memória
+    cache_path = settings.RETRIEVAL_CACHE_PATH if persistent else None
+    retriever.retrieval_cache = RetrievalCache(cache_path, settings.RETRIEVAL_CACHE_MAX_ENTRIES)
+
+def build_retriever(book_index: ParentDocumentRetriever, unit: str = None, chapter: str = None) -> ParentDocumentRetriever:
+    """
+    Retorna uma visão do índice do livro restrita a uma unidade e/ou capítulo.
+    A visão compartilha o banco vetorial e o armazenamento de pais do índice,
+    então não há nova indexação nem novo consumo de memória.
+    """
+    conditions = [{key: value} for key, value in (('unit', unit), ('chapter', chapter)) if value is not None]
+    search_kwargs = dict(book_index.search_kwargs)
+    if len(conditions) == 1:
+        search_kwargs['filter'] = conditions[0]
+    elif conditions:
+        search_kwargs['filter'] = {'$and': conditions}
+    return book_index.model_copy(update={'search_kwargs': search_kwargs})
+
+def drop_book_index(book_index: ParentDocumentRetriever, persist_directory: Path = None):
+    """
+    Descarta a coleção efêmera da execução e os segmentos que ela deixou no disco.
+    Índices persistentes são mantidos para reuso (a manutenção remove os antigos).
+    """
+    vectorstore = _chroma_store(book_index.vectorstore)
+    if vectorstore is None:
+        # Bancos em memória são liberados junto com o índice
+        return
+    collection_name = vectorstore._collection.name
+    if isinstance(book_index.docstore, SQLiteDocStore):
+        book_index.docstore.close()
+        logger.info(f"Índice persistido '{collection_name}' mantido para reuso.")
+        return
+    try:
+        vectorstore.delete_collection()
+        removed = vectorstore_maintenance.remove_orphan_segments(persist_directory or settings.VECTORSTORE_DIR)
+        logger.info(f"Coleção '{collection_name}' descartada ({len(removed)} segmentos removidos do disco).")
+    except Exception as e:
+        logger.warning(f"Não foi possível descartar a coleção '{collection_name}': {e}")
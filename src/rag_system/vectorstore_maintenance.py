@@ -0,0 +1,203 @@
+"""
+Manutenção dos bancos vetoriais persistidos (Chroma).
+
+Uso:
+    python -m src.rag_system.vectorstore_maintenance report [--all]
+    python -m src.rag_system.vectorstore_maintenance compact [--all] [--max-age-hours N]
+
+'report' lista as coleções, seus tamanhos e os segmentos órfãos no disco.
+'compact' remove coleções efêmeras de execuções interrompidas, índices persistidos
+sem uso há muito tempo (com seus armazenamentos de pais), a coleção legada
+'split_parents', os segmentos órfãos e compacta o SQLite do Chroma.
+"""
+import argparse
+import re
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+from typing import List
+
+import chromadb
+
+from config import settings
+from src.rag_system.parent_docstore import PARENT_DOCSTORE_SUFFIX
+from src.utils.logger import logger
+
+CHROMA_SQLITE_FILENAME = "chroma.sqlite3"
+LEGACY_COLLECTION_NAME = "split_parents"
+SEGMENT_DIR_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+def directory_size(path: Path) -> int:
+    """Tamanho total, em bytes, dos arquivos de um diretório."""
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+def list_collections(persist_directory: Path) -> List[dict]:
+    """Lista as coleções do banco com o número de chunks, a idade, o tempo sem uso e se são efêmeras."""
+    client = chromadb.PersistentClient(path=str(persist_directory))
+    now = time.time()
+    collections = []
+    for collection in client.list_collections():
+        # Versões antigas do Chroma devolvem apenas os nomes
+        if isinstance(collection, str):
+            collection = client.get_collection(collection)
+        metadata = collection.metadata or {}
+        created_at = metadata.get('created_at')
+        last_used = metadata.get('last_used', created_at)
+        collections.append({
+            'name': collection.name,
+            'count': collection.count(),
+            'ephemeral': bool(metadata.get('ephemeral')),
+            'age_hours': (now - created_at) / 3600 if created_at else None,
+            'idle_hours': (now - last_used) / 3600 if last_used else None,
+        })
+    return collections
+
+def find_orphan_segments(persist_directory: Path) -> List[Path]:
+    """Diretórios de segmentos que não pertencem a nenhuma coleção registrada no SQLite."""
+    persist_directory = Path(persist_directory)
+    sqlite_path = persist_directory / CHROMA_SQLITE_FILENAME
+    if not sqlite_path.exists():
+        return []
+    with sqlite3.connect(str(sqlite_path)) as connection:
+        segment_ids = {row[0] for row in connection.execute("SELECT id FROM segments")}
+    return [
+        path for path in persist_directory.iterdir()
+        if path.is_dir() and SEGMENT_DIR_PATTERN.match(path.name) and path.name not in segment_ids
+    ]
+
+def remove_orphan_segments(persist_directory: Path) -> List[Path]:
+    """Remove do disco os segmentos órfãos (deixados por coleções já excluídas)."""
+    orphans = find_orphan_segments(persist_directory)
+    for path in orphans:
+        shutil.rmtree(path, ignore_errors=True)
+    return orphans
+
+def find_orphan_docstores(persist_directory: Path, collection_names) -> List[Path]:
+    """Armazenamentos de pais cuja coleção não existe mais (ex.: índice interrompido e removido)."""
+    return [
+        path for path in Path(persist_directory).glob(f"*{PARENT_DOCSTORE_SUFFIX}")
+        if path.name[:-len(PARENT_DOCSTORE_SUFFIX)] not in collection_names
+    ]
+
+def _remove_docstore(path: Path):
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+def remove_superseded_indexes(persist_directory: Path, current_collection: str) -> List[str]:
+    """
+    Remove os índices persistidos do diretório (coleção e armazenamento de pais)
+    que não são `current_collection`: cada diretório é de um livro, e um índice de
+    outra impressão digital é de um conteúdo que já mudou.
+    """
+    persist_directory = Path(persist_directory)
+    client = chromadb.PersistentClient(path=str(persist_directory))
+    prefix = f"{settings.VECTORSTORE_RUN_PREFIX}_idx_"
+    superseded = [
+        collection['name'] for collection in list_collections(persist_directory)
+        if collection['name'].startswith(prefix) and not collection['ephemeral'] and collection['name'] != current_collection
+    ]
+    for name in superseded:
+        client.delete_collection(name)
+    remaining = {collection['name'] for collection in list_collections(persist_directory)}
+    for path in find_orphan_docstores(persist_directory, remaining):
+        if path.name.startswith(prefix):
+            _remove_docstore(path)
+    remove_orphan_segments(persist_directory)
+    return superseded
+
+def report_vectorstore(persist_directory: Path) -> dict:
+    """Resume o conteúdo de um banco vetorial persistido."""
+    persist_directory = Path(persist_directory)
+    collections = list_collections(persist_directory)
+    return {
+        'directory': persist_directory,
+        'size_bytes': directory_size(persist_directory),
+        'collections': collections,
+        'orphan_segments': find_orphan_segments(persist_directory),
+        'orphan_docstores': find_orphan_docstores(persist_directory, {c['name'] for c in collections}),
+    }
+
+def compact_vectorstore(persist_directory: Path, max_age_hours: float = None, persistent_max_age_days: float = None) -> dict:
+    """
+    Remove as coleções efêmeras mais antigas que `max_age_hours` (execuções
+    interrompidas), os índices persistidos sem uso há mais de `persistent_max_age_days`
+    e a coleção legada de nome fixo, apaga os segmentos e armazenamentos de pais
+    órfãos e executa VACUUM no SQLite do Chroma.
+    """
+    persist_directory = Path(persist_directory)
+    if max_age_hours is None:
+        max_age_hours = settings.VECTORSTORE_ORPHAN_MAX_AGE_HOURS
+    if persistent_max_age_days is None:
+        persistent_max_age_days = settings.VECTORSTORE_PERSISTENT_MAX_AGE_DAYS
+    size_before = directory_size(persist_directory)
+
+    client = chromadb.PersistentClient(path=str(persist_directory))
+    deleted = []
+    remaining = set()
+    for collection in list_collections(persist_directory):
+        is_stale_run = collection['ephemeral'] and (collection['age_hours'] or 0) >= max_age_hours
+        is_unused_index = not collection['ephemeral'] and (collection['idle_hours'] or 0) >= persistent_max_age_days * 24
+        if is_stale_run or is_unused_index or collection['name'] == LEGACY_COLLECTION_NAME:
+            client.delete_collection(collection['name'])
+            deleted.append(collection['name'])
+        else:
+            remaining.add(collection['name'])
+
+    removed_segments = remove_orphan_segments(persist_directory)
+    removed_docstores = find_orphan_docstores(persist_directory, remaining)
+    for path in removed_docstores:
+        _remove_docstore(path)
+
+    sqlite_path = persist_directory / CHROMA_SQLITE_FILENAME
+    if sqlite_path.exists():
+        connection = sqlite3.connect(str(sqlite_path))
+        try:
+            connection.execute("VACUUM")
+        finally:
+            connection.close()
+
+    return {
+        'directory': persist_directory,
+        'deleted_collections': deleted,
+        'removed_segments': removed_segments,
+        'removed_docstores': removed_docstores,
+        'size_before': size_before,
+        'size_after': directory_size(persist_directory),
+    }
+
+def _vectorstore_directories(include_books: bool) -> List[Path]:
+    directories = [settings.VECTORSTORE_DIR]
+    if include_books and settings.BOOKS_ARTIFACTS_DIR.exists():
+        directories.extend(sorted(p for p in settings.BOOKS_ARTIFACTS_DIR.glob("*/vectorstore") if p.is_dir()))
+    return directories
+
+def main():
+    parser = argparse.ArgumentParser(description="Manutenção dos bancos vetoriais persistidos.")
+    parser.add_argument("command", choices=["report", "compact"])
+    parser.add_argument("--all", action="store_true", help="Inclui os bancos vetoriais dos livros do modo em lote.")
+    parser.add_argument("--max-age-hours", type=float, default=settings.VECTORSTORE_ORPHAN_MAX_AGE_HOURS)
+    parser.add_argument("--persistent-max-age-days", type=float, default=settings.VECTORSTORE_PERSISTENT_MAX_AGE_DAYS)
+    args = parser.parse_args()
+
+    for directory in _vectorstore_directories(args.all):
+        if args.command == "report":
+            report = report_vectorstore(directory)
+            logger.info(f"Banco vetorial '{directory}': {report['size_bytes'] / 1e6:.1f} MB")
+            for collection in report['collections']:
+                age = f"{collection['age_hours']:.1f}h" if collection['age_hours'] is not None else "?"
+                kind = "efêmera" if collection['ephemeral'] else "persistente"
+                logger.info(f"  - {collection['name']}: {collection['count']} chunks, {kind}, idade {age}")
+            logger.info(f"  Segmentos órfãos: {len(report['orphan_segments'])}")
+            logger.info(f"  Armazenamentos de pais órfãos: {len(report['orphan_docstores'])}")
+        else:
+            result = compact_vectorstore(directory, args.max_age_hours, args.persistent_max_age_days)
+            logger.info(
+                f"Banco vetorial '{directory}': {len(result['deleted_collections'])} coleções e "
+                f"{len(result['removed_segments'])} segmentos e {len(result['removed_docstores'])} "
+                f"armazenamentos de pais removidos; "
+                f"{result['size_before'] / 1e6:.1f} MB → {result['size_after'] / 1e6:.1f} MB"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,40 @@
 import json
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 from config import settings, prompts
 from src.utils.logger import logger
-from src.utils.llm_handler import invoke_llm_with_tracking
+from src.utils.llm_handler import (
+    abatch_invoke_llm_with_tracking, ainvoke_llm_with_tracking, batch_invoke_llm_with_tracking,
+    get_chain, invoke_llm_with_tracking,
+)
 
 def _run_chain(prompt_template_str: str, params: dict, temperature: float = 0.4) -> str:
     """Helper para executar uma cadeia LLM."""
-    llm = ChatOpenAI(model=settings.LLM_MODEL, temperature=temperature, api_key=settings.OPENAI_API_KEY)
-    prompt = PromptTemplate.from_template(prompt_template_str)
-    chain = prompt | llm | StrOutputParser()
-    return chain.invoke(params)
+    chain = get_chain(prompt_template_str, temperature=temperature)
+    return chain.invoke(params).content
 
-def generate_section(sumario_completo: str, capitulo_atual: str, subtitulo_atual: str, texto_original_da_secao: str, retriever_do_capitulo) -> str:
-    llm = ChatOpenAI(model=settings.LLM_MODEL, temperature=settings.LLM_TEMPERATURE, top_p=settings.LLM_TOP_P, api_key=settings.OPENAI_API_KEY)
-    prompt = PromptTemplate.from_template(prompts.CHAPTER_SECTION_GENERATOR_PROMPT)
-    chain = prompt | llm | StrOutputParser()
-    context_docs = retriever_do_capitulo.invoke(texto_original_da_secao)
+# As versões assíncronas (prefixo 'a') usam os mesmos prompts e parâmetros das
+# síncronas e permitem gerar as seções de um capítulo em paralelo.
+
+def _section_params(sumario_completo: str, capitulo_atual: str, subtitulo_atual: str, texto_original_da_secao: str, context_docs: list) -> dict:
     conteudo_do_rag_adicional = "\n---\n".join([doc.page_content for doc in context_docs if doc.page_content != texto_original_da_secao])
-    
-    return invoke_llm_with_tracking(chain, {
+    return {
         "sumario_completo": sumario_completo, "capitulo_atual": capitulo_atual, "subtitulo_atual": subtitulo_atual,
         "texto_original_da_secao": texto_original_da_secao, "conteudo_do_rag_adicional": conteudo_do_rag_adicional
-    }, f"Geração da Seção: {subtitulo_atual[:30]}")
+    }
 
-def identify_expansion_topics(chapter_text: str) -> list:
-    # --- INÍCIO DA CORREÇÃO ---
-    llm = ChatOpenAI(model=settings.LLM_MODEL, temperature=0.0, api_key=settings.OPENAI_API_KEY)
-    prompt = PromptTemplate.from_template(prompts.TOPIC_ANALYSIS_PROMPT)
-    chain = prompt | llm | StrOutputParser()
-    response = invoke_llm_with_tracking(
-        chain, {"chapter_text": chapter_text}, "Análise de Tópicos para Expansão"
-    )
-    # --- FIM DA CORREÇÃO ---
+def _section_chain():
+    return get_chain(prompts.CHAPTER_SECTION_GENERATOR_PROMPT, temperature=settings.LLM_TEMPERATURE, top_p=settings.LLM_TOP_P)
+
+def generate_section(sumario_completo: str, capitulo_atual: str, subtitulo_atual: str, texto_original_da_secao: str, retriever_do_capitulo) -> str:
+    context_docs = retriever_do_capitulo.invoke(texto_original_da_secao)
+    params = _section_params(sumario_completo, capitulo_atual, subtitulo_atual, texto_original_da_secao, context_docs)
+    return invoke_llm_with_tracking(_section_chain(), params, f"Geração da Seção: {subtitulo_atual[:30]}")
+
+async def agenerate_section(sumario_completo: str, capitulo_atual: str, subtitulo_atual: str, texto_original_da_secao: str, retriever_do_capitulo) -> str:
+    context_docs = await retriever_do_capitulo.ainvoke(texto_original_da_secao)
+    params = _section_params(sumario_completo, capitulo_atual, subtitulo_atual, texto_original_da_secao, context_docs)
+    return await ainvoke_llm_with_tracking(_section_chain(), params, f"Geração da Seção: {subtitulo_atual[:30]}")
+
+def _parse_topics(response: str) -> list:
     try:
         clean_response = response.strip().replace("```json", "").replace("```", "").strip()
         topics = json.loads(clean_response)
@@ -42,38 +43,111 @@ def identify_expansion_topics(chapter_text: str) -> list:
         logger.warning(f"Não foi possível decodificar a lista de tópicos para expansão. Resposta: {response}")
         return []
 
-def generate_expansion_paragraph(topic: str, base_text: str, mapa_de_conteudo_global: dict) -> str:
+def identify_expansion_topics(chapter_text: str) -> list:
+    chain = get_chain(prompts.TOPIC_ANALYSIS_PROMPT, temperature=0.0)
+    response = invoke_llm_with_tracking(
+        chain, {"chapter_text": chapter_text}, "Análise de Tópicos para Expansão"
+    )
+    return _parse_topics(response)
+
+async def aidentify_expansion_topics(chapter_text: str) -> list:
+    chain = get_chain(prompts.TOPIC_ANALYSIS_PROMPT, temperature=0.0)
+    response = await ainvoke_llm_with_tracking(
+        chain, {"chapter_text": chapter_text}, "Análise de Tópicos para Expansão"
+    )
+    return _parse_topics(response)
+
+def _expansion_params(topic: str, base_text: str, mapa_de_conteudo_global: dict, mapa_str: str = None) -> dict:
+    if mapa_str is None:
+        mapa_str = json.dumps(mapa_de_conteudo_global, indent=2, ensure_ascii=False)
+    return {"mapa_de_conteudo_global": mapa_str, "topic_to_expand": topic, "base_text": base_text}
+
+def _expansion_batch(topics: list, base_text: str, mapa_de_conteudo_global: dict):
+    """Entradas e nomes de tarefa de todos os tópicos (o mapa global é serializado uma única vez)."""
     mapa_str = json.dumps(mapa_de_conteudo_global, indent=2, ensure_ascii=False)
-    # --- INÍCIO DA CORREÇÃO ---
-    llm = ChatOpenAI(model=settings.LLM_MODEL, temperature=settings.LLM_TEMPERATURE, api_key=settings.OPENAI_API_KEY)
-    prompt = PromptTemplate.from_template(prompts.EXPANSION_GENERATOR_PROMPT)
-    chain = prompt | llm | StrOutputParser()
-    return invoke_llm_with_tracking(chain, {
-        "mapa_de_conteudo_global": mapa_str, "topic_to_expand": topic, "base_text": base_text
-    }, f"Expansão do Tópico: {topic[:30]}")
-    # --- FIM DA CORREÇÃO ---
+    params_list = [_expansion_params(topic, base_text, mapa_de_conteudo_global, mapa_str) for topic in topics]
+    return params_list, [f"Expansão do Tópico: {topic[:30]}" for topic in topics]
 
-def integrate_expansions(base_text: str, expansion_paragraphs: dict) -> str:
+def generate_expansion_paragraph(topic: str, base_text: str, mapa_de_conteudo_global: dict) -> str:
+    chain = get_chain(prompts.EXPANSION_GENERATOR_PROMPT, temperature=settings.LLM_TEMPERATURE)
+    return invoke_llm_with_tracking(
+        chain, _expansion_params(topic, base_text, mapa_de_conteudo_global), f"Expansão do Tópico: {topic[:30]}"
+    )
+
+async def agenerate_expansion_paragraph(topic: str, base_text: str, mapa_de_conteudo_global: dict) -> str:
+    chain = get_chain(prompts.EXPANSION_GENERATOR_PROMPT, temperature=settings.LLM_TEMPERATURE)
+    return await ainvoke_llm_with_tracking(
+        chain, _expansion_params(topic, base_text, mapa_de_conteudo_global), f"Expansão do Tópico: {topic[:30]}"
+    )
+
+def generate_expansion_paragraphs(topics: list, base_text: str, mapa_de_conteudo_global: dict) -> dict:
+    """
+    Gera os parágrafos de todos os tópicos de uma iteração como um único lote
+    concorrente. Uma falha afeta só o próprio tópico (parágrafo vazio) e o
+    dicionário mantém a ordem dos tópicos.
+    """
+    chain = get_chain(prompts.EXPANSION_GENERATOR_PROMPT, temperature=settings.LLM_TEMPERATURE)
+    params_list, task_names = _expansion_batch(topics, base_text, mapa_de_conteudo_global)
+    paragraphs = batch_invoke_llm_with_tracking(chain, params_list, task_names, settings.EXPANSION_MAX_CONCURRENCY)
+    return dict(zip(topics, paragraphs))
+
+async def agenerate_expansion_paragraphs(topics: list, base_text: str, mapa_de_conteudo_global: dict) -> dict:
+    chain = get_chain(prompts.EXPANSION_GENERATOR_PROMPT, temperature=settings.LLM_TEMPERATURE)
+    params_list, task_names = _expansion_batch(topics, base_text, mapa_de_conteudo_global)
+    paragraphs = await abatch_invoke_llm_with_tracking(chain, params_list, task_names, settings.EXPANSION_MAX_CONCURRENCY)
+    return dict(zip(topics, paragraphs))
+
+def _integration_params(base_text: str, expansion_paragraphs: dict) -> dict:
     paragraphs_str = "\n\n".join(f"--- NOVO PARÁGRAFO SOBRE '{topic}' ---\n{para}" for topic, para in expansion_paragraphs.items())
-    # --- INÍCIO DA CORREÇÃO ---
-    llm = ChatOpenAI(model=settings.LLM_MODEL, temperature=0.2, api_key=settings.OPENAI_API_KEY)
-    prompt = PromptTemplate.from_template(prompts.INTEGRATION_PROMPT)
-    chain = prompt | llm | StrOutputParser()
-    return invoke_llm_with_tracking(chain, {
-        "base_text": base_text, "expansion_paragraphs": paragraphs_str
-    }, "Integração de Conteúdo Expandido")
-    # --- FIM DA CORREÇÃO ---
+    return {"base_text": base_text, "expansion_paragraphs": paragraphs_str}
 
-def generate_curiosities(chapter_content: str) -> dict:
-    logger.info("    - Verificando a necessidade de uma seção 'Você sabia?'...")
-    # --- INÍCIO DA CORREÇÃO ---
-    llm = ChatOpenAI(model=settings.LLM_MODEL, temperature=0.7, api_key=settings.OPENAI_API_KEY)
-    prompt = PromptTemplate.from_template(prompts.CURIOSITY_GENERATOR_PROMPT)
-    chain = prompt | llm | StrOutputParser()
-    response = invoke_llm_with_tracking(
-        chain, {"context": chapter_content}, "Geração de Curiosidade"
+def integrate_expansions(base_text: str, expansion_paragraphs: dict) -> str:
+    """Integra os parágrafos novos ao texto base. Devolve o texto base se a chamada falhar."""
+    chain = get_chain(prompts.INTEGRATION_PROMPT, temperature=0.2)
+    integrated = invoke_llm_with_tracking(
+        chain, _integration_params(base_text, expansion_paragraphs), "Integração de Conteúdo Expandido"
     )
-    # --- FIM DA CORREÇÃO ---
+    return integrated or base_text
+
+async def aintegrate_expansions(base_text: str, expansion_paragraphs: dict) -> str:
+    chain = get_chain(prompts.INTEGRATION_PROMPT, temperature=0.2)
+    integrated = await ainvoke_llm_with_tracking(
+        chain, _integration_params(base_text, expansion_paragraphs), "Integração de Conteúdo Expandido"
+    )
+    return integrated or base_text
+
+def _single_shot_params(base_text: str, target_words: float, mapa_de_conteudo_global: dict) -> dict:
+    target_words = int(target_words)
+    return {
+        "mapa_de_conteudo_global": json.dumps(mapa_de_conteudo_global, indent=2, ensure_ascii=False),
+        "base_text": base_text, "target_words": target_words,
+        "words_to_add": max(0, target_words - len(base_text.split())),
+    }
+
+def expand_section(base_text: str, target_words: float, mapa_de_conteudo_global: dict) -> str:
+    """
+    Reescreve a seção inteira, já expandida até cerca de `target_words` palavras,
+    numa única chamada (modo "single_shot"). Devolve o texto base se a chamada falhar.
+    """
+    chain = get_chain(prompts.SINGLE_SHOT_EXPANSION_PROMPT, temperature=settings.LLM_TEMPERATURE)
+    expanded = invoke_llm_with_tracking(
+        chain, _single_shot_params(base_text, target_words, mapa_de_conteudo_global), "Expansão Única da Seção"
+    )
+    return expanded or base_text
+
+async def aexpand_section(base_text: str, target_words: float, mapa_de_conteudo_global: dict) -> str:
+    chain = get_chain(prompts.SINGLE_SHOT_EXPANSION_PROMPT, temperature=settings.LLM_TEMPERATURE)
+    expanded = await ainvoke_llm_with_tracking(
+        chain, _single_shot_params(base_text, target_words, mapa_de_conteudo_global), "Expansão Única da Seção"
+    )
+    return expanded or base_text
+
+def curiosity_request(chapter_content: str) -> tuple:
+    """(cadeia, parâmetros, nome da tarefa) da curiosidade, para execução individual ou em lote."""
+    chain = get_chain(prompts.CURIOSITY_GENERATOR_PROMPT, temperature=0.7)
+    return chain, {"context": chapter_content}, "Geração de Curiosidade"
+
+def parse_curiosity(response: str) -> dict:
     try:
         clean_response = response.strip().replace("```json", "").replace("```", "").strip()
         curiosity_data = json.loads(clean_response)
@@ -81,4 +155,8 @@ def generate_curiosities(chapter_content: str) -> dict:
         return curiosity_data
     except (json.JSONDecodeError, TypeError):
         logger.warning(f"      -> Não foi possível gerar uma curiosidade em formato JSON. Resposta: {response}")
-        return {"curiosidade": None}
\ No newline at end of file
+        return {"curiosidade": None}
+
+def generate_curiosities(chapter_content: str) -> dict:
+    logger.info("    - Verificando a necessidade de uma seção 'Você sabia?'...")
+    return parse_curiosity(invoke_llm_with_tracking(*curiosity_request(chapter_content)))
\ No newline at end of file
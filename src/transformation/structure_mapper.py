@@ -1,11 +1,9 @@
 import json 
 from pathlib import Path 
 import re 
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import PromptTemplate
 from config import settings, prompts
 from src.utils.logger import logger 
-from src.utils.llm_handler import invoke_llm_with_tracking
+from src.utils.llm_handler import batch_api_invoke_llm_with_tracking, get_chain, invoke_llm_with_tracking
 
 def generate_structure_map(markdown_content: str, output_path: Path) -> dict:
     """
@@ -13,20 +11,19 @@ def generate_structure_map(markdown_content: str, output_path: Path) -> dict:
     """
     logger.info("Gerando mapa da nova estrutura (unidade por unidade)...")
     
-    llm = ChatOpenAI(
+    chain = get_chain(
+        prompts.STRUCTURE_MAPPER_PROMPT,
+        temperature=0.0,
         # Usamos um modelo mais barato para esta tarefa estruturada
         model=settings.LLM_MODEL_STRUCTURE if hasattr(settings, 'LLM_MODEL_STRUCTURE') else 'gpt-3.5-turbo',
-        temperature=0.0,
-        api_key=settings.OPENAI_API_KEY
     )
-    prompt_template = PromptTemplate.from_template(prompts.STRUCTURE_MAPPER_PROMPT)
-    chain = prompt_template | llm
 
     unit_splits = re.split(r'(^#\s.*)', markdown_content, flags=re.MULTILINE)
     if unit_splits and not unit_splits[0].strip():
         unit_splits = unit_splits[1:]
 
     final_structure_map = {}
+    unit_titles, requests = [], []
 
     for i in range(0, len(unit_splits), 2):
         unit_title = unit_splits[i].strip().replace('# ', '')
@@ -39,13 +36,20 @@ def generate_structure_map(markdown_content: str, output_path: Path) -> dict:
             continue
 
         logger.info(f"Mapeando seções para a '{unit_title}'...")
-        
-        response_content = invoke_llm_with_tracking(
-            chain, 
+        unit_titles.append(unit_title)
+        requests.append((
+            chain,
             {"unit_title": unit_title, "section_list": "\n".join(section_list)},
             f"Mapeamento da Estrutura: {unit_title}"
-        )
+        ))
+
+    # As unidades são independentes: no modo "batch_api" viram um único lote
+    if settings.LLM_EXECUTION_MODE == "batch_api":
+        responses = batch_api_invoke_llm_with_tracking(requests)
+    else:
+        responses = [invoke_llm_with_tracking(*request) for request in requests]
 
+    for unit_title, response_content in zip(unit_titles, responses):
         try:
             json_content = response_content.strip().replace("```json", "").replace("```", "").strip()
             unit_map = json.loads(json_content)
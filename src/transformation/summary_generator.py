@@ -1,29 +1,76 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from config import settings, prompts 
-from src.utils.llm_handler import invoke_llm_with_tracking
+import json
+from config import prompts 
+from src.transformation import content_generator
+from src.utils.llm_handler import get_chain, invoke_llm_with_tracking
+from src.utils.logger import logger
+
+# As funções `*_request` devolvem (cadeia, parâmetros, nome da tarefa) sem chamar o LLM,
+# para que as chamadas independentes de uma etapa possam ser enviadas em lote.
+
+def unit_theme_request(unit_title: str, chapter_summaries: str) -> tuple:
+    chain = get_chain(prompts.UNIT_THEME_GENERATOR_PROMPT, temperature=0.3)
+    return chain, {"unit_title": unit_title, "chapter_summaries": chapter_summaries}, "Geração de Tema da Unidade"
 
 def generate_unit_theme(unit_title: str, chapter_summaries: str, retriever) -> str:
     """Gera a seção 'Temáticas da unidade' com base nos resumos dos capítulos."""
-    llm = ChatOpenAI(model=settings.LLM_MODEL, temperature=0.3, api_key=settings.OPENAI_API_KEY)
-    prompt = PromptTemplate.from_template(prompts.UNIT_THEME_GENERATOR_PROMPT)
-    chain = prompt | llm | StrOutputParser()
-    return invoke_llm_with_tracking(
-        chain, 
-        {"unit_title": unit_title, "chapter_summaries": chapter_summaries}, 
-        "Geração de Tema da Unidade"
-    )
+    return invoke_llm_with_tracking(*unit_theme_request(unit_title, chapter_summaries))
+
+def chapter_summary_request(chapter_content: str) -> tuple:
+    chain = get_chain(prompts.CHAPTER_SUMMARY_GENERATOR_PROMPT, temperature=0.2)
+    return chain, {"context": chapter_content}, "Geração de Resumo do Capítulo"
 
 def generate_chapter_summary(chapter_content: str, retriever) -> str:
-    llm = ChatOpenAI(model=settings.LLM_MODEL, temperature=0.2, api_key=settings.OPENAI_API_KEY)
-    prompt = PromptTemplate.from_template(prompts.CHAPTER_SUMMARY_GENERATOR_PROMPT)
-    chain = prompt | llm | StrOutputParser()
-    return invoke_llm_with_tracking(chain, {"context": chapter_content}, "Geração de Resumo do Capítulo")
+    return invoke_llm_with_tracking(*chapter_summary_request(chapter_content))
 
 def summarize_text(text_to_summarize: str) -> str:
     if not text_to_summarize or not text_to_summarize.strip(): return ""
-    llm = ChatOpenAI(model=settings.LLM_MODEL, temperature=0.0, api_key=settings.OPENAI_API_KEY)
-    prompt = PromptTemplate.from_template(prompts.TEXT_SUMMARIZER_PROMPT)
-    chain = prompt | llm | StrOutputParser()
-    return invoke_llm_with_tracking(chain, {"text_to_summarize": text_to_summarize}, "Sumarização para Mapa Global")
\ No newline at end of file
+    chain = get_chain(prompts.TEXT_SUMMARIZER_PROMPT, temperature=0.0)
+    return invoke_llm_with_tracking(chain, {"text_to_summarize": text_to_summarize}, "Sumarização para Mapa Global")
+
+def chapter_enrichment_request(chapter_content: str) -> tuple:
+    chain = get_chain(prompts.CHAPTER_ENRICHMENT_PROMPT, temperature=0.3)
+    return chain, {"context": chapter_content}, "Enriquecimento do Capítulo"
+
+def _valid_text(value) -> bool:
+    return isinstance(value, str) and bool(value.strip())
+
+def parse_chapter_enrichment(response: str) -> dict:
+    """
+    Lê o JSON da chamada combinada e devolve só os campos válidos: "curiosidade"
+    (texto ou null), "resumo" e "resumo_mapa" (textos não vazios).
+    """
+    try:
+        clean_response = response.strip().replace("```json", "").replace("```", "").strip()
+        data = json.loads(clean_response)
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        data = None
+    if not isinstance(data, dict):
+        logger.warning(f"      -> O enriquecimento combinado não é um objeto JSON válido. Resposta: {response}")
+        return {}
+    fields = {}
+    if "curiosidade" in data and (data["curiosidade"] is None or _valid_text(data["curiosidade"])):
+        fields["curiosidade"] = data["curiosidade"]
+    for key in ("resumo", "resumo_mapa"):
+        if _valid_text(data.get(key)):
+            fields[key] = data[key].strip()
+    return fields
+
+def generate_chapter_enrichment(chapter_content: str, retriever) -> dict:
+    """
+    Curiosidade, resumo "Resumindo" e resumo de uma frase para o mapa global numa
+    única chamada, em vez de enviar o capítulo três vezes. Os campos ausentes ou
+    inválidos na resposta são gerados pelas chamadas separadas de sempre.
+    Devolve {"curiosidade": ..., "resumo": ..., "resumo_mapa": ...}.
+    """
+    fields = parse_chapter_enrichment(invoke_llm_with_tracking(*chapter_enrichment_request(chapter_content)))
+    fallbacks = {
+        "curiosidade": lambda: content_generator.generate_curiosities(chapter_content).get("curiosidade"),
+        "resumo": lambda: generate_chapter_summary(chapter_content, retriever),
+        "resumo_mapa": lambda: summarize_text(chapter_content),
+    }
+    missing = [key for key in fallbacks if key not in fields]
+    if missing:
+        logger.warning(f"      -> Enriquecimento combinado incompleto; gerando separadamente: {', '.join(missing)}")
+    for key in missing:
+        fields[key] = fallbacks[key]()
+    return fields
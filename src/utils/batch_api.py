@@ -0,0 +1,88 @@
+import json
+import time
+from typing import Dict
+
+import openai
+
+from src.utils.logger import logger
+
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+# Estados em que o lote não muda mais
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+class BatchJobError(RuntimeError):
+    """O lote não foi concluído (falhou, expirou, foi cancelado ou excedeu o prazo)."""
+
+class OpenAIBatchRunner:
+    """
+    Executa requisições de chat como jobs da Batch API da OpenAI: grava as
+    requisições num arquivo JSONL, cria o lote, consulta seu estado a cada
+    `poll_interval` segundos e lê os arquivos de saída e de erros. Lotes maiores
+    que `max_requests` são divididos em vários jobs, executados um após o outro.
+    """
+
+    def __init__(self, client: openai.OpenAI, poll_interval: float, timeout: float,
+                 completion_window: str = "24h", max_requests: int = 50_000):
+        self.client = client
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.completion_window = completion_window
+        self.max_requests = max_requests
+
+    def run(self, bodies: Dict[str, dict]) -> Dict[str, dict]:
+        """
+        Recebe o corpo de cada requisição por `custom_id` e devolve, por `custom_id`,
+        o corpo da resposta ou `{'error': ...}`. Requisições sem resultado ficam de fora.
+        """
+        custom_ids = list(bodies)
+        results = {}
+        for start in range(0, len(custom_ids), self.max_requests):
+            chunk = {custom_id: bodies[custom_id] for custom_id in custom_ids[start:start + self.max_requests]}
+            results.update(self._run_job(chunk))
+        return results
+
+    def _run_job(self, bodies: Dict[str, dict]) -> Dict[str, dict]:
+        lines = [
+            json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': CHAT_COMPLETIONS_ENDPOINT, 'body': body}, ensure_ascii=False)
+            for custom_id, body in bodies.items()
+        ]
+        input_file = self.client.files.create(
+            file=("lote.jsonl", "\n".join(lines).encode('utf-8'), "application/jsonl"), purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint=CHAT_COMPLETIONS_ENDPOINT, completion_window=self.completion_window,
+        )
+        logger.info(f"Lote '{batch.id}' enviado à Batch API com {len(bodies)} requisições.")
+
+        deadline = time.monotonic() + self.timeout
+        while batch.status not in FINAL_STATUSES:
+            if time.monotonic() > deadline:
+                self.client.batches.cancel(batch.id)
+                raise BatchJobError(f"O lote '{batch.id}' não terminou dentro do prazo e foi cancelado.")
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            if counts is not None:
+                logger.info(f"  - Lote '{batch.id}': {batch.status} ({counts.completed}/{counts.total} concluídas)")
+
+        if batch.status != "completed":
+            raise BatchJobError(f"O lote '{batch.id}' terminou com o estado '{batch.status}'.")
+
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                results.update(self._read_results(file_id))
+        return results
+
+    def _read_results(self, file_id: str) -> Dict[str, dict]:
+        results = {}
+        for line in self.client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            if record.get('error') is None and response.get('status_code') == 200:
+                results[record['custom_id']] = response['body']
+            else:
+                results[record['custom_id']] = {'error': record.get('error') or response.get('body')}
+        return results
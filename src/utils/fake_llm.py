@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from config import prompts
+from src.utils.rate_limiting import estimate_tokens
+
+# Vocabulário das respostas sintéticas
+VOCABULARY = (
+    "análise estrutura processo sistema conceito método modelo energia célula reação força "
+    "equilíbrio variação função relação princípio estudo exemplo aplicação resultado propriedade "
+    "fenômeno teoria experimento dado conjunto elemento etapa fator mecanismo condição efeito"
+).split()
+
+def _signature(template: str) -> str:
+    """Texto fixo do início do prompt, antes da primeira variável."""
+    return template.split("{", 1)[0].strip()
+
+STRUCTURE_MAPPER_SIGNATURE = _signature(prompts.STRUCTURE_MAPPER_PROMPT)
+TOPIC_ANALYSIS_SIGNATURE = _signature(prompts.TOPIC_ANALYSIS_PROMPT)
+CURIOSITY_SIGNATURE = _signature(prompts.CURIOSITY_GENERATOR_PROMPT)
+CHAPTER_ENRICHMENT_SIGNATURE = _signature(prompts.CHAPTER_ENRICHMENT_PROMPT)
+INTEGRATION_SIGNATURE = _signature(prompts.INTEGRATION_PROMPT)
+SINGLE_SHOT_EXPANSION_SIGNATURE = _signature(prompts.SINGLE_SHOT_EXPANSION_PROMPT)
+
+def _words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(max(1, count)))
+
+def _text(rng: random.Random, word_count: int) -> str:
+    """Texto corrido de `word_count` palavras em parágrafos de até 80."""
+    words = _words(rng, word_count).split()
+    return "\n\n".join(" ".join(words[i:i + 80]).capitalize() + "." for i in range(0, len(words), 80))
+
+def _tag_word_count(prompt: str, tag: str) -> int:
+    """Palavras dentro da última ocorrência de <tag>...</tag> (a tag também aparece nas instruções)."""
+    end = prompt.rfind(f"</{tag}>")
+    start = prompt.rfind(f"<{tag}>", 0, end)
+    return len(prompt[start + len(tag) + 2:end].split()) if start != -1 else 0
+
+def _structure_map(prompt: str) -> str:
+    """Distribui as seções da unidade, em ordem, entre 4 capítulos equilibrados."""
+    match = re.search(r'<lista_de_secoes_da_unidade>(.*?)</lista_de_secoes_da_unidade>', prompt, re.DOTALL)
+    sections = re.findall(r'^##\s.*$', match.group(1) if match else "", flags=re.MULTILINE)
+    size, extra = divmod(len(sections), 4)
+    chapters, start = {}, 0
+    for i in range(4):
+        end = start + size + (1 if i < extra else 0)
+        chapters[f"Capítulo {i + 1}"] = sections[start:end]
+        start = end
+    return json.dumps(chapters, ensure_ascii=False)
+
+def fake_response(prompt: str, rng: random.Random, completion_tokens: int) -> str:
+    """
+    Resposta sintética no formato que o pipeline espera de cada prompt: JSON para o
+    mapa da estrutura, a análise de tópicos, a curiosidade e o enriquecimento combinado
+    do capítulo; texto livre para os demais. Como um modelo real, a integração devolve o
+    texto base com os parágrafos e a expansão única atinge a meta de palavras pedida.
+    """
+    prompt = prompt.strip()
+    if prompt.startswith(STRUCTURE_MAPPER_SIGNATURE):
+        return _structure_map(prompt)
+    if prompt.startswith(TOPIC_ANALYSIS_SIGNATURE):
+        return json.dumps([f"Tópico {_words(rng, 2)}" for _ in range(rng.randint(2, 3))], ensure_ascii=False)
+    if prompt.startswith(CURIOSITY_SIGNATURE):
+        return json.dumps({"curiosidade": _words(rng, 30).capitalize() + "."}, ensure_ascii=False)
+    if prompt.startswith(CHAPTER_ENRICHMENT_SIGNATURE):
+        return json.dumps({
+            "curiosidade": _words(rng, 30).capitalize() + ".",
+            "resumo": _words(rng, int(completion_tokens * 0.75)).capitalize() + ".",
+            "resumo_mapa": _words(rng, 15).capitalize() + ".",
+        }, ensure_ascii=False)
+    if prompt.startswith(INTEGRATION_SIGNATURE):
+        return _text(rng, _tag_word_count(prompt, "texto_base_da_secao") + _tag_word_count(prompt, "paragrafos_de_expansao"))
+    if prompt.startswith(SINGLE_SHOT_EXPANSION_SIGNATURE):
+        target = re.search(r'<meta_de_palavras>(\d+)</meta_de_palavras>', prompt)
+        return _text(rng, int(target.group(1)) if target else int(completion_tokens * 0.75))
+    # ~0,75 palavra por token
+    return _text(rng, int(completion_tokens * 0.75))
+
+class FakeChatModel(BaseChatModel):
+    """
+    Modelo de chat local e determinístico, para testes e benchmarks sem custo.
+    A resposta, sua latência e seu tamanho dependem apenas do prompt, do modelo e
+    de `seed`: latência ~ Normal(`latency_mean`, `latency_std`) em segundos e
+    tokens de resposta ~ Normal(`completion_tokens_mean`, `completion_tokens_std`).
+    Informa o uso de tokens como a API, para os callbacks de custo e as métricas.
+    """
+
+    model_name: str
+    temperature: float = 0.0
+    top_p: Optional[float] = None
+    latency_mean: float = 0.0
+    latency_std: float = 0.0
+    completion_tokens_mean: int = 400
+    completion_tokens_std: int = 100
+    seed: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _respond(self, messages: List[BaseMessage]):
+        prompt = "\n".join(str(message.content) for message in messages)
+        digest = hashlib.sha256(f"{self.seed}\0{self.model_name}\0{prompt}".encode('utf-8')).digest()
+        rng = random.Random(int.from_bytes(digest[:8], 'big'))
+        latency = max(0.0, rng.gauss(self.latency_mean, self.latency_std))
+        completion_tokens = max(1, int(rng.gauss(self.completion_tokens_mean, self.completion_tokens_std)))
+        text = fake_response(prompt, rng, completion_tokens)
+
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        message = AIMessage(content=text, usage_metadata={
+            'input_tokens': prompt_tokens, 'output_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens,
+        })
+        token_usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
+        result = ChatResult(generations=[ChatGeneration(message=message)], llm_output={'token_usage': token_usage, 'model_name': self.model_name})
+        return result, latency
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        result, latency = self._respond(messages)
+        time.sleep(latency)
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        result, latency = self._respond(messages)
+        await asyncio.sleep(latency)
+        return result
@@ -1,19 +1,483 @@
+import asyncio
+import contextvars
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+import openai
 from langchain_community.callbacks import get_openai_callback
-from langchain_core.runnables.base import Runnable
+from langchain_community.callbacks.openai_info import TokenType, get_openai_token_cost_for_model
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import convert_to_openai_messages
+from langchain_core.prompts import BasePromptTemplate, PromptTemplate
+from langchain_core.runnables.base import Runnable, RunnableSequence
+from langchain_openai import ChatOpenAI
+from config import settings
+from src.utils.batch_api import BatchJobError, OpenAIBatchRunner
+from src.utils.fake_llm import FakeChatModel
+from src.utils.llm_scheduler import LLMScheduler
 from src.utils.logger import logger
+from src.utils.rate_limiting import RETRYABLE_ERRORS, estimate_tokens
+from src.utils.response_cache import LLMResponseCache
+
+# Um único cliente HTTP com conexões keep-alive é compartilhado por todos os
+# modelos, e cada cadeia (modelo, temperatura, top_p, prompt) é montada uma só vez
+# por processo. Assim, o laço de geração não recria clientes nem refaz handshakes TLS.
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_llm_registry: Dict[Tuple, BaseChatModel] = {}
+_chain_registry: Dict[Tuple, Runnable] = {}
+_registry_lock = threading.Lock()
+_response_cache: Optional[LLMResponseCache] = None
+_scheduler: Optional[LLMScheduler] = None
+_rate_limit_share = 1.0
+_batch_api_usage = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost': 0.0}
+
+def get_http_client() -> httpx.Client:
+    """Cliente HTTP compartilhado (pool de conexões keep-alive) para as chamadas à OpenAI."""
+    global _http_client
+    with _registry_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=settings.LLM_HTTP_TIMEOUT,
+            )
+        return _http_client
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Versão assíncrona do cliente compartilhado. Suas conexões ficam presas ao laço
+    de eventos em que foram abertas, por isso o pipeline usa um único laço por execução.
+    """
+    global _async_http_client
+    with _registry_lock:
+        if _async_http_client is None:
+            _async_http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=settings.LLM_HTTP_TIMEOUT,
+            )
+        return _async_http_client
+
+async def aclose_async_http_client():
+    """
+    Fecha o cliente assíncrono antes de encerrar o laço de eventos que o usou.
+    Os modelos registrados o referenciam, então o registro também é esvaziado.
+    """
+    global _async_http_client
+    with _registry_lock:
+        client, _async_http_client = _async_http_client, None
+        _chain_registry.clear()
+        _llm_registry.clear()
+    if client is not None:
+        await client.aclose()
 
-def invoke_llm_with_tracking(chain: Runnable, params: dict, task_name: str) -> str:
+def _create_llm(model: str, temperature: float, top_p: Optional[float]) -> BaseChatModel:
     """
-    Invoca uma cadeia LangChain. O rastreamento de custo será feito por um 
+    Cria o modelo de chat com o provedor de `settings.LLM_PROVIDER`. O modelo falso usa
+    o nome "fake-<modelo>", para não se misturar ao real no cache e nos limites de taxa.
+    """
+    if settings.LLM_PROVIDER == "fake":
+        return FakeChatModel(
+            model_name=f"fake-{model}", temperature=temperature, top_p=top_p,
+            latency_mean=settings.FAKE_LLM_LATENCY_MEAN, latency_std=settings.FAKE_LLM_LATENCY_STD,
+            completion_tokens_mean=settings.FAKE_LLM_COMPLETION_TOKENS_MEAN,
+            completion_tokens_std=settings.FAKE_LLM_COMPLETION_TOKENS_STD,
+            seed=settings.FAKE_LLM_SEED,
+        )
+    # O cliente assíncrono só é criado no modo que o usa e o fecha ao final do livro
+    http_async_client = get_async_http_client() if settings.SECTION_EXECUTION_MODE == "async" else None
+    return ChatOpenAI(
+        model=model, temperature=temperature, top_p=top_p,
+        api_key=settings.OPENAI_API_KEY, http_client=get_http_client(),
+        http_async_client=http_async_client,
+        # As novas tentativas ficam a cargo do agendador, que respeita os limites de taxa
+        max_retries=0,
+    )
+
+def get_llm(model: str, temperature: float, top_p: Optional[float] = None) -> BaseChatModel:
+    """Retorna o modelo de chat registrado para (modelo, temperatura, top_p), criando-o na primeira vez."""
+    key = (model, temperature, top_p)
+    llm = _llm_registry.get(key)
+    if llm is None:
+        # Criado fora da trava: os clientes HTTP compartilhados usam a mesma trava
+        created = _create_llm(model, temperature, top_p)
+        with _registry_lock:
+            llm = _llm_registry.setdefault(key, created)
+    return llm
+
+def get_chain(prompt_template: str, temperature: float, top_p: Optional[float] = None, model: Optional[str] = None) -> Runnable:
+    """
+    Retorna a cadeia `prompt | llm` registrada para (modelo, temperatura, top_p, prompt).
+    A cadeia devolve a mensagem do modelo (com os metadados de uso), e
+    `invoke_llm_with_tracking` extrai o texto.
+    """
+    model = model or settings.LLM_MODEL
+    key = (model, temperature, top_p, prompt_template)
+    chain = _chain_registry.get(key)
+    if chain is None:
+        llm = get_llm(model, temperature, top_p)
+        with _registry_lock:
+            chain = _chain_registry.get(key)
+            if chain is None:
+                chain = PromptTemplate.from_template(prompt_template) | llm
+                _chain_registry[key] = chain
+    return chain
+
+def clear_chain_registry():
+    """Esvazia o registro de cadeias e modelos (ex.: após alterar as configurações)."""
+    with _registry_lock:
+        _chain_registry.clear()
+        _llm_registry.clear()
+
+def get_response_cache() -> Optional[LLMResponseCache]:
+    """Cache de respostas compartilhado pelo processo, ou None se estiver desativado."""
+    global _response_cache
+    if not settings.USE_LLM_RESPONSE_CACHE:
+        return None
+    with _registry_lock:
+        if _response_cache is None:
+            ttl_days = settings.LLM_RESPONSE_CACHE_TTL_DAYS
+            _response_cache = LLMResponseCache(
+                settings.LLM_RESPONSE_CACHE_PATH,
+                ttl_seconds=ttl_days * 86400 if ttl_days is not None else None,
+                max_entries=settings.LLM_RESPONSE_CACHE_MAX_ENTRIES,
+            )
+        return _response_cache
+
+def reset_response_cache():
+    """Descarta o cache de respostas do processo (ex.: após alterar as configurações)."""
+    global _response_cache
+    with _registry_lock:
+        _response_cache = None
+
+def response_cache_stats() -> dict:
+    """Estatísticas do cache de respostas no processo (zeradas se estiver desativado)."""
+    cache = _response_cache
+    if cache is None:
+        return {'hits': 0, 'misses': 0, 'prompt_tokens_saved': 0, 'completion_tokens_saved': 0, 'tokens_saved': 0}
+    return cache.stats()
+
+def get_scheduler() -> LLMScheduler:
+    """Agendador de chamadas compartilhado pelo processo (limites por modelo, prioridades e novas tentativas)."""
+    global _scheduler
+    with _registry_lock:
+        if _scheduler is None:
+            rate_limits = {model: _shared_limits(limits) for model, limits in settings.LLM_RATE_LIMITS.items()}
+            _scheduler = LLMScheduler(
+                rate_limits, _shared_limits(settings.LLM_DEFAULT_RATE_LIMITS), settings.LLM_MAX_RETRIES,
+                base_delay=settings.LLM_RETRY_BASE_DELAY, max_delay=settings.LLM_RETRY_MAX_DELAY,
+            )
+        return _scheduler
+
+def _shared_limits(limits: Tuple[float, float]) -> Tuple[float, float]:
+    requests_per_minute, tokens_per_minute = limits
+    return requests_per_minute * _rate_limit_share, tokens_per_minute * _rate_limit_share
+
+def reset_scheduler(rate_limit_share: float = 1.0):
+    """
+    Descarta o agendador do processo (e suas métricas). `rate_limit_share` é a fração
+    dos limites da conta que cabe a este processo quando vários processos a dividem.
+    """
+    global _scheduler, _rate_limit_share
+    with _registry_lock:
+        _scheduler = None
+        _rate_limit_share = rate_limit_share
+
+def scheduler_metrics() -> dict:
+    """Métricas de vazão por modelo no processo (vazio se nenhuma chamada foi feita)."""
+    scheduler = _scheduler
+    return scheduler.metrics() if scheduler is not None else {}
+
+def scheduler_task_metrics() -> dict:
+    """Chamadas e tokens por tipo de tarefa no processo (vazio se nenhuma chamada foi feita)."""
+    scheduler = _scheduler
+    return scheduler.task_metrics() if scheduler is not None else {}
+
+def task_priority(task_name: str) -> int:
+    """Prioridade da tarefa no agendador, pelo início do nome (menor = antes)."""
+    for prefix, priority in settings.LLM_TASK_PRIORITIES.items():
+        if task_name.startswith(prefix):
+            return priority
+    return settings.LLM_DEFAULT_PRIORITY
+
+class _Request(NamedTuple):
+    cache_key: Optional[str]
+    model: str
+    priority: int
+    tokens: int
+
+def _prepare_request(chain: Runnable, params: dict, task_name: str, use_cache: bool, priority: Optional[int]) -> _Request:
+    """
+    Renderiza o prompt uma vez para obter a chave do cache de respostas (modelo,
+    temperatura, top_p e prompt renderizado) e a estimativa de tokens usada nos
+    limites de taxa. Sem cadeia `prompt | llm`, não há cache e o modelo é "default".
+    """
+    rendered_prompt, llm = None, None
+    if isinstance(chain, RunnableSequence) and isinstance(chain.first, BasePromptTemplate):
+        llm = chain.last
+        try:
+            rendered_prompt = chain.first.invoke(params).to_string()
+        except Exception:
+            # Parâmetros inválidos: a própria chamada à cadeia reporta o erro
+            pass
+    model = getattr(llm, 'model_name', None) or "default"
+    tokens = estimate_tokens(rendered_prompt if rendered_prompt is not None else str(params)) + settings.LLM_EXPECTED_COMPLETION_TOKENS
+
+    cache_key = None
+    cache = get_response_cache()
+    if (use_cache and cache is not None and rendered_prompt is not None
+            and not task_name.startswith(tuple(settings.LLM_CACHE_DISABLED_TASKS))):
+        cache_key = cache.make_key(model, getattr(llm, 'temperature', None), getattr(llm, 'top_p', None), rendered_prompt)
+    return _Request(cache_key, model, task_priority(task_name) if priority is None else priority, tokens)
+
+def _cached_response(key: Optional[str]) -> Optional[str]:
+    if key is None:
+        return None
+    try:
+        return get_response_cache().get(key)
+    except sqlite3.Error as e:
+        logger.warning(f"  - Falha ao consultar o cache de respostas: {e}")
+        return None
+
+def _store_response(key: Optional[str], response):
+    """Guarda a resposta com os tokens que ela custou, para contabilizar a economia nos acertos."""
+    content = response if isinstance(response, str) else response.content
+    usage = getattr(response, 'usage_metadata', None) or {}
+    _store_content(key, content, usage.get('input_tokens', 0), usage.get('output_tokens', 0))
+
+def _store_content(key: Optional[str], content: str, prompt_tokens: int, completion_tokens: int):
+    if key is None or not content:
+        return
+    try:
+        get_response_cache().put(key, content, prompt_tokens, completion_tokens)
+    except sqlite3.Error as e:
+        logger.warning(f"  - Falha ao gravar no cache de respostas: {e}")
+
+def invoke_llm_with_tracking(chain: Runnable, params: dict, task_name: str, use_cache: bool = True,
+                             priority: Optional[int] = None) -> str:
+    """
+    Invoca uma cadeia LangChain. O rastreamento de custo será feito por um
     context manager global no ponto de entrada do script (main.py).
+    Respostas já obtidas para o mesmo prompt vêm do cache de respostas,
+    salvo se `use_cache` for False ou a tarefa estiver em LLM_CACHE_DISABLED_TASKS.
+    As demais passam pelo agendador, que respeita os limites de taxa do modelo e
+    repete erros transitórios. Se eles persistirem, o erro é propagado em vez de
+    virar um texto vazio (a execução pode ser retomada com `--resume`); outros
+    erros são registrados e devolvem "".
     """
     response_content = ""
     try:
-        # Executa a chamada diretamente, sem o callback local
-        response = chain.invoke(params)
+        request = _prepare_request(chain, params, task_name, use_cache, priority)
+        cached = _cached_response(request.cache_key)
+        if cached is not None:
+            return cached
+        response = get_scheduler().run(request.model, request.priority, request.tokens, lambda: chain.invoke(params), task_name)
         response_content = response if isinstance(response, str) else response.content
+        _store_response(request.cache_key, response)
+    except RETRYABLE_ERRORS:
+        raise
+    except Exception as e:
+        logger.error(f"  - Erro durante a execução da tarefa '{task_name}': {e}")
+        return ""
+
+    return response_content
+
+async def ainvoke_llm_with_tracking(chain: Runnable, params: dict, task_name: str, use_cache: bool = True,
+                                    priority: Optional[int] = None) -> str:
+    """Versão assíncrona de `invoke_llm_with_tracking`, com o mesmo tratamento de erros, cache e agendamento."""
+    try:
+        request = _prepare_request(chain, params, task_name, use_cache, priority)
+        cached = _cached_response(request.cache_key)
+        if cached is not None:
+            return cached
+        response = await get_scheduler().arun(request.model, request.priority, request.tokens, lambda: chain.ainvoke(params), task_name)
+        _store_response(request.cache_key, response)
+        return response if isinstance(response, str) else response.content
+    except RETRYABLE_ERRORS:
+        raise
     except Exception as e:
         logger.error(f"  - Erro durante a execução da tarefa '{task_name}': {e}")
         return ""
-        
-    return response_content
\ No newline at end of file
+
+def _batch_contents(responses: list, task_names: List[str]) -> List[str]:
+    contents = []
+    for response, task_name in zip(responses, task_names):
+        if isinstance(response, Exception):
+            logger.error(f"  - Erro durante a execução da tarefa '{task_name}': {response}")
+            contents.append("")
+        else:
+            contents.append(response if isinstance(response, str) else response.content)
+    return contents
+
+def _split_cached(chain: Runnable, params_list: List[dict], task_names: List[str], use_cache: bool):
+    """Separa as entradas já respondidas no cache das que precisam ir à API."""
+    requests = [_prepare_request(chain, params, task_name, use_cache, None) for params, task_name in zip(params_list, task_names)]
+    contents = [_cached_response(request.cache_key) for request in requests]
+    missing = [i for i, content in enumerate(contents) if content is None]
+    return requests, contents, missing
+
+def _merge_responses(requests, contents, missing, responses, task_names) -> List[str]:
+    """
+    Preenche as respostas obtidas na API. As bem-sucedidas vão para o cache antes
+    de um erro transitório persistente ser propagado, para não serem pagas de novo.
+    """
+    for i, response in zip(missing, responses):
+        if not isinstance(response, Exception):
+            _store_response(requests[i].cache_key, response)
+    for response in responses:
+        if isinstance(response, RETRYABLE_ERRORS):
+            raise response
+    for i, content in zip(missing, _batch_contents(responses, [task_names[i] for i in missing])):
+        contents[i] = content
+    return contents
+
+def batch_invoke_llm_with_tracking(chain: Runnable, params_list: List[dict], task_names: List[str], max_concurrency: int,
+                                   use_cache: bool = True) -> List[str]:
+    """
+    Invoca a cadeia para várias entradas em paralelo (até `max_concurrency`).
+    Cada requisição é isolada: a que falhar devolve "" sem afetar as demais.
+    Os resultados seguem a ordem de `params_list`; só as entradas ausentes do
+    cache de respostas são enviadas à API, cada uma pelo agendador.
+    """
+    if not params_list:
+        return []
+    requests, contents, missing = _split_cached(chain, params_list, task_names, use_cache)
+    if not missing:
+        return contents
+    scheduler = get_scheduler()
+
+    def call(i):
+        try:
+            return scheduler.run(requests[i].model, requests[i].priority, requests[i].tokens,
+                                 lambda: chain.invoke(params_list[i]), task_names[i])
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        # Copia o contexto para que callbacks como o get_openai_callback vejam as chamadas
+        futures = [executor.submit(contextvars.copy_context().run, call, i) for i in missing]
+        responses = [future.result() for future in futures]
+    return _merge_responses(requests, contents, missing, responses, task_names)
+
+async def abatch_invoke_llm_with_tracking(chain: Runnable, params_list: List[dict], task_names: List[str], max_concurrency: int,
+                                          use_cache: bool = True) -> List[str]:
+    """Versão assíncrona de `batch_invoke_llm_with_tracking`."""
+    if not params_list:
+        return []
+    requests, contents, missing = _split_cached(chain, params_list, task_names, use_cache)
+    if not missing:
+        return contents
+    scheduler = get_scheduler()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def call(i):
+        async with semaphore:
+            try:
+                return await scheduler.arun(requests[i].model, requests[i].priority, requests[i].tokens,
+                                            lambda: chain.ainvoke(params_list[i]), task_names[i])
+            except Exception as e:
+                return e
+
+    responses = await asyncio.gather(*(call(i) for i in missing))
+    return _merge_responses(requests, contents, missing, responses, task_names)
+
+def get_batch_runner() -> OpenAIBatchRunner:
+    """Executor de lotes da Batch API (em `settings.BATCH_API_BASE_URL`, se definido)."""
+    client = openai.OpenAI(
+        api_key=settings.OPENAI_API_KEY, base_url=settings.BATCH_API_BASE_URL, http_client=get_http_client(),
+    )
+    return OpenAIBatchRunner(
+        client, poll_interval=settings.BATCH_API_POLL_INTERVAL, timeout=settings.BATCH_API_TIMEOUT_HOURS * 3600,
+        completion_window=settings.BATCH_API_COMPLETION_WINDOW, max_requests=settings.BATCH_API_MAX_REQUESTS,
+    )
+
+def batch_api_stats() -> dict:
+    """Requisições, tokens e custo estimado (com o desconto da Batch API) dos lotes do processo."""
+    with _registry_lock:
+        return dict(_batch_api_usage)
+
+def _record_batch_usage(model: str, usage: dict):
+    prompt_tokens, completion_tokens = usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+    try:
+        cost = (get_openai_token_cost_for_model(model, prompt_tokens, token_type=TokenType.PROMPT)
+                + get_openai_token_cost_for_model(model, completion_tokens, token_type=TokenType.COMPLETION))
+    except ValueError:
+        # Modelo sem preço conhecido: contabiliza só os tokens
+        cost = 0.0
+    with _registry_lock:
+        _batch_api_usage['requests'] += 1
+        _batch_api_usage['prompt_tokens'] += prompt_tokens
+        _batch_api_usage['completion_tokens'] += completion_tokens
+        _batch_api_usage['cost'] += cost * settings.BATCH_API_COST_FACTOR
+
+def _batch_request_body(chain: Runnable, params: dict) -> Optional[dict]:
+    """Corpo de /v1/chat/completions equivalente à cadeia `prompt | ChatOpenAI` (None se não for o caso)."""
+    if not isinstance(chain, RunnableSequence) or not isinstance(chain.first, BasePromptTemplate):
+        return None
+    llm = chain.last
+    if not isinstance(llm, ChatOpenAI):
+        return None
+    try:
+        messages = convert_to_openai_messages(chain.first.invoke(params).to_messages())
+    except Exception:
+        # Parâmetros inválidos: a chamada interativa reporta o erro
+        return None
+    body = {'model': llm.model_name, 'messages': messages, 'temperature': llm.temperature}
+    if llm.top_p is not None:
+        body['top_p'] = llm.top_p
+    return body
+
+def batch_api_invoke_llm_with_tracking(requests: List[Tuple[Runnable, dict, str]], use_cache: bool = True) -> List[str]:
+    """
+    Envia as requisições (cadeia, parâmetros, nome da tarefa) como um único lote
+    da Batch API e devolve os textos na ordem recebida. Respostas em cache não
+    entram no lote; requisições com erro devolvem "". Se o lote não for concluído,
+    ou a cadeia não puder ser traduzida para a API, a chamada é feita de forma interativa.
+    """
+    if not requests:
+        return []
+    prepared = [_prepare_request(chain, params, task_name, use_cache, None) for chain, params, task_name in requests]
+    contents = [_cached_response(request.cache_key) for request in prepared]
+    bodies = {}
+    for i, (chain, params, task_name) in enumerate(requests):
+        if contents[i] is not None:
+            continue
+        body = _batch_request_body(chain, params)
+        if body is None:
+            contents[i] = invoke_llm_with_tracking(chain, params, task_name, use_cache)
+        else:
+            bodies[str(i)] = body
+    if not bodies:
+        return contents
+
+    try:
+        results = get_batch_runner().run(bodies)
+    except (BatchJobError, openai.OpenAIError) as e:
+        logger.warning(f"O lote da Batch API não foi concluído ({e}); as requisições serão feitas de forma interativa.")
+        results = {}
+
+    for custom_id, body in bodies.items():
+        i = int(custom_id)
+        chain, params, task_name = requests[i]
+        result = results.get(custom_id)
+        if result is None:
+            contents[i] = invoke_llm_with_tracking(chain, params, task_name, use_cache)
+        elif 'error' in result:
+            logger.error(f"  - Erro durante a execução da tarefa '{task_name}' no lote: {result['error']}")
+            contents[i] = ""
+        else:
+            usage = result.get('usage') or {}
+            _record_batch_usage(body['model'], usage)
+            contents[i] = result['choices'][0]['message']['content'] or ""
+            _store_content(prepared[i].cache_key, contents[i], usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+    return contents
@@ -0,0 +1,225 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from src.utils.logger import logger
+from src.utils.rate_limiting import RETRYABLE_ERRORS, RateLimiter, backoff_delay, retry_after
+
+# Intervalo com que as corrotinas em espera verificam se já podem ser admitidas
+ASYNC_POLL_INTERVAL = 0.05
+
+class LLMScheduler:
+    """
+    Ponto único por onde passam as chamadas ao LLM. Cada modelo tem seus limites
+    de requisições e tokens por minuto (baldes de fichas). Quando não há fichas, as
+    chamadas esperam numa fila de prioridade (menor valor = antes, empate pela
+    ordem de chegada), para que tarefas curtas do caminho crítico não fiquem atrás
+    de longas gerações de seções. Erros transitórios (429, timeouts, 5xx) são
+    repetidos com backoff exponencial e jitter, e cada modelo acumula métricas de vazão.
+    """
+
+    def __init__(self, rate_limits: Dict[str, Tuple[float, float]], default_limits: Tuple[float, float],
+                 max_retries: int, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.rate_limits = rate_limits
+        self.default_limits = default_limits
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._waiting: Dict[str, list] = {}
+        self._metrics: Dict[str, dict] = {}
+        self._task_metrics: Dict[str, dict] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _limiter(self, model: str) -> RateLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limiter = self._limiters[model] = RateLimiter(*self.rate_limits.get(model, self.default_limits))
+            self._waiting[model] = []
+            self._metrics[model] = {
+                'requests': 0, 'retries': 0, 'failures': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                'queue_seconds': 0.0, 'latency_seconds': 0.0, 'first_request_at': None, 'last_response_at': None,
+            }
+        return limiter
+
+    def _admission_wait(self, model: str, ticket: tuple, tokens: int) -> Optional[float]:
+        """
+        Admite a chamada se ela estiver à frente da fila e houver fichas (devolve 0).
+        Senão, devolve a espera até as fichas chegarem ou None se ela não for a próxima.
+        Deve ser chamada com `_condition` adquirida.
+        """
+        queue = self._waiting[model]
+        if queue[0] != ticket:
+            return None
+        limiter = self._limiters[model]
+        wait = limiter.wait_time(tokens)
+        if wait > 0:
+            return wait
+        limiter.consume(tokens)
+        heapq.heappop(queue)
+        self._condition.notify_all()
+        return 0.0
+
+    def _enqueue(self, model: str, priority: int) -> tuple:
+        with self._condition:
+            self._limiter(model)
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting[model], ticket)
+            return ticket
+
+    def _withdraw(self, model: str, ticket: tuple):
+        """Remove da fila uma chamada abandonada (ex.: interrompida) antes de ser admitida."""
+        with self._condition:
+            queue = self._waiting[model]
+            if ticket in queue:
+                queue.remove(ticket)
+                heapq.heapify(queue)
+                self._condition.notify_all()
+
+    def acquire(self, model: str, priority: int, tokens: int):
+        """Bloqueia a thread até a chamada ser admitida pelos limites do modelo."""
+        ticket = self._enqueue(model, priority)
+        start = time.monotonic()
+        try:
+            with self._condition:
+                while (wait := self._admission_wait(model, ticket, tokens)) != 0:
+                    self._condition.wait(timeout=wait)
+        except BaseException:
+            self._withdraw(model, ticket)
+            raise
+        self._record_admission(model, time.monotonic() - start)
+
+    async def aacquire(self, model: str, priority: int, tokens: int):
+        """Versão assíncrona de `acquire`, que espera sem bloquear o laço de eventos."""
+        ticket = self._enqueue(model, priority)
+        start = time.monotonic()
+        try:
+            while True:
+                with self._condition:
+                    wait = self._admission_wait(model, ticket, tokens)
+                if wait == 0:
+                    break
+                await asyncio.sleep(min(wait, ASYNC_POLL_INTERVAL) if wait is not None else ASYNC_POLL_INTERVAL)
+        except BaseException:
+            self._withdraw(model, ticket)
+            raise
+        self._record_admission(model, time.monotonic() - start)
+
+    def _record_admission(self, model: str, queue_seconds: float):
+        with self._condition:
+            metrics = self._metrics[model]
+            metrics['queue_seconds'] += queue_seconds
+            if metrics['first_request_at'] is None:
+                metrics['first_request_at'] = time.monotonic()
+
+    def _record_response(self, model: str, task_name: str, response: Any, estimated_tokens: int, latency: float):
+        usage = getattr(response, 'usage_metadata', None) or {}
+        prompt_tokens, completion_tokens = usage.get('input_tokens', 0), usage.get('output_tokens', 0)
+        with self._condition:
+            task = self._task_metrics.setdefault(
+                task_category(task_name), {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'latency_seconds': 0.0}
+            )
+            task['requests'] += 1
+            task['prompt_tokens'] += prompt_tokens
+            task['completion_tokens'] += completion_tokens
+            task['latency_seconds'] += latency
+            metrics = self._metrics[model]
+            metrics['requests'] += 1
+            metrics['prompt_tokens'] += prompt_tokens
+            metrics['completion_tokens'] += completion_tokens
+            metrics['latency_seconds'] += latency
+            metrics['last_response_at'] = time.monotonic()
+            if usage:
+                # Corrige o balde de tokens com o consumo real (a estimativa inclui a resposta esperada)
+                bucket = self._limiters[model].tokens
+                bucket.tokens = min(bucket.capacity, bucket.tokens + estimated_tokens - prompt_tokens - completion_tokens)
+
+    def _retry_delay(self, model: str, task_name: str, attempt: int, error: BaseException) -> float:
+        with self._condition:
+            self._metrics[model]['retries'] += 1
+        delay = max(backoff_delay(attempt, self.base_delay, self.max_delay), retry_after(error))
+        logger.warning(
+            f"  - Erro transitório em '{task_name}' ({type(error).__name__}); "
+            f"nova tentativa {attempt + 1}/{self.max_retries} em {delay:.1f}s."
+        )
+        return delay
+
+    def _give_up(self, model: str, task_name: str, error: BaseException):
+        with self._condition:
+            self._metrics[model]['failures'] += 1
+        logger.error(f"  - A tarefa '{task_name}' falhou após {self.max_retries} novas tentativas: {error}")
+
+    def run(self, model: str, priority: int, tokens: int, func: Callable[[], Any], task_name: str) -> Any:
+        """Executa `func` dentro dos limites do modelo, repetindo-a em erros transitórios."""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(model, priority, tokens)
+            start = time.monotonic()
+            try:
+                response = func()
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self._give_up(model, task_name, e)
+                    raise
+                time.sleep(self._retry_delay(model, task_name, attempt, e))
+                continue
+            self._record_response(model, task_name, response, tokens, time.monotonic() - start)
+            return response
+
+    async def arun(self, model: str, priority: int, tokens: int, func: Callable[[], Awaitable[Any]], task_name: str) -> Any:
+        """Versão assíncrona de `run`; `func` devolve a corrotina da chamada."""
+        for attempt in range(self.max_retries + 1):
+            await self.aacquire(model, priority, tokens)
+            start = time.monotonic()
+            try:
+                response = await func()
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self._give_up(model, task_name, e)
+                    raise
+                await asyncio.sleep(self._retry_delay(model, task_name, attempt, e))
+                continue
+            self._record_response(model, task_name, response, tokens, time.monotonic() - start)
+            return response
+
+    def metrics(self) -> Dict[str, dict]:
+        """Métricas por modelo: chamadas, novas tentativas, falhas, tokens, esperas e vazão."""
+        report = {}
+        with self._condition:
+            for model, metrics in self._metrics.items():
+                requests = metrics['requests']
+                total_tokens = metrics['prompt_tokens'] + metrics['completion_tokens']
+                elapsed_minutes = ((metrics['last_response_at'] or 0) - (metrics['first_request_at'] or 0)) / 60
+                report[model] = {
+                    'requests': requests,
+                    'retries': metrics['retries'],
+                    'failures': metrics['failures'],
+                    'prompt_tokens': metrics['prompt_tokens'],
+                    'completion_tokens': metrics['completion_tokens'],
+                    'avg_queue_seconds': metrics['queue_seconds'] / requests if requests else 0.0,
+                    'avg_latency_seconds': metrics['latency_seconds'] / requests if requests else 0.0,
+                    'requests_per_minute': requests / elapsed_minutes if elapsed_minutes > 0 else 0.0,
+                    'tokens_per_minute': total_tokens / elapsed_minutes if elapsed_minutes > 0 else 0.0,
+                }
+        return report
+
+    def task_metrics(self) -> Dict[str, dict]:
+        """Chamadas, tokens e latência somada por tipo de tarefa (ver `task_category`)."""
+        with self._condition:
+            return {category: dict(metrics) for category, metrics in self._task_metrics.items()}
+
+def task_category(task_name: str) -> str:
+    """Tipo da tarefa: o nome sem o detalhe após ':' (ex.: "Expansão do Tópico: Mitose" → "Expansão do Tópico")."""
+    return task_name.split(":", 1)[0].strip()
+
+def log_scheduler_metrics(metrics: Dict[str, dict]):
+    """Registra a vazão por modelo junto ao resumo de custo."""
+    for model, m in metrics.items():
+        logger.info(
+            f"Modelo {model}: {m['requests']} chamadas, {m['retries']} novas tentativas, {m['failures']} falhas; "
+            f"{m['requests_per_minute']:.0f} RPM, {m['tokens_per_minute']:.0f} TPM; "
+            f"espera média na fila {m['avg_queue_seconds']:.2f}s, latência média {m['avg_latency_seconds']:.2f}s"
+        )
@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+from typing import Callable, Tuple, Type, TypeVar
+
+import openai
+
+from src.utils.logger import logger
+
+T = TypeVar("T")
+
+# Erros transitórios da API: vale a pena tentar novamente após uma espera
+RETRYABLE_ERRORS: Tuple[Type[BaseException], ...] = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa rápida de tokens (~4 caracteres por token), suficiente para limites de taxa."""
+    return len(text) // 4 + 1
+
+class TokenBucket:
+    """Balde de fichas reabastecido continuamente a `capacity` fichas por minuto."""
+
+    def __init__(self, capacity: float):
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.refill_rate = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos até haver `amount` fichas (pedidos maiores que a capacidade esperam o balde encher)."""
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.refill_rate)
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+class RateLimiter:
+    """
+    Limita requisições por minuto (RPM) e tokens por minuto (TPM) com dois
+    baldes de fichas. `acquire` bloqueia a thread até a requisição caber nos dois limites.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+
+    def wait_time(self, tokens: int) -> float:
+        """Reabastece os baldes e devolve a espera necessária (0 se já houver fichas)."""
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def consume(self, tokens: int):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    def acquire(self, tokens: int = 0):
+        while True:
+            with self._lock:
+                wait = self.wait_time(tokens)
+                if wait <= 0:
+                    self.consume(tokens)
+                    return
+            time.sleep(wait)
+
+def retry_after(error: BaseException) -> float:
+    """Espera pedida pela API no cabeçalho Retry-After do erro (0 se ausente)."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return max(0.0, float(headers.get('retry-after', 0)))
+    except (TypeError, ValueError):
+        return 0.0
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Espera exponencial com jitter completo para a tentativa `attempt` (começando em 0)."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+def call_with_retries(
+    func: Callable[[], T],
+    task_name: str,
+    max_retries: int,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    retryable: Tuple[Type[BaseException], ...] = RETRYABLE_ERRORS,
+) -> T:
+    """
+    Executa `func`, repetindo-a com backoff exponencial e jitter enquanto ela
+    falhar com um erro transitório, esperando ao menos o Retry-After pedido pela
+    API. Após `max_retries` novas tentativas, o erro é propagado.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except retryable as e:
+            if attempt == max_retries:
+                raise
+            delay = max(backoff_delay(attempt, base_delay, max_delay), retry_after(e))
+            logger.warning(
+                f"  - Erro transitório em '{task_name}' ({type(e).__name__}); "
+                f"nova tentativa {attempt + 1}/{max_retries} em {delay:.1f}s."
+            )
+            time.sleep(delay)
@@ -0,0 +1,94 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+class LLMResponseCache:
+    """
+    Cache persistente (SQLite) das respostas do LLM, com chave
+    (modelo, temperatura, top_p, hash do prompt renderizado). Entradas mais
+    antigas que `ttl_seconds` são ignoradas e removidas; acima de `max_entries`,
+    as usadas há mais tempo são descartadas. Cada entrada guarda os tokens gastos
+    na chamada original, para contabilizar o que cada acerto economizou.
+    """
+
+    def __init__(self, path: Path, ttl_seconds: Optional[float], max_entries: int):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.prompt_tokens_saved = 0
+        self.completion_tokens_saved = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Vários processos (modo em lote) podem compartilhar o mesmo arquivo
+            self._connection = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, content TEXT NOT NULL,"
+                " prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+        return self._connection
+
+    @staticmethod
+    def make_key(model: str, temperature, top_p, rendered_prompt: str) -> str:
+        prompt_hash = hashlib.sha256(rendered_prompt.encode('utf-8')).hexdigest()
+        return hashlib.sha256(f"{model}\0{temperature}\0{top_p}\0{prompt_hash}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT content, prompt_tokens, completion_tokens, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[3] > self.ttl_seconds:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                connection.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            connection.commit()
+            self.hits += 1
+            self.prompt_tokens_saved += row[1]
+            self.completion_tokens_saved += row[2]
+        return row[0]
+
+    def put(self, key: str, content: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, content, prompt_tokens, completion_tokens, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, content, prompt_tokens, completion_tokens, now, now),
+            )
+            excess = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+            if excess > 0:
+                connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+            connection.commit()
+
+    def stats(self) -> dict:
+        """Acertos, falhas e tokens economizados desde a criação do cache neste processo."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'prompt_tokens_saved': self.prompt_tokens_saved,
+            'completion_tokens_saved': self.completion_tokens_saved,
+            'tokens_saved': self.prompt_tokens_saved + self.completion_tokens_saved,
+        }
@@ -0,0 +1,45 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+# Tempo (e contadores, se houver sonda) acumulado por etapa do pipeline no processo
+_timings: Dict[str, Dict[str, float]] = {}
+_probe: Optional[Callable[[], Dict[str, float]]] = None
+_lock = threading.Lock()
+
+def set_stage_probe(probe: Optional[Callable[[], Dict[str, float]]]):
+    """
+    Registra uma função que devolve contadores cumulativos (ex.: chamadas ao LLM,
+    pico de memória); cada etapa passa a registrar também a variação deles. A
+    variação só é exata para etapas sequenciais: em etapas que rodam em paralelo
+    (ex.: a expansão das seções no modo assíncrono), cada uma conta também as demais.
+    """
+    global _probe
+    _probe = probe
+
+@contextmanager
+def timed_stage(name: str):
+    """Mede a duração de uma etapa do pipeline; etapas repetidas se somam."""
+    probe = _probe
+    before = probe() if probe else {}
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        after = probe() if probe else {}
+        with _lock:
+            timing = _timings.setdefault(name, {'seconds': 0.0})
+            timing['seconds'] += elapsed
+            for counter, value in after.items():
+                timing[counter] = timing.get(counter, 0) + value - before.get(counter, 0)
+
+def stage_timings() -> Dict[str, Dict[str, float]]:
+    """Etapas na ordem em que foram executadas pela primeira vez, com seus totais."""
+    with _lock:
+        return {name: dict(timing) for name, timing in _timings.items()}
+
+def reset_stage_timings():
+    with _lock:
+        _timings.clear()
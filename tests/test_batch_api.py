@@ -0,0 +1,183 @@
+# tests/test_batch_api.py
+import json
+import threading
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+
+import main
+from src.orchestration.checkpoint import CheckpointJournal
+from src.transformation import structure_mapper
+from src.utils import llm_handler
+
+class BatchAPIStandIn(ThreadingHTTPServer):
+    """
+    Servidor local que imita os endpoints da Batch API usados pelo pipeline
+    (upload de arquivo, criação e consulta do lote, download dos resultados).
+    `answer(body)` devolve o texto da resposta de cada requisição, ou None para um erro.
+    """
+
+    def __init__(self, answer):
+        super().__init__(("127.0.0.1", 0), BatchAPIHandler)
+        self.answer = answer
+        self.files = {}
+        self.batches = {}
+        self.submitted = []
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def run_batch(self, batch: dict):
+        output, errors = [], []
+        for line in self.files[batch['input_file_id']]['content'].decode('utf-8').splitlines():
+            request = json.loads(line)
+            self.submitted.append(request)
+            content = self.answer(request['body'])
+            if content is None:
+                errors.append({'custom_id': request['custom_id'], 'response': {'status_code': 400, 'body': {'error': {'message': "requisição inválida"}}}, 'error': None})
+            else:
+                body = {
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15},
+                }
+                output.append({'custom_id': request['custom_id'], 'response': {'status_code': 200, 'body': body}, 'error': None})
+        batch['status'] = 'completed'
+        batch['request_counts'] = {'completed': len(output), 'failed': len(errors), 'total': len(output) + len(errors)}
+        batch['output_file_id'] = self.store_file("\n".join(json.dumps(r) for r in output).encode('utf-8'))
+        batch['error_file_id'] = self.store_file("\n".join(json.dumps(r) for r in errors).encode('utf-8')) if errors else None
+
+    def store_file(self, content: bytes) -> str:
+        file_id = f"file-{len(self.files)}"
+        self.files[file_id] = {
+            'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': 0,
+            'filename': "lote.jsonl", 'purpose': 'batch', 'status': 'processed', 'content': content,
+        }
+        return file_id
+
+class BatchAPIHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, payload: dict):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path == "/v1/files":
+            message = BytesParser(policy=policy.default).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + body
+            )
+            upload = next(part for part in message.iter_parts() if part.get_param('name', header='content-disposition') == 'file')
+            file_id = self.server.store_file(upload.get_payload(decode=True))
+            self.send_json({k: v for k, v in self.server.files[file_id].items() if k != 'content'})
+        elif self.path == "/v1/batches":
+            request = json.loads(body)
+            batch_id = f"batch-{len(self.server.batches)}"
+            self.server.batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': request['endpoint'], 'input_file_id': request['input_file_id'],
+                'completion_window': request['completion_window'], 'created_at': 0, 'status': 'validating',
+            }
+            self.send_json(self.server.batches[batch_id])
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts[1] == "batches":
+            batch = self.server.batches[parts[2]]
+            # O lote fica pronto na segunda consulta, como um job que leva algum tempo
+            if batch['status'] == 'validating':
+                batch['status'] = 'in_progress'
+            else:
+                self.server.run_batch(batch)
+            self.send_json(batch)
+        elif parts[1] == "files" and parts[-1] == "content":
+            content = self.server.files[parts[2]]['content']
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self.send_error(404)
+
+@pytest.fixture
+def batch_api():
+    """Inicia servidores locais sob demanda e aponta o modo "batch_api" do pipeline para eles."""
+    servers = []
+
+    def start(answer):
+        server = BatchAPIStandIn(answer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        llm_handler.settings.BATCH_API_BASE_URL = server.base_url
+        return server
+
+    llm_handler.clear_chain_registry()
+    with patch.object(llm_handler.settings, 'OPENAI_API_KEY', "chave-de-teste"), \
+         patch.object(llm_handler.settings, 'USE_LLM_RESPONSE_CACHE', False), \
+         patch.object(llm_handler.settings, 'LLM_EXECUTION_MODE', "batch_api"), \
+         patch.object(llm_handler.settings, 'BATCH_API_POLL_INTERVAL', 0), \
+         patch.object(llm_handler.settings, 'BATCH_API_BASE_URL', None):
+        yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    llm_handler.clear_chain_registry()
+
+def test_structure_map_units_are_sent_as_one_batch(batch_api, tmp_path):
+    """Testa se as unidades do mapa da estrutura vão num único lote e se os resultados voltam a cada unidade."""
+    def answer(body):
+        prompt = body['messages'][0]['content']
+        return json.dumps({"Capítulo 1": ["## 1.1 A"]}) if "Unidade 1" in prompt else None
+
+    server = batch_api(answer)
+    markdown = "# Unidade 1\n## 1.1 A\nTexto.\n# Unidade 2\n## 2.1 B\nTexto.\n"
+
+    result = structure_mapper.generate_structure_map(markdown, tmp_path / "mapa.json")
+
+    assert len(server.batches) == 1
+    assert [request['body']['model'] for request in server.submitted] == [llm_handler.settings.LLM_MODEL_STRUCTURE] * 2
+    assert result == {"Unidade 1": {"Capítulo 1": ["## 1.1 A"]}, "Unidade 2": {}}
+
+def test_chapter_enrichment_is_mapped_back_from_batch(batch_api):
+    """
+    Testa se curiosidades, resumos e temas voltam aos capítulos e unidades certos
+    e se, com o diário de checkpoints completo, nada é reenviado.
+    """
+    def answer(body):
+        prompt = body['messages'][0]['content']
+        chapter = "Mitose" if "Mitose" in prompt else "Meiose"
+        if "editor criativo" in prompt:
+            return json.dumps({"curiosidade": f"Curiosidade sobre {chapter}."})
+        if "introdução de uma unidade" in prompt:
+            return "Tema da unidade."
+        return f"Resumo sobre {chapter}."
+
+    server = batch_api(answer)
+    processed_content = {"Unidade 1": {'chapters': {
+        "Capítulo 1": {'content': "### 1.1\nTexto sobre Mitose."},
+        "Capítulo 2": {'content': "### 1.2\nTexto sobre Meiose."},
+    }}}
+    journal = CheckpointJournal(None, "")
+
+    main.enrich_book_with_batch_api(processed_content, journal)
+
+    chapters = processed_content["Unidade 1"]['chapters']
+    assert chapters["Capítulo 1"]['curiosity'] == "Curiosidade sobre Mitose."
+    assert chapters["Capítulo 1"]['summary'] == "Resumo sobre Mitose."
+    assert chapters["Capítulo 2"]['summary'] == "Resumo sobre Meiose."
+    assert processed_content["Unidade 1"]['theme'] == "Tema da unidade."
+    assert len(server.submitted) == 5
+
+    main.enrich_book_with_batch_api(processed_content, journal)
+    assert len(server.batches) == 1
@@ -0,0 +1,223 @@
+# tests/test_native_converter.py
+import io
+import os
+import re
+from pathlib import Path
+
+import struct
+import zlib
+
+import docx
+import pytest
+from docx.shared import Inches
+
+from src.preprocessing import document_handler, native_converter
+
+# Arquivos de referência gerados pelo pandoc a partir dos mesmos documentos.
+# Para regenerá-los (com o pandoc instalado): UPDATE_GOLDEN=1 pytest tests/test_native_converter.py
+GOLDEN_DIR = Path(__file__).parent / "golden"
+
+def build_headings_book():
+    """Livro com títulos por estilo, títulos em negrito e parágrafos simples."""
+    doc = docx.Document()
+    doc.add_paragraph("Capa do livro", style="Title")
+    p = doc.add_paragraph()
+    p.add_run("UNIDADE 1 Fundamentos da Biologia").bold = True
+    doc.add_paragraph("A biologia estuda os seres vivos e suas interações com o ambiente.")
+    p = doc.add_paragraph()
+    p.add_run("1.1 O que é a vida?").bold = True
+    doc.add_paragraph("Não existe uma definição única de vida, mas há características comuns.")
+    p = doc.add_paragraph()
+    p.add_run("1.2 A célula ").bold = True
+    p.add_run("como unidade").bold = True
+    doc.add_paragraph("Todos os seres vivos são formados por células.")
+    doc.add_heading("Conceitos-chave", level=3)
+    doc.add_paragraph("Membrana, citoplasma e núcleo.")
+    p = doc.add_paragraph()
+    p.add_run("Unidade 2 Genética").bold = True
+    p = doc.add_paragraph()
+    p.add_run("2.1 Hereditariedade").bold = True
+    doc.add_paragraph("Mendel cruzou ervilhas para estudar a transmissão de características.")
+    doc.add_heading("Resumindo", level=2)
+    doc.add_paragraph("A genética explica a herança biológica.")
+    return doc
+
+def build_lists_and_tables_book():
+    """Livro com listas com marcadores, listas numeradas e tabelas simples."""
+    doc = docx.Document()
+    p = doc.add_paragraph()
+    p.add_run("UNIDADE 1 Materiais").bold = True
+    p = doc.add_paragraph()
+    p.add_run("1.1 Propriedades").bold = True
+    doc.add_paragraph("As propriedades mais importantes são:")
+    doc.add_paragraph("Resistência mecânica", style="List Bullet")
+    doc.add_paragraph("Durabilidade", style="List Bullet")
+    doc.add_paragraph("Custo de manutenção", style="List Bullet")
+    doc.add_paragraph("Para ensaiar uma amostra:")
+    doc.add_paragraph("Prepare o corpo de prova.", style="List Number")
+    doc.add_paragraph("Aplique a carga gradualmente.", style="List Number")
+    doc.add_paragraph("Registre a deformação.", style="List Number")
+    p = doc.add_paragraph()
+    p.add_run("1.2 Comparação entre aços").bold = True
+    table = doc.add_table(rows=3, cols=3)
+    rows = [
+        ["Característica", "Aço carbono", "Aço inoxidável"],
+        ["Custo", "Baixo", "Alto"],
+        ["Resistência à corrosão", "Baixa", "Alta"],
+    ]
+    for row, values in zip(table.rows, rows):
+        for cell, value in zip(row.cells, values):
+            cell.text = value
+    doc.add_paragraph("A escolha depende da aplicação.")
+    return doc
+
+def build_inline_formatting_book():
+    """Livro com negrito e itálico no meio do texto e caracteres que precisam de escape."""
+    doc = docx.Document()
+    p = doc.add_paragraph()
+    p.add_run("UNIDADE 1 Matemática financeira").bold = True
+    p = doc.add_paragraph()
+    p.add_run("1.1 Juros [simples] e *compostos*").bold = True
+    p = doc.add_paragraph("O montante ")
+    p.add_run("M").italic = True
+    p.add_run(" é calculado por ")
+    p.add_run("M = C * (1 + i)^n").bold = True
+    p.add_run(", onde o capital custa R$ 1.000 e a taxa é de 2% <ao mês>.")
+    doc.add_paragraph("1. Esta frase começa com um número, mas não é uma lista.")
+    doc.add_paragraph("# Esta frase começa com cerquilha.")
+    p = doc.add_paragraph()
+    r = p.add_run("Atenção:")
+    r.bold = True
+    r = p.add_run(" valores")
+    r.bold = True
+    r.italic = True
+    p.add_run(" arredondados.")
+    p = doc.add_paragraph("Primeira linha")
+    p.runs[0].add_break()
+    p.add_run("Segunda linha")
+    return doc
+
+def _tiny_png() -> io.BytesIO:
+    """Imagem PNG de 1x1 pixel."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    return io.BytesIO(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\x00\xff\xff\xff")) + chunk(b"IEND", b""))
+
+def build_figures_book():
+    """Livro com uma figura entre parágrafos (o conversor nativo a descartaria)."""
+    doc = docx.Document()
+    p = doc.add_paragraph()
+    p.add_run("UNIDADE 1 Citologia").bold = True
+    p = doc.add_paragraph()
+    p.add_run("1.1 A célula animal").bold = True
+    doc.add_paragraph("A figura mostra as organelas da célula animal.")
+    doc.add_picture(_tiny_png(), width=Inches(1))
+    doc.add_paragraph("O núcleo guarda o material genético.")
+    return doc
+
+GOLDEN_BOOKS = {
+    "livro_titulos": build_headings_book,
+    "livro_listas_tabelas": build_lists_and_tables_book,
+    "livro_formatacao": build_inline_formatting_book,
+}
+# Livros que o modo "auto" envia ao pandoc: a referência é a própria saída esperada
+PANDOC_ONLY_BOOKS = {
+    "livro_figuras": build_figures_book,
+}
+
+def _pandoc_markdown(doc) -> str:
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    import pypandoc
+    return pypandoc.convert_text(source=buffer.getvalue(), to='markdown', format='docx', extra_args=['--wrap=none'])
+
+def _golden_markdown(name: str) -> str:
+    golden_path = GOLDEN_DIR / f"{name}.md"
+    if os.environ.get("UPDATE_GOLDEN"):
+        golden_path.write_text(_pandoc_markdown({**GOLDEN_BOOKS, **PANDOC_ONLY_BOOKS}[name]()), encoding='utf-8')
+    return golden_path.read_text(encoding='utf-8')
+
+def _plain_words(markdown: str) -> list:
+    """Palavras do texto sem a marcação do Markdown (escapes, ênfase, tabelas e marcadores)."""
+    text = re.sub(r'\\(.)', r'\1', markdown)
+    text = re.sub(r'^\s*[-|: ]+\s*$', ' ', text, flags=re.MULTILINE)
+    text = re.sub(r'[*|#]', ' ', text)
+    return [word for word in text.split() if word not in ('-', '\\')]
+
+def _structure(markdown: str) -> list:
+    """Títulos e palavras de cada seção, como o pipeline os enxerga após o pré-processamento."""
+    corrected = document_handler.preprocess_markdown_headings(markdown)
+    tree = document_handler.build_section_tree(corrected, "livro.md")
+    return [(doc.metadata['title'], _plain_words(doc.page_content)) for doc in tree['documents']]
+
+@pytest.mark.parametrize("name", sorted(GOLDEN_BOOKS))
+def test_native_converter_matches_pandoc_golden(name):
+    """
+    Testa se o conversor nativo produz os mesmos títulos (após o pré-processamento)
+    e o mesmo texto por seção que o pandoc.
+    """
+    native_md = native_converter.docx_to_markdown(GOLDEN_BOOKS[name]())
+    golden_md = _golden_markdown(name)
+
+    native_headings = [l for l in document_handler.preprocess_markdown_headings(native_md).split('\n') if l.startswith('#')]
+    golden_headings = [l for l in document_handler.preprocess_markdown_headings(golden_md).split('\n') if l.startswith('#')]
+    assert native_headings == golden_headings
+
+    assert _structure(native_md) == _structure(golden_md)
+
+def test_find_unsupported_content_detects_merged_cells():
+    """Testa se tabelas com células mescladas são encaminhadas ao pandoc."""
+    doc = build_lists_and_tables_book()
+    assert native_converter.find_unsupported_content(doc) == []
+
+    table = doc.tables[0]
+    table.cell(0, 0).merge(table.cell(0, 1))
+    assert native_converter.find_unsupported_content(doc) == ["células mescladas"]
+
+def test_list_info_without_paragraph_style():
+    """Testa se um item de lista sem estilo resolvível não quebra a conversão (nível 0)."""
+    doc = docx.Document()
+    paragraph = doc.add_paragraph("Item sem estilo")
+    num_id = doc.styles["List Bullet"].element.pPr.numPr.numId.val
+    paragraph._p.get_or_add_pPr().get_or_add_numPr().get_or_add_numId().val = num_id
+
+    assert native_converter._list_info(doc, None, paragraph._p) == (0, False)
+
+def test_auto_mode_sends_figures_to_pandoc(tmp_path, monkeypatch):
+    """
+    Testa se, no modo "auto", um livro com figuras é convertido pelo pandoc
+    (que mantém a imagem) em vez de perdê-las no conversor nativo.
+    """
+    input_path = tmp_path / "livro.docx"
+    build_figures_book().save(input_path)
+    golden_md = _golden_markdown("livro_figuras")
+    assert native_converter.find_unsupported_content(docx.Document(input_path)) == ["figuras"]
+
+    pandoc_calls = []
+    def fake_pandoc(*args, **kwargs):
+        pandoc_calls.append(kwargs)
+        return golden_md
+    monkeypatch.setattr(document_handler.pypandoc, "convert_text", fake_pandoc)
+
+    markdown = document_handler.convert_docx_to_markdown(input_path, tmp_path / "livro.md", converter='auto')
+
+    assert len(pandoc_calls) == 1
+    assert markdown == golden_md
+    assert "![](media/image1.png)" in markdown
+    assert "media/" not in native_converter.docx_to_markdown(build_figures_book())
+
+def test_convert_docx_to_markdown_native_mode_skips_pandoc(tmp_path, monkeypatch):
+    """Testa se o modo nativo converte o documento sem chamar o pandoc."""
+    input_path = tmp_path / "livro.docx"
+    build_headings_book().save(input_path)
+    output_path = tmp_path / "livro.md"
+
+    def fail_if_called(*args, **kwargs):
+        raise AssertionError("O pandoc não deveria ser chamado no modo nativo.")
+    monkeypatch.setattr(document_handler.pypandoc, "convert_text", fail_if_called)
+
+    markdown = document_handler.convert_docx_to_markdown(input_path, output_path, converter='native')
+
+    assert markdown.startswith("**UNIDADE 1 Fundamentos da Biologia**")
+    assert output_path.read_text(encoding='utf-8') == markdown
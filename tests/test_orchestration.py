@@ -0,0 +1,352 @@
+# tests/test_orchestration.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from unittest.mock import patch
+from langchain_core.documents import Document
+import main
+from src.orchestration import batch_runner
+from src.orchestration.checkpoint import CheckpointJournal
+from src.orchestration.task_graph import TaskGraph
+
+@pytest.fixture
+def books_dir(tmp_path):
+    """Cria um diretório com livros .docx, um arquivo de lock do Word e um arquivo que não é .docx."""
+    for name in ["livro_b.docx", "livro_a.docx", "~$livro_a.docx", "notas.txt"]:
+        (tmp_path / name).write_bytes(b"")
+    return tmp_path
+
+def test_collect_input_files_expands_directories(books_dir):
+    """Testa se diretórios são expandidos, arquivos de lock ignorados e repetições removidas."""
+    files = batch_runner.collect_input_files([books_dir, books_dir / "livro_a.docx", books_dir / "inexistente.docx"])
+
+    assert [p.name for p in files] == ["livro_a.docx", "livro_b.docx"]
+
+def test_assign_book_names_disambiguates_homonyms(tmp_path):
+    """Testa se livros com o mesmo nome em diretórios diferentes recebem espaços distintos."""
+    files = [tmp_path / "a" / "Livro Final.docx", tmp_path / "b" / "Livro Final.docx", tmp_path / "outro.docx"]
+
+    names = batch_runner.assign_book_names(files)
+
+    assert names[files[2]] == "outro"
+    assert names[files[0]] != names[files[1]]
+    assert all(names[f].startswith("Livro_Final_") for f in files[:2])
+
+@patch('config.settings.get_artifact_paths')
+@patch('main.run_pipeline')
+def test_run_book_reports_status_and_isolates_errors(mock_run_pipeline, mock_get_paths, tmp_path):
+    """Testa se o relatório de um livro registra sucesso e se falhas não se propagam."""
+    mock_get_paths.return_value = {'intermediate': tmp_path, 'output': tmp_path, 'vectorstore': tmp_path}
+    mock_run_pipeline.return_value = tmp_path / "livro_reestruturado.docx"
+
+    report = batch_runner._run_book(tmp_path / "livro.docx", "livro")
+
+    mock_get_paths.assert_called_once_with("livro")
+    mock_run_pipeline.assert_called_once_with(tmp_path / "livro.docx", mock_get_paths.return_value, resume=False)
+    assert report['status'] == 'concluído'
+    assert report['output'] == str(tmp_path / "livro_reestruturado.docx")
+
+    mock_run_pipeline.side_effect = RuntimeError("falha simulada")
+    report = batch_runner._run_book(tmp_path / "livro.docx", "livro")
+
+    assert report['status'] == 'erro'
+    assert "falha simulada" in report['error']
+
+@patch('src.utils.llm_handler.batch_api_stats')
+@patch('config.settings.get_artifact_paths')
+@patch('main.run_pipeline')
+def test_run_book_reports_batch_api_usage_apart_from_total(mock_run_pipeline, mock_get_paths, mock_batch_stats, tmp_path):
+    """Testa se o uso da Batch API fica em campos próprios, fora do total do callback (como na CLI)."""
+    mock_run_pipeline.return_value = tmp_path / "livro_reestruturado.docx"
+    mock_batch_stats.side_effect = [
+        {'requests': 2, 'prompt_tokens': 100, 'completion_tokens': 50, 'cost': 0.5},
+        {'requests': 5, 'prompt_tokens': 400, 'completion_tokens': 150, 'cost': 1.25},
+    ]
+
+    report = batch_runner._run_book(tmp_path / "livro.docx", "livro")
+
+    assert (report['batch_api_requests'], report['batch_api_tokens']) == (3, 400)
+    assert report['batch_api_cost'] == pytest.approx(0.75)
+    assert (report['total_tokens'], report['total_cost']) == (0, 0.0)
+
+def test_run_batch_reports_books_whose_worker_died(tmp_path):
+    """Testa se a morte do processo de um livro vira um relatório de falha sem abortar o lote."""
+    for name in ("livro_a", "livro_b"):
+        (tmp_path / f"{name}.docx").touch()
+
+    def fake_run_book(input_path, book_name, resume, rate_limit_share):
+        if book_name == "livro_a":
+            raise BrokenProcessPool("processo encerrado abruptamente")
+        report = batch_runner._new_report(input_path, book_name)
+        report['status'] = 'concluído'
+        return report
+
+    with patch.object(batch_runner, 'ProcessPoolExecutor', lambda max_workers, mp_context: ThreadPoolExecutor(max_workers)), \
+         patch.object(batch_runner, '_run_book', side_effect=fake_run_book), \
+         patch.object(batch_runner, 'log_batch_report') as log_report:
+        reports = batch_runner.run_batch([tmp_path], max_workers=2)
+
+    assert [(r['book'], r['status']) for r in reports] == [("livro_a", "falhou"), ("livro_b", "concluído")]
+    assert "processo encerrado abruptamente" in reports[0]['error']
+    log_report.assert_called_once_with(reports)
+
+class FakeTitleIndex:
+    """Índice de títulos falso: toda seção existe e seu texto fonte é o próprio título."""
+
+    def lookup(self, title):
+        return Document(page_content=f"fonte {title}", metadata={'title': title})
+
+def test_async_section_generation_is_concurrent_and_keeps_map_order():
+    """
+    Testa se o modo assíncrono gera as seções do capítulo em paralelo, respeitando
+    o limite de concorrência, e devolve as seções na ordem do mapa da estrutura.
+    """
+    sections = [f"1.{i} Seção {i}" for i in range(6)]
+    in_flight, peak = 0, 0
+
+    async def fake_agenerate_section(sumario_completo, capitulo_atual, subtitulo_atual, texto_original_da_secao, retriever_do_capitulo):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # As primeiras seções terminam por último
+        await asyncio.sleep(0.01 * (len(sections) - int(subtitulo_atual.split()[-1])))
+        in_flight -= 1
+        return f"texto de {subtitulo_atual}"
+
+    event_loop = asyncio.new_event_loop()
+    try:
+        with patch.object(main.settings, 'SECTION_MAX_CONCURRENCY', 3), \
+             patch('main.content_generator.agenerate_section', side_effect=fake_agenerate_section):
+            result = main.generate_chapter_sections(
+                sections, "Capítulo 1", None, FakeTitleIndex(), "sumário",
+                target_words_per_section=0, mapa_de_conteudo_global={}, event_loop=event_loop,
+            )
+    finally:
+        event_loop.close()
+
+    assert list(result) == [f"1.{i} Seção {i}" for i in range(6)]
+    assert result["1.0 Seção 0"] == "texto de 1.0 Seção 0"
+    assert peak == 3
+
+def test_async_section_failure_cancels_the_other_sections():
+    """
+    Testa se a falha de uma seção no modo assíncrono cancela e aguarda as demais,
+    em vez de deixá-las pendentes quando o laço de eventos é fechado.
+    """
+    cancelled = []
+
+    async def fake_agenerate_section(sumario_completo, capitulo_atual, subtitulo_atual, texto_original_da_secao, retriever_do_capitulo):
+        if subtitulo_atual == "1.0 Falha":
+            raise RuntimeError("falha simulada")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(subtitulo_atual)
+            raise
+
+    event_loop = asyncio.new_event_loop()
+    try:
+        with patch('main.content_generator.agenerate_section', side_effect=fake_agenerate_section), \
+             pytest.raises(RuntimeError, match="falha simulada"):
+            main.generate_chapter_sections(
+                ["1.0 Falha", "1.1 Lenta", "1.2 Lenta"], "Capítulo 1", None, FakeTitleIndex(), "sumário",
+                target_words_per_section=0, mapa_de_conteudo_global={}, event_loop=event_loop,
+            )
+        assert asyncio.all_tasks(event_loop) == set()
+    finally:
+        event_loop.close()
+
+    assert sorted(cancelled) == ["1.1 Lenta", "1.2 Lenta"]
+
+def test_task_graph_respects_dependencies_and_priorities():
+    """
+    Testa se o grafo passa os resultados das dependências, escolhe entre as
+    tarefas prontas pela prioridade e rejeita ciclos.
+    """
+    executed = []
+
+    def task(name, value):
+        def run(*inputs):
+            executed.append(name)
+            return value + sum(inputs)
+        return run
+
+    graph = TaskGraph()
+    graph.add("a", task("a", 1), priority=1)
+    graph.add("b", task("b", 10), priority=0)
+    graph.add("c", task("c", 100), ["a", "b"], priority=0)
+    graph.add("d", task("d", 1000), priority=2)
+
+    results = graph.run(max_workers=1)
+
+    assert executed == ["b", "a", "c", "d"]
+    assert results["c"] == 111
+
+    cyclic = TaskGraph()
+    cyclic.add("x", task("x", 0), ["y"])
+    cyclic.add("y", task("y", 0), ["x"])
+    with pytest.raises(ValueError):
+        cyclic.run(max_workers=2)
+
+def test_dag_scheduler_keeps_content_map_order_in_strict_mode():
+    """
+    Testa se, no modo estrito, as seções de um capítulo veem no mapa global os
+    capítulos anteriores, e se o conteúdo final segue a ordem do mapa da estrutura.
+    """
+    structure_map = {
+        "Unidade 1": {"Capítulo 1": ["1.1 A"], "Capítulo 2": ["1.2 B"]},
+        "Unidade 2": {"Capítulo 3": ["2.1 C"]},
+    }
+    maps_seen = {}
+
+    def fake_process_section(section_title, chapter_title, chapter_retriever, title_index,
+                             full_book_summary, target_words_per_section, mapa_de_conteudo_global):
+        maps_seen[chapter_title] = sorted(mapa_de_conteudo_global)
+        return section_title, f"texto {section_title}"
+
+    with patch.object(main.settings, 'DAG_MAX_WORKERS', 4), \
+         patch('main.process_section', side_effect=fake_process_section), \
+         patch('main.retriever_builder.build_retriever'), \
+         patch('main.content_generator.generate_curiosities', return_value={"curiosidade": None}), \
+         patch('main.summary_generator.generate_chapter_summary', return_value="resumo"), \
+         patch('main.summary_generator.summarize_text', side_effect=lambda text: text[:10]), \
+         patch('main.summary_generator.generate_unit_theme', return_value="tema"):
+        content = main.generate_book_content_dag(structure_map, FakeTitleIndex(), None, "sumário")
+
+    assert maps_seen == {"Capítulo 1": [], "Capítulo 2": ["Capítulo 1"], "Capítulo 3": ["Capítulo 1", "Capítulo 2"]}
+    assert list(content) == ["Unidade 1", "Unidade 2"]
+    assert list(content["Unidade 1"]["chapters"]) == ["Capítulo 1", "Capítulo 2"]
+    assert content["Unidade 1"]["chapters"]["Capítulo 2"] == {'content': "### 1.2 B\ntexto 1.2 B", 'summary': "resumo"}
+    assert content["Unidade 2"]["theme"] == "tema"
+
+def test_fused_enrichment_feeds_chapter_and_content_map():
+    """Testa se, no modo "fused", uma única tarefa por capítulo preenche curiosidade, resumo e mapa global."""
+    structure_map = {"Unidade 1": {"Capítulo 1": ["1.1 A"], "Capítulo 2": ["1.2 B"]}}
+    maps_seen = {}
+
+    def fake_process_section(section_title, chapter_title, chapter_retriever, title_index,
+                             full_book_summary, target_words_per_section, mapa_de_conteudo_global):
+        maps_seen[chapter_title] = dict(mapa_de_conteudo_global)
+        return section_title, f"texto {section_title}"
+
+    def fake_enrichment(full_chapter_text, chapter_retriever):
+        return {"curiosidade": "Fato.", "resumo": "resumo", "resumo_mapa": full_chapter_text[:7]}
+
+    for scheduler in ("loop", "dag"):
+        maps_seen.clear()
+        with patch.object(main.settings, 'ENRICHMENT_MODE', "fused"), \
+             patch.object(main.settings, 'BOOK_SCHEDULER', scheduler), \
+             patch('main.process_section', side_effect=fake_process_section), \
+             patch('main.retriever_builder.build_retriever'), \
+             patch('main.summary_generator.generate_chapter_enrichment', side_effect=fake_enrichment) as enrichment, \
+             patch('main.summary_generator.summarize_text') as summarize, \
+             patch('main.summary_generator.generate_unit_theme', return_value="tema"):
+            content = main.generate_book_content(structure_map, FakeTitleIndex(), None, "sumário")
+
+        assert enrichment.call_count == 2
+        summarize.assert_not_called()
+        assert maps_seen["Capítulo 2"] == {"Capítulo 1": "### 1.1"}
+        assert content["Unidade 1"]["chapters"]["Capítulo 1"] == {
+            'content': "### 1.1 A\ntexto 1.1 A", 'curiosity': "Fato.", 'summary': "resumo"
+        }
+        assert content["Unidade 1"]["theme"] == "tema"
+
+def test_single_shot_expansion_replaces_iterative_loop():
+    """Testa se o modo "single_shot" faz uma única expansão e só quando o rascunho está abaixo da meta."""
+    with patch.object(main.settings, 'EXPANSION_MODE', "single_shot"), \
+         patch('main.content_generator.expand_section', return_value="texto expandido") as expand, \
+         patch('main.content_generator.identify_expansion_topics') as identify:
+        assert main.expand_section_text("1.1 A", "rascunho curto", 100, {}) == "texto expandido"
+        assert main.expand_section_text("1.1 A", "rascunho " * 100, 100, {}) == "rascunho " * 100
+
+    expand.assert_called_once_with("rascunho curto", 100, {})
+    identify.assert_not_called()
+
+def test_failed_expansion_paragraphs_are_left_out_of_integration():
+    """
+    Testa se os parágrafos de expansão que falharam (vazios) não são enviados à
+    integração e se, sem nenhum parágrafo válido, o texto da seção é mantido.
+    """
+    with patch.object(main.settings, 'EXPANSION_MODE', "iterative"), \
+         patch.object(main.settings, 'MAX_EXPANSION_ITERATIONS', 1), \
+         patch('main.content_generator.identify_expansion_topics', return_value=["Mitose", "Meiose"]), \
+         patch('main.content_generator.generate_expansion_paragraphs') as paragraphs, \
+         patch('main.content_generator.integrate_expansions', return_value="texto integrado") as integrate:
+        paragraphs.return_value = {"Mitose": "", "Meiose": "Parágrafo sobre Meiose."}
+        assert main.expand_section_text("1.1 A", "rascunho curto", 100, {}) == "texto integrado"
+        integrate.assert_called_once_with("rascunho curto", {"Meiose": "Parágrafo sobre Meiose."})
+
+        integrate.reset_mock()
+        paragraphs.return_value = {"Mitose": "", "Meiose": "  "}
+        assert main.expand_section_text("1.1 A", "rascunho curto", 100, {}) == "rascunho curto"
+        integrate.assert_not_called()
+
+def test_checkpoint_journal_skips_partial_results():
+    """
+    Testa se resultados com alguma parte vazia (ex.: enriquecimento combinado cujo
+    resumo falhou) não ficam no diário e são gerados de novo.
+    """
+    journal = CheckpointJournal(None, "livro")
+    partial = {"curiosidade": "Fato curioso.", "resumo": "", "resumo_mapa": "Resumo curto."}
+    complete = {"curiosidade": "Fato curioso.", "resumo": "Resumo.", "resumo_mapa": "Resumo curto."}
+
+    assert journal.step("enriquecimento:U/C", lambda text: partial, "texto") == partial
+    assert journal.step("enriquecimento:U/C", lambda text: complete, "texto") == complete
+    assert journal.step("enriquecimento:U/C", lambda text: partial, "texto") == complete
+    assert journal.step("seção:U/C:0", lambda title: (title, ""), "1.1 A") == ("1.1 A", "")
+    assert "seção:U/C:0" not in journal.results
+
+def test_resume_continues_from_checkpoint_journal(tmp_path):
+    """
+    Testa se, após uma interrupção, a retomada reconstrói o conteúdo e o mapa
+    global a partir do diário e gera apenas as tarefas que faltavam, inclusive a
+    seção que falhou (texto vazio) e o que dependia dela.
+    """
+    structure_map = {
+        "Unidade 1": {"Capítulo 1": ["1.1 A"], "Capítulo 2": ["1.2 B"]},
+        "Unidade 2": {"Capítulo 3": ["2.1 C"]},
+    }
+    journal_path = tmp_path / "checkpoint.jsonl"
+    processed, maps_seen = [], {}
+
+    def fake_process_section(section_title, chapter_title, chapter_retriever, title_index,
+                             full_book_summary, target_words_per_section, mapa_de_conteudo_global):
+        if section_title == "2.1 C" and not processed.count("2.1 C interrompida"):
+            processed.append("2.1 C interrompida")
+            raise KeyboardInterrupt
+        if section_title == "1.2 B" and not processed.count("1.2 B vazia"):
+            processed.append("1.2 B vazia")
+            return section_title, ""
+        processed.append(section_title)
+        maps_seen[chapter_title] = sorted(mapa_de_conteudo_global)
+        return section_title, f"texto {section_title}"
+
+    def generate(resume):
+        journal = CheckpointJournal(journal_path, "livro", resume=resume)
+        return main.generate_book_content(structure_map, FakeTitleIndex(), None, "sumário", journal)
+
+    with patch('main.process_section', side_effect=fake_process_section), \
+         patch('main.retriever_builder.build_retriever'), \
+         patch('main.content_generator.generate_curiosities', return_value={"curiosidade": None}), \
+         patch('main.summary_generator.generate_chapter_summary', return_value="resumo"), \
+         patch('main.summary_generator.summarize_text', side_effect=lambda text: text[:10]) as summarize, \
+         patch('main.summary_generator.generate_unit_theme', return_value="tema") as unit_theme:
+        with pytest.raises(KeyboardInterrupt):
+            generate(resume=False)
+        # Simula uma gravação interrompida no meio da linha
+        with open(journal_path, 'a', encoding='utf-8') as f:
+            f.write('{"task": "seção:Unidade 2/Capí')
+        summarize.reset_mock()
+        unit_theme.reset_mock()
+
+        content = generate(resume=True)
+
+    assert processed == ["1.1 A", "1.2 B vazia", "2.1 C interrompida", "1.2 B", "2.1 C"]
+    assert maps_seen["Capítulo 3"] == ["Capítulo 1", "Capítulo 2"]
+    # Mapa do capítulo 2 e tema da unidade 1 são refeitos com a seção regenerada
+    assert summarize.call_count == 2
+    assert unit_theme.call_count == 2
+    assert content["Unidade 1"]["chapters"]["Capítulo 2"] == {'content': "### 1.2 B\ntexto 1.2 B", 'summary': "resumo"}
+    assert content["Unidade 1"]["theme"] == "tema"
+    assert content["Unidade 2"]["chapters"]["Capítulo 3"]["content"] == "### 2.1 C\ntexto 2.1 C"
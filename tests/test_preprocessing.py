@@ -1,9 +1,12 @@
 # tests/test_preprocessing.py
+import io
+import docx
 import pytest
 from unittest.mock import patch, MagicMock
 from pathlib import Path
 from langchain_core.documents import Document
-from src.preprocessing import document_handler
+from src.preprocessing import conversion_cache, document_handler
+from src.preprocessing.title_index import TitleIndex
 
 @pytest.fixture
 def mock_markdown_content():
@@ -23,31 +26,63 @@ Conteúdo da seção 1.2.
 Conteúdo da seção 2.1.
 """
 
+@pytest.fixture
+def sample_docx_path(tmp_path):
+    """Cria um .docx real com conteúdo que deve ser mantido e conteúdo que deve ser limpo."""
+    doc = docx.Document()
+    doc.add_paragraph("Introdução ao tema.")
+    doc.add_paragraph("https://exemplo.com/imagem.png")
+    doc.add_paragraph("Fonte: Acervo do autor.")
+    doc.add_table(rows=1, cols=1).cell(0, 0).text = "Tabela mantida"
+    doc.add_paragraph("Exercícios resolvidos")
+    doc.add_paragraph("Exercício 1.")
+    doc.add_table(rows=1, cols=1).cell(0, 0).text = "Tabela descartada"
+    path = tmp_path / "test.docx"
+    doc.save(path)
+    return path
+
 @patch('src.preprocessing.document_handler.pypandoc')
-def test_convert_docx_to_markdown(mock_pypandoc, tmp_path):
+def test_convert_docx_to_markdown(mock_pypandoc, sample_docx_path, tmp_path):
     """
-    Testa se a função de conversão chama o pypandoc com os argumentos corretos.
+    Testa se, no modo pandoc, a função envia o documento limpo ao pandoc
+    em memória e salva o Markdown retornado.
     """
-    input_file = tmp_path / "test.docx"
+    mock_pypandoc.convert_text.return_value = "Introdução ao tema."
     output_file = tmp_path / "test.md"
     
-    document_handler.convert_docx_to_markdown(input_file, output_file)
+    result = document_handler.convert_docx_to_markdown(sample_docx_path, output_file, converter='pandoc')
     
-    mock_pypandoc.convert_file.assert_called_once_with(
-        source_file=str(input_file),
-        to='markdown',
-        outputfile=str(output_file),
-        extra_args=['--wrap=none']
-    )
+    mock_pypandoc.convert_text.assert_called_once()
+    kwargs = mock_pypandoc.convert_text.call_args.kwargs
+    assert kwargs['format'] == 'docx'
+    assert kwargs['to'] == 'markdown'
+    assert kwargs['extra_args'] == ['--wrap=none']
+
+    cleaned = docx.Document(io.BytesIO(kwargs['source']))
+    assert [p.text for p in cleaned.paragraphs] == ["Introdução ao tema."]
+    assert [t.cell(0, 0).text for t in cleaned.tables] == ["Tabela mantida"]
+
+    assert result == "Introdução ao tema."
+    assert output_file.read_text(encoding='utf-8') == "Introdução ao tema."
+    # Nenhum arquivo intermediário deve ser criado
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["test.docx", "test.md"]
+
+def test_clean_docx_body_with_custom_rules(sample_docx_path):
+    """Testa se a lista de regras de limpeza é configurável."""
+    doc = docx.Document(sample_docx_path)
+    rules = [lambda text: document_handler.REMOVE if text.startswith("Exercício") else None]
+
+    removed = document_handler.clean_docx_body(doc, rules)
 
-def test_load_and_split_by_structure(mock_markdown_content, tmp_path):
+    assert removed == 2
+    assert "Exercícios resolvidos" not in [p.text for p in doc.paragraphs]
+    assert "Fonte: Acervo do autor." in [p.text for p in doc.paragraphs]
+
+def test_load_and_split_by_structure(mock_markdown_content):
     """
     Testa se o arquivo markdown é carregado e dividido corretamente em Documentos.
     """
-    md_path = tmp_path / "test.md"
-    md_path.write_text(mock_markdown_content, encoding='utf-8')
-    
-    documents = document_handler.load_and_split_by_structure(md_path)
+    documents = document_handler.load_and_split_by_structure(mock_markdown_content, "test.md")
     
     assert len(documents) == 3
     assert isinstance(documents[0], Document)
@@ -58,4 +93,139 @@ def test_load_and_split_by_structure(mock_markdown_content, tmp_path):
 
     # Verifica o conteúdo e metadados do terceiro documento
     assert documents[2].page_content == "Conteúdo da seção 2.1."
-    assert documents[2].metadata['title'] == "# Unidade 2: Título da Unidade 2\n## Seção 2.1: Título da Seção 2.1"
\ No newline at end of file
+    assert documents[2].metadata['title'] == "# Unidade 2: Título da Unidade 2\n## Seção 2.1: Título da Seção 2.1"
+
+def test_build_section_tree_groups_sections_under_unit_with_text():
+    """
+    Testa se uma unidade com texto próprio absorve suas seções e se a árvore
+    aponta as seções para o documento agrupado.
+    """
+    content = """
+# Unidade 1
+Introdução da unidade.
+
+## 1.1 Primeira
+Conteúdo 1.1.
+### Detalhe
+Mais detalhes.
+
+## 1.2 Segunda
+Conteúdo 1.2.
+
+# Unidade 2
+
+## 2.1 Terceira
+Conteúdo 2.1.
+"""
+    tree = document_handler.build_section_tree(content, "test.md")
+    documents = tree['documents']
+
+    assert len(documents) == 2
+    assert documents[0].metadata['title'] == "# Unidade 1"
+    assert documents[0].page_content.startswith("Introdução da unidade.\n\n## 1.1 Primeira\n\nConteúdo 1.1.")
+    assert "## 1.2 Segunda\n\nConteúdo 1.2." in documents[0].page_content
+    assert documents[1].page_content == "Conteúdo 2.1."
+
+    unit_1 = tree['units']["# Unidade 1"]
+    assert unit_1['document'] == 0
+    assert list(unit_1['sections']) == ["## 1.1 Primeira", "## 1.2 Segunda"]
+    assert unit_1['sections']["## 1.1 Primeira"]['document'] == 0
+    assert unit_1['sections']["## 1.1 Primeira"]['subsections'] == ["### Detalhe"]
+
+    unit_2 = tree['units']["# Unidade 2"]
+    assert unit_2['document'] is None
+    assert unit_2['sections']["## 2.1 Terceira"]['document'] == 1
+
+@patch('src.preprocessing.conversion_cache.document_handler.convert_docx_to_markdown')
+def test_convert_with_cache_skips_conversion_on_hit(mock_convert, mock_markdown_content, sample_docx_path, tmp_path):
+    """
+    Testa se a segunda execução com o mesmo arquivo e as mesmas regras
+    reutiliza o Markdown e as seções salvas, sem converter novamente, e se
+    regrava o Markdown intermediário (ex.: diretório de artefatos limpo).
+    """
+    mock_convert.return_value = mock_markdown_content
+    cache_dir = tmp_path / "cache"
+    md_path = tmp_path / "livro.md"
+
+    first_md, first_tree = conversion_cache.convert_with_cache(sample_docx_path, md_path, cache_dir)
+    md_path.unlink(missing_ok=True)
+    second_md, second_tree = conversion_cache.convert_with_cache(sample_docx_path, md_path, cache_dir)
+
+    assert mock_convert.call_count == 1
+    assert md_path.read_text(encoding='utf-8') == mock_markdown_content
+    assert second_md == first_md
+    assert [d.page_content for d in second_tree['documents']] == [d.page_content for d in first_tree['documents']]
+    assert isinstance(second_tree['documents'][0], Document)
+    assert second_tree['units'] == first_tree['units']
+
+def test_cache_key_depends_on_rules(sample_docx_path):
+    """Testa se mudar as regras de limpeza invalida o cache."""
+    default_key = conversion_cache.compute_cache_key(sample_docx_path, document_handler.DEFAULT_CLEANING_RULES)
+    other_key = conversion_cache.compute_cache_key(sample_docx_path, [document_handler.drop_image_sources])
+
+    assert default_key != other_key
+    assert default_key == conversion_cache.compute_cache_key(sample_docx_path, document_handler.DEFAULT_CLEANING_RULES)
+
+    # Lambdas diferentes têm o mesmo nome ("<lambda>"), mas não a mesma chave
+    lambda_keys = {
+        conversion_cache.compute_cache_key(sample_docx_path, [rule]) for rule in (
+            lambda text: document_handler.REMOVE if text.startswith("Exercício") else None,
+            lambda text: document_handler.REMOVE if text.startswith("Atividade") else None,
+        )
+    }
+    assert len(lambda_keys) == 2
+
+    # Valores capturados sem representação estável (repr com endereço) não entram na chave
+    class Marker:
+        pass
+    marker = Marker()
+    with pytest.raises(ValueError):
+        conversion_cache.compute_cache_key(sample_docx_path, [lambda text: marker if text else None])
+
+def test_title_index_finds_sections_absorbed_by_their_unit():
+    """
+    Testa se o título de uma seção absorvida pelo documento da unidade (que tem
+    texto próprio) é encontrado e leva ao documento que contém seu conteúdo.
+    """
+    content = """
+# Unidade 1
+Introdução da unidade.
+
+## 1.1 Primeira
+Conteúdo 1.1.
+
+# Unidade 2
+
+## 2.1 Terceira
+Conteúdo 2.1.
+"""
+    tree = document_handler.build_section_tree(content, "test.md")
+    index = TitleIndex.from_section_tree(tree)
+
+    unit_document = index.lookup("## 1.1 Primeira")
+    assert unit_document is tree['documents'][0]
+    assert "Conteúdo 1.1." in unit_document.page_content
+    # Também por similaridade, como as demais seções
+    assert index.lookup("## 1.1 Primeiro") is unit_document
+    assert index.lookup("## 2.1 Terceira") is tree['documents'][1]
+
+def test_title_index_exact_and_fuzzy_lookup(mock_markdown_content):
+    """
+    Testa se o índice encontra títulos exatos, tolera pequenas diferenças
+    de grafia e rejeita seções com numeração diferente.
+    """
+    tree = document_handler.build_section_tree(mock_markdown_content, "test.md")
+    index = TitleIndex.from_section_tree(tree)
+
+    exact = index.lookup("## Seção 1.1: Título da Seção 1.1")
+    assert exact is tree['documents'][0]
+
+    # Acentos, caixa e pontuação são normalizados na busca exata
+    assert index.lookup("seção 1.2 titulo da SECAO 1.2") is tree['documents'][1]
+
+    # Uma pequena alteração do título pela LLM ainda encontra a seção
+    assert index.lookup("## Seção 2.1: Titulo das Seções 2.1") is tree['documents'][2]
+
+    # Números diferentes não devem ser associados por similaridade
+    assert index.lookup("## Seção 1.3: Título da Seção 1.3") is None
+    assert index.lookup("## Assunto sem relação") is None
@@ -1,19 +1,33 @@
 # tests/test_rag_system.py
+import time
+import chromadb
+import httpx
+import openai
 import pytest
 from unittest.mock import patch, MagicMock
 from langchain_core.documents import Document
-from src.rag_system import retriever_builder
+from langchain_core.vectorstores import VectorStore
+from langchain.retrievers import ParentDocumentRetriever
+from langchain.storage import InMemoryStore
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from src.rag_system import retriever_builder, vectorstore_maintenance
+from src.rag_system.concurrent_embeddings import ConcurrentEmbeddings, split_into_batches
+from src.rag_system.embedding_cache import CachedEmbeddings
+from src.rag_system.hash_embeddings import HashEmbeddings
+from src.rag_system.lexical_index import HybridVectorStore
+from src.rag_system.numpy_vectorstore import NumpyVectorStore
+from src.utils.rate_limiting import RateLimiter
 
-@patch('src.rag_system.retriever_builder.ParentDocumentRetriever')
+@patch('src.rag_system.retriever_builder.MemoizedParentDocumentRetriever')
 @patch('src.rag_system.retriever_builder.InMemoryStore')
 @patch('src.rag_system.retriever_builder.Chroma')
 @patch('src.rag_system.retriever_builder.OpenAIEmbeddings')
 @patch('src.rag_system.retriever_builder.RecursiveCharacterTextSplitter')
-def test_build_retriever(
+def test_build_book_index(
     MockSplitter, MockEmbeddings, MockChroma, MockStore, MockRetriever
 ):
     """
-    Testa se o retriever é instanciado e configurado com os componentes corretos.
+    Testa se o índice do livro é instanciado e configurado com os componentes corretos.
     """
     # Configura os mocks para retornar instâncias falsas
     mock_retriever_instance = MockRetriever.return_value
@@ -21,8 +35,9 @@ def test_build_retriever(
     # Dados de entrada
     dummy_documents = [Document(page_content="teste")]
     
-    # Chama a função
-    retriever = retriever_builder.build_retriever(dummy_documents)
+    # Chama a função (índice efêmero, com os pais em memória)
+    with patch.object(retriever_builder.settings, 'PERSIST_BOOK_INDEX', False):
+        retriever = retriever_builder.build_book_index(dummy_documents)
     
     # Verificações
     assert MockSplitter.call_count == 2  # Um para o pai, um para o filho
@@ -35,4 +50,332 @@ def test_build_retriever(
     mock_retriever_instance.add_documents.assert_called_once_with(dummy_documents, ids=None)
     
     # Verifica se a função retorna a instância mockada
-    assert retriever == mock_retriever_instance
\ No newline at end of file
+    assert retriever == mock_retriever_instance
+
+def test_build_retriever_returns_filtered_view_sharing_the_index():
+    """
+    Testa se as visões por capítulo e por unidade reutilizam o banco vetorial
+    e o armazenamento de pais do índice, apenas adicionando o filtro de busca.
+    """
+    vectorstore = MagicMock(spec=VectorStore)
+    vectorstore.similarity_search.return_value = []
+    book_index = ParentDocumentRetriever(
+        vectorstore=vectorstore,
+        docstore=InMemoryStore(),
+        child_splitter=RecursiveCharacterTextSplitter(chunk_size=400),
+    )
+
+    chapter_view = retriever_builder.build_retriever(book_index, unit="Unidade 1", chapter="Capítulo 2")
+    unit_view = retriever_builder.build_retriever(book_index, unit="Unidade 1")
+
+    assert chapter_view.vectorstore is book_index.vectorstore
+    assert chapter_view.docstore is book_index.docstore
+    assert chapter_view.search_kwargs['filter'] == {'$and': [{'unit': "Unidade 1"}, {'chapter': "Capítulo 2"}]}
+    assert unit_view.search_kwargs['filter'] == {'unit': "Unidade 1"}
+    assert 'filter' not in book_index.search_kwargs
+
+    chapter_view.invoke("consulta")
+    vectorstore.similarity_search.assert_called_once_with(
+        "consulta", filter={'$and': [{'unit': "Unidade 1"}, {'chapter': "Capítulo 2"}]}
+    )
+
+class CountingEmbeddings:
+    """Função de embedding falsa que registra os textos recebidos."""
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append([text])
+        return [float(len(text)), 1.0]
+
+def test_cached_embeddings_reuses_vectors_across_instances(tmp_path):
+    """
+    Testa se os vetores calculados são persistidos e reutilizados por outra
+    instância, enviando ao modelo apenas os textos ainda não vistos.
+    """
+    cache_path = tmp_path / "embeddings.sqlite"
+    first_model = CountingEmbeddings()
+    first = CachedEmbeddings(first_model, "modelo-teste", cache_path, max_entries=100)
+
+    vectors = first.embed_documents(["a", "bb", "a"])
+    assert vectors == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert first_model.calls == [["a", "bb"]]
+
+    second_model = CountingEmbeddings()
+    second = CachedEmbeddings(second_model, "modelo-teste", cache_path, max_entries=100)
+    assert second.embed_documents(["bb", "ccc"]) == [[2.0, 1.0], [3.0, 1.0]]
+    assert second_model.calls == [["ccc"]]
+    assert (second.hits, second.misses) == (1, 1)
+
+    # Outro modelo não reaproveita os vetores
+    other_model = CountingEmbeddings()
+    CachedEmbeddings(other_model, "outro-modelo", cache_path, max_entries=100).embed_query("a")
+    assert other_model.calls == [["a"]]
+
+def test_cached_embeddings_evicts_least_recently_used(tmp_path):
+    """Testa se o cache respeita o limite de tamanho descartando os vetores menos usados."""
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, "modelo-teste", tmp_path / "embeddings.sqlite", max_entries=2)
+
+    cache.embed_documents(["a"])
+    cache.embed_documents(["bb"])
+    cache.embed_documents(["a"])      # "a" passa a ser o mais recente
+    cache.embed_documents(["ccc"])    # excede o limite e descarta "bb"
+    model.calls.clear()
+
+    cache.embed_documents(["a", "bb", "ccc"])
+    assert model.calls == [["bb"]]
+
+class KeywordEmbeddings:
+    """Função de embedding falsa: um eixo por palavra-chave presente no texto."""
+
+    KEYWORDS = ["fotossíntese", "célula", "energia"]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(text.lower().count(keyword)) for keyword in self.KEYWORDS] + [0.1]
+
+def test_numpy_backend_indexes_book_in_memory_and_filters_views(tmp_path):
+    """
+    Testa se o backend NumPy funciona atrás do ParentDocumentRetriever,
+    devolvendo os pais mais próximos e respeitando os filtros das visões.
+    """
+    documents = [
+        Document(page_content="A fotossíntese converte luz em energia.", metadata={'unit': "U1", 'chapter': "C1"}),
+        Document(page_content="A célula é a unidade da vida.", metadata={'unit': "U1", 'chapter': "C2"}),
+        Document(page_content="Fotossíntese nas algas marinhas.", metadata={'unit': "U2", 'chapter': "C1"}),
+    ]
+    with patch.object(retriever_builder.settings, 'VECTOR_BACKEND', "numpy"), \
+         patch('src.rag_system.retriever_builder.get_embedding_function', return_value=KeywordEmbeddings()):
+        book_index = retriever_builder.build_book_index(documents, tmp_path)
+
+    assert isinstance(book_index.vectorstore, NumpyVectorStore)
+    assert len(book_index.vectorstore) == 3
+    assert not any(tmp_path.iterdir())
+
+    top = book_index.vectorstore.similarity_search("célula", k=1)
+    assert top[0].page_content == "A célula é a unidade da vida."
+
+    view = retriever_builder.build_retriever(book_index, unit="U2", chapter="C1")
+    assert [doc.page_content for doc in view.invoke("fotossíntese")] == ["Fotossíntese nas algas marinhas."]
+    assert [doc.metadata['chapter'] for doc in retriever_builder.build_retriever(book_index, unit="U1").invoke("energia")] == ["C1", "C2"]
+
+    retriever_builder.drop_book_index(book_index, tmp_path)
+
+BIOLOGY_DOCUMENTS = [
+    Document(page_content="A fotossíntese ocorre nos cloroplastos das plantas.", metadata={'unit': "U1", 'chapter': "C1"}),
+    Document(page_content="A respiração celular libera energia na mitocôndria.", metadata={'unit': "U1", 'chapter': "C2"}),
+    Document(page_content="Cloroplastos e mitocôndrias têm DNA próprio.", metadata={'unit': "U2", 'chapter': "C1"}),
+]
+
+def test_lexical_mode_needs_no_embeddings(tmp_path):
+    """
+    Testa se o modo lexical indexa e recupera os pais só com BM25,
+    sem criar a função de embedding, e se os filtros das visões são respeitados.
+    """
+    with patch.object(retriever_builder.settings, 'RETRIEVAL_MODE', "lexical"), \
+         patch('src.rag_system.retriever_builder.get_embedding_function', side_effect=AssertionError("sem rede")):
+        book_index = retriever_builder.build_book_index(BIOLOGY_DOCUMENTS, tmp_path)
+
+    results = book_index.invoke("Onde ficam os cloroplastos?")
+    assert sorted(doc.page_content for doc in results) == [
+        "A fotossíntese ocorre nos cloroplastos das plantas.", "Cloroplastos e mitocôndrias têm DNA próprio.",
+    ]
+    view = retriever_builder.build_retriever(book_index, unit="U2")
+    assert [doc.metadata['unit'] for doc in view.invoke("mitocôndria cloroplastos")] == ["U2"]
+    assert book_index.invoke("termo inexistente") == []
+    retriever_builder.drop_book_index(book_index, tmp_path)
+
+def test_hybrid_mode_fuses_lexical_and_vector_rankings():
+    """Testa se a fusão promove o documento bem colocado nos dois rankings."""
+    store = HybridVectorStore(NumpyVectorStore(KeywordEmbeddings()))
+    store.add_documents(BIOLOGY_DOCUMENTS)
+
+    # O vetor só conhece "energia"; o BM25 encontra o termo exato "mitocôndria"
+    results = store.similarity_search("energia da mitocôndria", k=2)
+    assert results[0].page_content == "A respiração celular libera energia na mitocôndria."
+    filtered = store.similarity_search("energia da mitocôndria", k=2, filter={'unit': "U2"})
+    assert [doc.metadata['unit'] for doc in filtered] == ["U2"]
+
+def test_hybrid_store_delete_removes_document_from_both_rankings():
+    """Testa se um documento removido não volta mais na busca híbrida nem na lexical."""
+    for vector_store in (NumpyVectorStore(KeywordEmbeddings()), None):
+        store = HybridVectorStore(vector_store)
+        ids = store.add_documents(BIOLOGY_DOCUMENTS)
+
+        store.delete([ids[1]])
+
+        results = store.similarity_search("energia da mitocôndria", k=3)
+        assert "A respiração celular libera energia na mitocôndria." not in [doc.page_content for doc in results]
+        # As linhas seguintes foram renumeradas: o documento após o removido continua com seus metadados
+        remaining = store.lexical_index.search("DNA próprio", k=3)
+        assert [store.lexical_index.document(row).metadata['unit'] for row, _ in remaining] == ["U2"]
+        assert len(store.lexical_index) == 2
+
+def test_retrieval_cache_skips_query_embedding_and_search(tmp_path):
+    """
+    Testa se uma consulta repetida no mesmo escopo devolve os mesmos pais sem
+    novo embedding da consulta, e se outro escopo não reaproveita a entrada.
+    """
+    model = CountingEmbeddings()
+    with patch.object(retriever_builder.settings, 'VECTOR_BACKEND', "numpy"), \
+         patch('src.rag_system.retriever_builder.get_embedding_function', return_value=model):
+        book_index = retriever_builder.build_book_index(BIOLOGY_DOCUMENTS, tmp_path)
+    chapter_view = retriever_builder.build_retriever(book_index, unit="U1", chapter="C2")
+    model.calls.clear()
+
+    first = chapter_view.invoke("texto original da seção")
+    second = retriever_builder.build_retriever(book_index, unit="U1", chapter="C2").invoke("texto original da seção")
+    assert second == first
+    assert model.calls == [["texto original da seção"]]
+
+    retriever_builder.build_retriever(book_index, unit="U2").invoke("texto original da seção")
+    assert len(model.calls) == 2
+    assert (book_index.retrieval_cache.hits, book_index.retrieval_cache.misses) == (1, 2)
+
+def test_split_into_batches_respects_token_and_item_limits():
+    """Testa se os lotes respeitam os limites e mantêm a ordem dos textos."""
+    texts = ["a" * 36, "b" * 36, "c" * 36, "d" * 400, "e"]  # 10, 10, 10, 101 e 1 tokens estimados
+    assert split_into_batches(texts, max_tokens=20, max_items=10) == [[0, 1], [2], [3], [4]]
+    assert split_into_batches(texts, max_tokens=1000, max_items=2) == [[0, 1], [2, 3], [4]]
+
+def test_concurrent_embeddings_preserves_order_and_retries_transient_errors():
+    """
+    Testa se os lotes enviados em paralelo são remontados na ordem original
+    e se um lote que falha com limite de taxa é repetido após o Retry-After pedido.
+    """
+    model = CountingEmbeddings()
+    original = model.embed_documents
+    failures = []
+
+    def flaky_embed_documents(texts):
+        if texts == ["ccc"] and not failures:
+            failures.append(texts)
+            response = httpx.Response(429, headers={'retry-after': "7"}, request=httpx.Request("POST", "https://api.openai.com/v1/embeddings"))
+            raise openai.RateLimitError("limite", response=response, body=None)
+        return original(texts)
+
+    model.embed_documents = flaky_embed_documents
+    embeddings = ConcurrentEmbeddings(
+        model, max_batch_tokens=1, max_batch_items=10, max_concurrency=3,
+        rate_limiter=RateLimiter(requests_per_minute=1000, tokens_per_minute=100_000), max_retries=2,
+    )
+    with patch('src.utils.rate_limiting.time.sleep') as sleep:
+        vectors = embeddings.embed_documents(["a", "bb", "ccc", "dddd"])
+
+    assert vectors == [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0], [4.0, 1.0]]
+    assert failures == [["ccc"]]
+    assert sorted(model.calls) == [["a"], ["bb"], ["ccc"], ["dddd"]]
+    sleep.assert_called_once_with(7.0)
+
+@patch('src.rag_system.retriever_builder.OpenAIEmbeddings')
+def test_openai_embeddings_leave_retries_to_the_wrapper(MockOpenAIEmbeddings):
+    """Testa se o cliente da OpenAI não repete as requisições por conta própria (o ConcurrentEmbeddings já repete)."""
+    with patch.object(retriever_builder.settings, 'EMBEDDING_PROVIDER', "openai"), \
+         patch.object(retriever_builder.settings, 'USE_EMBEDDING_CACHE', False):
+        embeddings = retriever_builder.get_embedding_function()
+
+    assert embeddings.underlying is MockOpenAIEmbeddings.return_value
+    assert MockOpenAIEmbeddings.call_args.kwargs['max_retries'] == 0
+
+def test_rate_limiter_waits_when_the_bucket_is_empty():
+    """Testa se o limitador bloqueia quando os tokens por minuto se esgotam."""
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60)
+    limiter.acquire(60)
+    assert limiter.wait_time(30) == pytest.approx(30, abs=0.1)
+    assert limiter.wait_time(0) == 0
+
+def test_compact_vectorstore_removes_stale_runs_and_orphan_segments(tmp_path):
+    """
+    Testa se a manutenção remove coleções efêmeras antigas e a coleção legada,
+    preserva a coleção da execução atual e apaga os segmentos órfãos do disco.
+    """
+    client = chromadb.PersistentClient(path=str(tmp_path))
+    collections = {
+        "run_antiga_livro": {'created_at': time.time() - 48 * 3600, 'ephemeral': True},
+        "run_atual_livro": {'created_at': time.time(), 'ephemeral': True},
+        "split_parents": None,
+    }
+    for name, metadata in collections.items():
+        collection = client.get_or_create_collection(name, metadata=metadata)
+        collection.add(ids=["1"], embeddings=[[0.1, 0.2]], documents=["chunk"])
+
+    report = vectorstore_maintenance.report_vectorstore(tmp_path)
+    assert sorted(c['name'] for c in report['collections']) == sorted(collections)
+
+    result = vectorstore_maintenance.compact_vectorstore(tmp_path, max_age_hours=24)
+
+    assert sorted(result['deleted_collections']) == ["run_antiga_livro", "split_parents"]
+    assert [c['name'] for c in vectorstore_maintenance.list_collections(tmp_path)] == ["run_atual_livro"]
+    assert vectorstore_maintenance.find_orphan_segments(tmp_path) == []
+
+def test_persistent_book_index_is_reused_without_re_embedding(tmp_path):
+    """
+    Testa se o índice persistido (pais em SQLite + filhos no Chroma) é reaproveitado
+    por uma nova execução sobre o mesmo conteúdo, sem gerar embeddings de novo,
+    e se a manutenção o remove junto com o armazenamento de pais quando fica sem uso.
+    """
+    first_model = CountingEmbeddings()
+    with patch.object(retriever_builder.settings, 'RETRIEVAL_CACHE_PATH', tmp_path / "retrievals.sqlite"), \
+         patch('src.rag_system.retriever_builder.get_embedding_function', return_value=first_model):
+        first_index = retriever_builder.build_book_index(BIOLOGY_DOCUMENTS, tmp_path)
+        retriever_builder.drop_book_index(first_index, tmp_path)
+    assert first_model.calls
+
+    second_model = CountingEmbeddings()
+    with patch.object(retriever_builder.settings, 'RETRIEVAL_CACHE_PATH', tmp_path / "retrievals.sqlite"), \
+         patch('src.rag_system.retriever_builder.get_embedding_function', return_value=second_model):
+        second_index = retriever_builder.build_book_index(BIOLOGY_DOCUMENTS, tmp_path)
+    assert second_model.calls == []
+    assert second_index.vectorstore._collection.name == first_index.vectorstore._collection.name
+
+    view = retriever_builder.build_retriever(second_index, unit="U2")
+    assert [doc.page_content for doc in view.invoke("cloroplastos")] == ["Cloroplastos e mitocôndrias têm DNA próprio."]
+    retriever_builder.drop_book_index(second_index, tmp_path)
+
+    docstores = list(tmp_path.glob("*.parents.sqlite"))
+    assert len(docstores) == 1
+    result = vectorstore_maintenance.compact_vectorstore(tmp_path, persistent_max_age_days=0)
+    assert result['deleted_collections'] == [second_index.vectorstore._collection.name]
+    assert result['removed_docstores'] == docstores
+    assert not docstores[0].exists()
+
+def test_new_persistent_index_replaces_the_superseded_one(tmp_path):
+    """
+    Testa se indexar um conteúdo diferente do mesmo livro remove o índice persistido
+    anterior (coleção e armazenamento de pais), em vez de acumular um por conteúdo.
+    """
+    changed_documents = BIOLOGY_DOCUMENTS + [
+        Document(page_content="Ribossomos sintetizam proteínas.", metadata={'unit': "U3", 'chapter': "C3"}),
+    ]
+    with patch.object(retriever_builder.settings, 'RETRIEVAL_CACHE_PATH', tmp_path / "retrievals.sqlite"), \
+         patch('src.rag_system.retriever_builder.get_embedding_function', return_value=CountingEmbeddings()):
+        first_index = retriever_builder.build_book_index(BIOLOGY_DOCUMENTS, tmp_path)
+        retriever_builder.drop_book_index(first_index, tmp_path)
+        second_index = retriever_builder.build_book_index(changed_documents, tmp_path)
+        retriever_builder.drop_book_index(second_index, tmp_path)
+
+    second_name = second_index.vectorstore._collection.name
+    assert second_name != first_index.vectorstore._collection.name
+    assert [c['name'] for c in vectorstore_maintenance.list_collections(tmp_path)] == [second_name]
+    assert [p.name for p in tmp_path.glob("*.parents.sqlite")] == [f"{second_name}.parents.sqlite"]
+
+
+def test_fake_embedding_provider_ranks_by_shared_words():
+    """Testa se, com o provedor falso, os embeddings por hash recuperam o documento com mais palavras em comum."""
+    with patch.object(retriever_builder.settings, 'EMBEDDING_PROVIDER', "fake"):
+        embeddings = retriever_builder.get_embedding_function()
+    assert isinstance(embeddings, HashEmbeddings)
+    assert embeddings.embed_query("mitocôndria") == embeddings.embed_documents(["mitocôndria"])[0]
+
+    store = NumpyVectorStore(embeddings)
+    store.add_documents(BIOLOGY_DOCUMENTS)
+    results = store.similarity_search("respiração celular libera energia", k=1)
+    assert results[0].page_content == "A respiração celular libera energia na mitocôndria."
@@ -1,11 +1,45 @@
 # tests/test_transformation.py
 import pytest
+import asyncio
 import json
+import threading
+import time
+import httpx
+import openai
 from unittest.mock import patch, MagicMock
 from langchain_core.documents import Document
 from langchain_core.messages import AIMessage
 
 from src.transformation import content_generator, structure_mapper, summary_generator
+from src.utils import llm_handler
+from src.utils.llm_scheduler import LLMScheduler
+from src.utils.response_cache import LLMResponseCache
+
+@pytest.fixture(autouse=True)
+def empty_chain_registry():
+    """Garante que cada teste monte suas cadeias com o ChatOpenAI simulado."""
+    llm_handler.clear_chain_registry()
+    yield
+    llm_handler.clear_chain_registry()
+
+@pytest.fixture(autouse=True)
+def no_response_cache():
+    """Impede que as respostas simuladas sejam gravadas no cache real de respostas."""
+    llm_handler.reset_response_cache()
+    with patch('config.settings.USE_LLM_RESPONSE_CACHE', False):
+        yield
+    llm_handler.reset_response_cache()
+
+@pytest.fixture(autouse=True)
+def fresh_scheduler():
+    """Cada teste começa com um agendador sem filas nem métricas."""
+    llm_handler.reset_scheduler()
+    yield
+    llm_handler.reset_scheduler()
+
+def rate_limit_error() -> openai.RateLimitError:
+    response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    return openai.RateLimitError("limite de taxa", response=response, body=None)
 
 def setup_llm_mock(MockChatOpenAI, response_content: str):
     """
@@ -23,7 +57,7 @@ def setup_llm_mock(MockChatOpenAI, response_content: str):
     mock_llm_instance.return_value = AIMessage(content=response_content)
 
 
-@patch('src.transformation.structure_mapper.ChatOpenAI')
+@patch('src.utils.llm_handler.ChatOpenAI')
 def test_generate_structure_map(MockChatOpenAI, tmp_path):
     """Testa a geração do mapa de estrutura, mockando a resposta do LLM."""
     # O conteúdo que o LLM "retornaria", incluindo os marcadores que o código irá limpar
@@ -66,7 +100,7 @@ def test_rewrite_chunk(MockChatOpenAI):
     assert result == "Texto formal reescrito."
 
 
-@patch('src.transformation.summary_generator.ChatOpenAI')
+@patch('src.utils.llm_handler.ChatOpenAI')
 def test_generate_chapter_summary(MockChatOpenAI):
     """Testa a geração de resumo de capítulo."""
     setup_llm_mock(MockChatOpenAI, "Este é o resumo do capítulo.")
@@ -75,4 +109,212 @@ def test_generate_chapter_summary(MockChatOpenAI):
     
     result = summary_generator.generate_chapter_summary("Conteúdo completo do capítulo.", mock_retriever)
     
-    assert result == "Este é o resumo do capítulo."
\ No newline at end of file
+    assert result == "Este é o resumo do capítulo."
+
+
+@patch('src.utils.llm_handler.ChatOpenAI')
+def test_chain_registry_reuses_chains_and_http_client(MockChatOpenAI):
+    """
+    Testa se cada combinação (modelo, temperatura, top_p, prompt) gera uma única
+    cadeia e se todos os modelos compartilham o mesmo cliente HTTP. O cliente
+    assíncrono só é criado no modo de seções assíncrono.
+    """
+    first = llm_handler.get_chain("Resuma: {texto}", temperature=0.2)
+    assert llm_handler.get_chain("Resuma: {texto}", temperature=0.2) is first
+    assert llm_handler.get_chain("Resuma: {texto}", temperature=0.7) is not first
+    llm_handler.get_chain("Traduza: {texto}", temperature=0.2)
+
+    # O mesmo modelo de chat serve aos dois prompts com temperatura 0.2
+    assert MockChatOpenAI.call_count == 2
+    http_clients = {id(call.kwargs['http_client']) for call in MockChatOpenAI.call_args_list}
+    assert http_clients == {id(llm_handler.get_http_client())}
+    assert all(call.kwargs['http_async_client'] is None for call in MockChatOpenAI.call_args_list)
+
+    llm_handler.clear_chain_registry()
+    with patch('config.settings.SECTION_EXECUTION_MODE', "async"):
+        llm_handler.get_chain("Resuma: {texto}", temperature=0.2)
+    assert MockChatOpenAI.call_args.kwargs['http_async_client'] is llm_handler.get_async_http_client()
+    asyncio.run(llm_handler.aclose_async_http_client())
+
+
+
+@patch('src.utils.llm_handler.ChatOpenAI')
+def test_expansion_paragraphs_run_as_isolated_batch(MockChatOpenAI):
+    """
+    Testa se os parágrafos dos tópicos são gerados em lote, na ordem dos tópicos,
+    e se a falha de um tópico não derruba os demais.
+    """
+    def fake_llm(prompt_value):
+        text = prompt_value.to_string()
+        if "Tópico instável" in text:
+            raise RuntimeError("falha simulada")
+        topic = next(t for t in ["Mitose", "Meiose"] if t in text)
+        return AIMessage(content=f"Parágrafo sobre {topic}.")
+
+    MockChatOpenAI.return_value.side_effect = fake_llm
+
+    paragraphs = content_generator.generate_expansion_paragraphs(
+        ["Meiose", "Tópico instável", "Mitose"], "Texto base.", {"Capítulo 1": "Resumo."}
+    )
+
+    assert list(paragraphs) == ["Meiose", "Tópico instável", "Mitose"]
+    assert paragraphs["Meiose"] == "Parágrafo sobre Meiose."
+    assert paragraphs["Tópico instável"] == ""
+    assert paragraphs["Mitose"] == "Parágrafo sobre Mitose."
+
+
+@patch('src.utils.llm_handler.ChatOpenAI')
+def test_response_cache_skips_repeated_prompts(MockChatOpenAI, tmp_path):
+    """
+    Testa se um prompt já respondido vem do cache (contabilizando os tokens
+    economizados) e se as tarefas desativadas sempre chamam a API.
+    """
+    MockChatOpenAI.return_value.side_effect = lambda prompt_value: AIMessage(
+        content=f"Resumo de: {prompt_value.to_string()[-12:]}",
+        usage_metadata={'input_tokens': 30, 'output_tokens': 10, 'total_tokens': 40},
+    )
+
+    with patch('config.settings.USE_LLM_RESPONSE_CACHE', True), \
+         patch('config.settings.LLM_RESPONSE_CACHE_PATH', tmp_path / "responses.sqlite"):
+        first = summary_generator.summarize_text("Texto sobre a célula.")
+        assert summary_generator.summarize_text("Texto sobre a célula.") == first
+        summary_generator.summarize_text("Texto sobre o átomo.")
+        assert MockChatOpenAI.return_value.call_count == 2
+        assert llm_handler.response_cache_stats() == {
+            'hits': 1, 'misses': 2, 'prompt_tokens_saved': 30, 'completion_tokens_saved': 10, 'tokens_saved': 40,
+        }
+
+        with patch('config.settings.LLM_CACHE_DISABLED_TASKS', ("Sumarização",)):
+            summary_generator.summarize_text("Texto sobre a célula.")
+        assert MockChatOpenAI.return_value.call_count == 3
+
+
+def test_response_cache_expires_and_evicts(tmp_path):
+    """Testa a expiração por TTL e o descarte das entradas usadas há mais tempo."""
+    cache = LLMResponseCache(tmp_path / "responses.sqlite", ttl_seconds=60, max_entries=2)
+    keys = [cache.make_key("modelo", 0.2, None, f"prompt {i}") for i in range(3)]
+    for key in keys:
+        cache.put(key, f"resposta {key[:6]}")
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == f"resposta {keys[2][:6]}"
+
+    with patch('src.utils.response_cache.time.time', return_value=time.time() + 61):
+        assert cache.get(keys[2]) is None
+
+
+@patch('src.utils.llm_handler.ChatOpenAI')
+def test_scheduler_retries_transient_errors_and_reports_metrics(MockChatOpenAI):
+    """
+    Testa se um 429 é repetido com backoff em vez de virar texto vazio, se as
+    métricas do modelo registram a nova tentativa e se um erro persistente é propagado.
+    """
+    MockChatOpenAI.return_value.side_effect = [
+        rate_limit_error(),
+        AIMessage(content="Resumo.", usage_metadata={'input_tokens': 5, 'output_tokens': 3, 'total_tokens': 8}),
+    ]
+
+    with patch('src.utils.llm_scheduler.time.sleep') as sleep:
+        assert summary_generator.summarize_text("Texto sobre a célula.") == "Resumo."
+    sleep.assert_called_once()
+    metrics = llm_handler.scheduler_metrics()["default"]
+    assert (metrics['requests'], metrics['retries'], metrics['failures']) == (1, 1, 0)
+    assert metrics['completion_tokens'] == 3
+
+    MockChatOpenAI.return_value.side_effect = rate_limit_error()
+    with patch.object(llm_handler.settings, 'LLM_MAX_RETRIES', 2), \
+         patch('src.utils.llm_scheduler.time.sleep'), \
+         pytest.raises(openai.RateLimitError):
+        llm_handler.reset_scheduler()
+        summary_generator.summarize_text("Outro texto.")
+    assert llm_handler.scheduler_metrics()["default"]['failures'] == 1
+
+
+def test_scheduler_admits_higher_priority_first_when_limited():
+    """Testa se, com os limites esgotados, a chamada mais prioritária é admitida antes."""
+    scheduler = LLMScheduler({}, (600, 1_000_000), max_retries=0)
+    scheduler._limiter("modelo").requests.tokens = 0
+    admitted = []
+
+    def request(priority):
+        scheduler.acquire("modelo", priority, tokens=1)
+        admitted.append(priority)
+
+    low = threading.Thread(target=request, args=(3,))
+    low.start()
+    time.sleep(0.02)
+    high = threading.Thread(target=request, args=(0,))
+    high.start()
+    low.join()
+    high.join()
+
+    assert admitted == [0, 3]
+
+
+def test_fake_provider_is_deterministic_and_follows_prompt_formats(tmp_path):
+    """Testa se o LLM falso devolve o mapa da estrutura esperado e respostas reproduzíveis com uso de tokens."""
+    markdown = "# Unidade 1\n" + "".join(f"## 1.{i} Seção {i}\nTexto.\n" for i in range(1, 6))
+    with patch.object(llm_handler.settings, 'LLM_PROVIDER', "fake"):
+        result = structure_mapper.generate_structure_map(markdown, tmp_path / "mapa.json")
+        first = summary_generator.summarize_text("Texto sobre mitose.")
+        second = summary_generator.summarize_text("Texto sobre mitose.")
+
+    assert result["Unidade 1"]["Capítulo 1"] == ["## 1.1 Seção 1", "## 1.2 Seção 2"]
+    assert sum(len(sections) for sections in result["Unidade 1"].values()) == 5
+    assert first and first == second
+    metrics = llm_handler.scheduler_metrics()
+    assert set(metrics) == {f"fake-{llm_handler.settings.LLM_MODEL_STRUCTURE}", f"fake-{llm_handler.settings.LLM_MODEL}"}
+    assert metrics[f"fake-{llm_handler.settings.LLM_MODEL}"]['completion_tokens'] > 0
+
+
+@patch('src.utils.llm_handler.ChatOpenAI')
+def test_fused_chapter_enrichment_uses_one_call_and_falls_back_per_field(MockChatOpenAI):
+    """
+    Testa se a chamada combinada fornece curiosidade, resumo e resumo do mapa de
+    uma vez e se só os campos inválidos são gerados pelas chamadas separadas.
+    """
+    responses = {
+        "Geração de Curiosidade": '{"curiosidade": "Curiosidade separada."}',
+        "Geração de Resumo do Capítulo": "Resumo separado.",
+        "Sumarização para Mapa Global": "Frase separada.",
+    }
+    calls = []
+
+    def fake_invoke(chain, params, task_name):
+        calls.append(task_name)
+        return responses[task_name]
+
+    with patch('src.transformation.summary_generator.invoke_llm_with_tracking', side_effect=fake_invoke), \
+         patch('src.transformation.content_generator.invoke_llm_with_tracking', side_effect=fake_invoke):
+        responses["Enriquecimento do Capítulo"] = '```json\n{"curiosidade": null, "resumo": "Resumo.", "resumo_mapa": "Frase."}\n```'
+        assert summary_generator.generate_chapter_enrichment("Capítulo.", None) == {
+            "curiosidade": None, "resumo": "Resumo.", "resumo_mapa": "Frase."
+        }
+        assert calls == ["Enriquecimento do Capítulo"]
+
+        calls.clear()
+        responses["Enriquecimento do Capítulo"] = '{"curiosidade": "Fato.", "resumo": "", "resumo_mapa": 3}'
+        result = summary_generator.generate_chapter_enrichment("Capítulo.", None)
+        assert result == {"curiosidade": "Fato.", "resumo": "Resumo separado.", "resumo_mapa": "Frase separada."}
+        assert calls == ["Enriquecimento do Capítulo", "Geração de Resumo do Capítulo", "Sumarização para Mapa Global"]
+
+        calls.clear()
+        responses["Enriquecimento do Capítulo"] = "Não consegui gerar o JSON."
+        result = summary_generator.generate_chapter_enrichment("Capítulo.", None)
+        assert result["curiosidade"] == "Curiosidade separada."
+        assert len(calls) == 4
+
+
+@patch('src.utils.llm_handler.ChatOpenAI')
+def test_single_shot_expansion_is_sized_by_word_deficit(MockChatOpenAI):
+    """Testa se a expansão única pede a meta e o déficit de palavras e se mantém o texto base quando a chamada falha."""
+    setup_llm_mock(MockChatOpenAI, "Seção reescrita e expandida.")
+    base_text = "Texto base com seis palavras aqui."
+
+    with patch('src.transformation.content_generator.invoke_llm_with_tracking', wraps=llm_handler.invoke_llm_with_tracking) as invoke:
+        assert content_generator.expand_section(base_text, 250.4, {"Capítulo 1": "Resumo."}) == "Seção reescrita e expandida."
+    params = invoke.call_args.args[1]
+    assert (params["target_words"], params["words_to_add"]) == (250, 244)
+    assert llm_handler.scheduler_task_metrics()["Expansão Única da Seção"]['requests'] == 1
+
+    with patch('src.transformation.content_generator.invoke_llm_with_tracking', return_value=""):
+        assert content_generator.expand_section(base_text, 250, {}) == base_text